@@ -38,7 +38,10 @@ def main(config_path):
 
     # Step 2: Speaker Diarization & German Transcription & Segmentation
     if config["steps"]["diarization"] or config["steps"]["segmentation"]:
-        diarize_and_segment_podcast(podcast_name, config["steps"]["diarization"], config["steps"]["segmentation"], copy_to_projects=True)
+        window_minutes = config["diarization_window_minutes"]
+        diarize_and_segment_podcast(podcast_name, config["steps"]["diarization"], config["steps"]["segmentation"], copy_to_projects=True,
+                                    use_vad=config["diarization_vad"], prescreen=config["prescreen_episodes"],
+                                    window_duration=window_minutes * 60 if window_minutes else None)
 
     # Step 3: Phoneme Transcription
     if config["steps"]["phon_transcription"]:
@@ -46,11 +49,12 @@ def main(config_path):
 
     # Step 4: Dialect Identification
     if config["steps"]["dialect_classification"]:
-        dialect_identification_naive_bayes_majority_voting(podcast_name)
+        dialect_identification_naive_bayes_majority_voting(podcast_name, config["did_speaker_index"])
 
     # Step 5: Swiss German Text Generation
     if config["steps"]["ch_transcription"]:
-        transcribe_de_to_ch(podcast_name, write_to_hdf5)
+        transcribe_de_to_ch(podcast_name, write_to_hdf5, planned_decoding=config["ch_planned_decoding"],
+                            backend=config["ch_transcription_backend"])
 
     # Step 6: Mel-Spectrogram Generation
     if config["steps"]["mel_spectrogram"]:
@@ -58,7 +62,8 @@ def main(config_path):
 
     # Step 7: Move podcast based h5 into central dialect h5
     if config["steps"]["move_into_dialect_h5"]:
-        move_podcast_to_dialect(podcast_name)
+        move_podcast_to_dialect(podcast_name, as_view=config["dialect_h5_as_view"],
+                                hierarchical=config["h5_hierarchical_keys"])
 
     logger.info("Finished")
 
@@ -0,0 +1,64 @@
+import argparse
+import os
+import time
+
+import pandas as pd
+
+from src.processing.dialect_writer import DIALECT_VIEW_PATH
+from src.transcription.utils import load_meta_data, DIALECT_DATA_PATH
+from src.utils.catalog import register_samples, hours_per_dialect_per_dataset, LOCATION_PODCAST, LOCATION_DIALECT, \
+    LOCATION_SUBSET
+from src.utils.logger import get_logger
+from src.utils.paths import PODCAST_AUDIO_FOLDER, TTS_TRAINING_SUBSETS_PATH
+
+logger = get_logger(__name__)
+
+
+def _register_folder(folder: str, location: str, load_as_dialect: bool) -> int:
+    if not os.path.isdir(folder):
+        logger.warning(f"Skipping {folder} as it does not exist.")
+        return 0
+
+    num_samples = 0
+    for metadata_file in sorted(file for file in os.listdir(folder) if file.endswith(".txt")):
+        h5_file = os.path.join(folder, metadata_file.replace(".txt", ".hdf5"))
+        if not os.path.exists(h5_file):
+            continue
+
+        meta_data, length = load_meta_data(os.path.join(folder, metadata_file), load_as_dialect=load_as_dialect)
+        register_samples(meta_data, h5_file, location, dataset_name=metadata_file.replace(".txt", ""))
+        num_samples += length
+    return num_samples
+
+
+def rebuild_catalog() -> None:
+    """
+    Fills the sample catalog from all metadata files, e.g. for the first use or after files were moved by hand. Regular
+    pipeline runs update the catalog incrementally.
+    """
+    num_samples = _register_folder(PODCAST_AUDIO_FOLDER, LOCATION_PODCAST, load_as_dialect=False)
+    num_samples += _register_folder(DIALECT_DATA_PATH, LOCATION_DIALECT, load_as_dialect=True)
+    num_samples += _register_folder(DIALECT_VIEW_PATH, LOCATION_DIALECT, load_as_dialect=True)
+    num_samples += _register_folder(TTS_TRAINING_SUBSETS_PATH, LOCATION_SUBSET, load_as_dialect=True)
+    logger.info(f"Registered {num_samples} samples in the catalog.")
+
+
+def dialect_hours_per_podcast(location: str = LOCATION_PODCAST) -> None:
+    start = time.perf_counter()
+    rows = hours_per_dialect_per_dataset(location)
+    logger.info(f"Queried catalog in {(time.perf_counter() - start) * 1000:.1f}ms.")
+
+    df = pd.DataFrame(rows, columns=["podcast", "dialect", "hours"])
+    df = df.pivot(index="podcast", columns="dialect", values="hours").fillna(0.0).round(4)
+    df.to_csv("dialect_durations_catalog.csv", sep=";", encoding="utf-8")
+    logger.info(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the catalog from all metadata files")
+    parser.add_argument("--location", type=str, default=LOCATION_PODCAST, help="podcast, dialect, subset or packed")
+    args = parser.parse_args()
+    if args.rebuild:
+        rebuild_catalog()
+    dialect_hours_per_podcast(args.location)
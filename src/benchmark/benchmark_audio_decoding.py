@@ -0,0 +1,92 @@
+import argparse
+import os
+import tempfile
+import time
+
+import librosa
+import numpy as np
+import soundfile as sf
+from pydub import AudioSegment
+
+from src.utils.audio import DecoderPool, decode_audio, get_audio_duration, SAMPLING_RATE
+from src.utils.logger import get_logger
+
+FIXTURE_EXTENSIONS = (".mp3", ".flac", ".wav", ".ogg")
+FIXTURE_SAMPLING_RATE = 44100
+FIXTURE_DURATION = 10.0
+
+logger = get_logger(__name__)
+
+
+def create_fixtures(folder: str, num_files: int, seed: int = 42) -> list[str]:
+    """
+    Writes stereo MP3 and FLAC files at 44.1kHz, the typical format of downloaded podcasts and corpora.
+    :return: Paths of the fixtures
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(num_files):
+        audio = 0.1 * rng.standard_normal((int(FIXTURE_DURATION * FIXTURE_SAMPLING_RATE), 2)).astype(np.float32)
+        path = os.path.join(folder, f"fixture_{i}.{'mp3' if i % 2 == 0 else 'flac'}")
+        sf.write(path, audio, FIXTURE_SAMPLING_RATE, format="MP3" if path.endswith(".mp3") else "FLAC")
+        paths.append(path)
+    return paths
+
+
+def legacy_decode(path: str, work_dir: str) -> np.ndarray:
+    """Mirrors the pydub export to WAV followed by librosa.load used by the importers before."""
+    wav_path = os.path.join(work_dir, os.path.basename(path) + ".wav")
+    AudioSegment.from_file(path).export(wav_path, format="wav")
+    speech, _ = librosa.load(wav_path, sr=SAMPLING_RATE)
+    os.remove(wav_path)
+    return speech
+
+
+def run_benchmark(fixtures: str | None = None, num_files: int = 32, num_workers: int | None = None,
+                  work_dir: str | None = None) -> dict:
+    """
+    Compares the legacy decode against the in-process decoder, serially and in the DecoderPool. Reports seconds of
+    audio decoded per second.
+    :param fixtures: Folder with MP3 / FLAC files, synthetic fixtures are created if not given
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        if fixtures:
+            paths = sorted(os.path.join(fixtures, file) for file in os.listdir(fixtures)
+                           if file.lower().endswith(FIXTURE_EXTENSIONS))
+        else:
+            paths = create_fixtures(tmp_dir, num_files)
+        audio_seconds = sum(get_audio_duration(path) for path in paths)
+
+        start = time.perf_counter()
+        for path in paths:
+            legacy_decode(path, tmp_dir)
+        results["legacy"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for path in paths:
+            decode_audio(path)
+        results["in_process"] = time.perf_counter() - start
+
+        with DecoderPool(num_workers) as pool:
+            start = time.perf_counter()
+            for _ in pool.imap(paths):
+                pass
+            results["pool"] = time.perf_counter() - start
+
+    for name, seconds in results.items():
+        logger.info(f"{name}: {seconds:.2f}s for {len(paths)} files, {audio_seconds / seconds:.0f} seconds of audio "
+                    f"per second")
+    logger.info(f"Speedup over legacy: in process {results['legacy'] / results['in_process']:.2f}x, "
+                f"pool {results['legacy'] / results['pool']:.2f}x")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", type=str, default=None, help="Folder with local MP3 / FLAC fixtures")
+    parser.add_argument("--num_files", type=int, default=32, help="Number of synthetic fixtures if none are given")
+    parser.add_argument("--num_workers", type=int, default=None, help="Workers of the decoder pool")
+    parser.add_argument("--work_dir", type=str, default=None, help="Directory for temporary files")
+    args = parser.parse_args()
+    run_benchmark(args.fixtures, args.num_files, args.num_workers, args.work_dir)
@@ -0,0 +1,54 @@
+import argparse
+import time
+
+from src.benchmark.benchmark_decoding_planner import load_held_out_prompts
+from src.transcription.cpu_backend import BACKEND_CPU_INT8, BACKEND_GPU, CPU_BATCH_SIZE, report_quality_drift, \
+    setup_cpu_threads
+from src.transcription.decoding_planner import DecodingPlanner
+from src.transcription.transcribe_to_swiss_german import setup_ch_de_model
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def load_fixture_prompts(fixtures: str) -> list[str]:
+    """Fixture file with one '[ch_xx]: German text' prompt per line."""
+    with open(fixtures, "rt", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def run_benchmark(fixtures: str | None = None, podcast: str | None = None, num_samples: int = 256) -> dict:
+    """
+    Translates the fixture prompts on the CPU with the float model and the int8 model. Reports the speedup and the
+    quality drift (exact match, chrF) of the int8 model against the float model.
+    :param fixtures: Prompt fixture file, a held-out sample of podcast is used if not given
+    """
+    assert fixtures or podcast, "Either a fixture file or a podcast is required"
+    prompts = load_fixture_prompts(fixtures) if fixtures else load_held_out_prompts(podcast, num_samples)
+
+    # both models run with the same thread budget, setup_ch_de_model would only set it for the int8 model
+    setup_cpu_threads()
+    results = {}
+    translations = {}
+    for backend in (BACKEND_GPU, BACKEND_CPU_INT8):
+        tokenizer, model = setup_ch_de_model("cpu", backend)
+        planner = DecodingPlanner(tokenizer, model, "cpu", CPU_BATCH_SIZE)
+        start = time.perf_counter()
+        translations[backend] = planner.translate(prompts)
+        results[f"{backend}_seconds"] = time.perf_counter() - start
+        planner.log_stats()
+
+    results["speedup"] = results[f"{BACKEND_GPU}_seconds"] / results[f"{BACKEND_CPU_INT8}_seconds"]
+    logger.info(f"{len(prompts)} prompts on the CPU: float {results[f'{BACKEND_GPU}_seconds']:.1f}s, int8 "
+                f"{results[f'{BACKEND_CPU_INT8}_seconds']:.1f}s, speedup {results['speedup']:.2f}x")
+    results.update(report_quality_drift(translations[BACKEND_GPU], translations[BACKEND_CPU_INT8], BACKEND_CPU_INT8))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", type=str, default=None, help="File with one prompt per line")
+    parser.add_argument("--podcast", type=str, default=None, help="Podcast to draw a held-out sample from instead")
+    parser.add_argument("--num_samples", type=int, default=256, help="Size of the held-out sample")
+    args = parser.parse_args()
+    run_benchmark(args.fixtures, args.podcast, args.num_samples)
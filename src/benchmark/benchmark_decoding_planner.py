@@ -0,0 +1,75 @@
+import argparse
+import random
+import time
+from difflib import SequenceMatcher
+
+from src.transcription.decoding_planner import DecodingPlanner
+from src.transcription.transcribe_to_swiss_german import BATCH_SIZE, get_ch_de_prompt, setup_ch_de_model, \
+    translate_ch_de_prompts
+from src.transcription.utils import MISSING_TEXT, load_meta_data, get_metadata_path, setup_gpu_device
+from src.utils.logger import get_logger
+
+HELD_OUT_SEED = 42
+
+logger = get_logger(__name__)
+
+
+def load_held_out_prompts(podcast: str, num_samples: int, seed: int = HELD_OUT_SEED) -> list[str]:
+    meta_data, _ = load_meta_data(get_metadata_path(podcast))
+    candidates = [sample for sample in meta_data
+                  if sample.dialect and sample.dialect != "Deutschland" and sample.de_text not in ["", MISSING_TEXT]]
+    samples = random.Random(seed).sample(candidates, min(num_samples, len(candidates)))
+    return [get_ch_de_prompt(sample) for sample in samples]
+
+
+def run_benchmark(podcast: str, num_samples: int = 512) -> dict:
+    """
+    Translates a held-out sample of a podcast with the fixed 5 beam / 400 token decoding and the decoding planner.
+    Reports tokens/s of both and how often the planner output equals the current output.
+    """
+    prompts = load_held_out_prompts(podcast, num_samples)
+    device, _ = setup_gpu_device()
+    tokenizer, model = setup_ch_de_model(device)
+
+    def count_tokens(texts: list[str]) -> int:
+        return sum(len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"])
+
+    # warm up kernels and allocator before timing
+    translate_ch_de_prompts(prompts[:BATCH_SIZE], tokenizer, model, device)
+
+    start = time.perf_counter()
+    legacy = []
+    for batch_start in range(0, len(prompts), BATCH_SIZE):
+        legacy += translate_ch_de_prompts(prompts[batch_start:batch_start + BATCH_SIZE], tokenizer, model, device)
+    legacy_time = time.perf_counter() - start
+
+    planner = DecodingPlanner(tokenizer, model, device, BATCH_SIZE)
+    start = time.perf_counter()
+    planned = planner.translate(prompts)
+    planned_time = time.perf_counter() - start
+
+    results = {
+        "legacy_tokens_per_second": count_tokens(legacy) / legacy_time,
+        "planned_tokens_per_second": count_tokens(planned) / planned_time,
+        "speedup": legacy_time / planned_time,
+        "exact_match": sum(a == b for a, b in zip(legacy, planned)) / len(prompts),
+        "char_similarity": sum(SequenceMatcher(None, a, b).ratio() for a, b in zip(legacy, planned)) / len(prompts),
+    }
+    logger.info(f"{len(prompts)} held-out samples of {podcast}: legacy {legacy_time:.1f}s "
+                f"({results['legacy_tokens_per_second']:.0f} tokens/s), planned {planned_time:.1f}s "
+                f"({results['planned_tokens_per_second']:.0f} tokens/s), speedup {results['speedup']:.2f}x")
+    logger.info(f"Equivalence to the current output: {results['exact_match']:.1%} exact matches, "
+                f"{results['char_similarity']:.3f} mean character similarity")
+
+    for prompt, a, b in zip(prompts, legacy, planned):
+        if a != b:
+            logger.debug(f"{prompt}\n  legacy:  {a}\n  planned: {b}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--podcast", type=str, required=True, help="Podcast with German transcripts and dialects")
+    parser.add_argument("--num_samples", type=int, default=512, help="Size of the held-out sample")
+    args = parser.parse_args()
+    run_benchmark(args.podcast, args.num_samples)
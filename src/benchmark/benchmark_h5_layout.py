@@ -0,0 +1,110 @@
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from src.utils.h5_layout import LAYOUT_ATTR, contains_sample, get_sample_key, open_h5, resolve_sample
+from src.utils.logger import get_logger
+
+SAMPLES_PER_EPISODE = 200
+NUM_DATASETS = 50
+SAMPLE_LENGTH = 16  # the benchmark measures metadata, audio is kept tiny so 1M objects fit on any disk
+
+logger = get_logger(__name__)
+
+
+def _synthetic_names(num_samples: int) -> list[tuple[str, str]]:
+    """
+    :return: Pairs of (dataset name, sample name) with sample names following <episode>_<1000+i>
+    """
+    names = []
+    for i in range(num_samples):
+        episode, cut = divmod(i, SAMPLES_PER_EPISODE)
+        names.append((f"podcast{episode % NUM_DATASETS}", f"ep{episode:07d}_{1000 + cut}"))
+    return names
+
+
+def create_file(path: str, names: list[tuple[str, str]], hierarchical: bool) -> float:
+    data = np.zeros(SAMPLE_LENGTH, dtype=float)
+    start = time.perf_counter()
+    if hierarchical:
+        with open_h5(path, "w", hierarchical=True) as h5:
+            for dataset_name, sample_name in names:
+                h5.create_dataset(get_sample_key(h5, sample_name, dataset_name, create_groups=True), data=data)
+    else:
+        # the current layout, all samples under the root group in the oldest compatible file format
+        with h5py.File(path, "w") as h5:
+            for _, sample_name in names:
+                h5.create_dataset(sample_name, data=data)
+    return time.perf_counter() - start
+
+
+def time_lookups(path: str, names: list[tuple[str, str]], num_lookups: int, with_dataset_name: bool = True,
+                 seed: int = 42) -> tuple[float, float]:
+    """
+    :return: Seconds for membership checks of existing and of missing samples and for reading the resolved samples
+    """
+    rng = np.random.default_rng(seed)
+    picks = [names[i] for i in rng.integers(0, len(names), num_lookups)]
+
+    with h5py.File(path, "r") as h5:
+        start = time.perf_counter()
+        for dataset_name, sample_name in picks:
+            assert contains_sample(h5, sample_name, dataset_name if with_dataset_name else "")
+            assert not contains_sample(h5, sample_name + "0", dataset_name if with_dataset_name else "")
+        lookup_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for dataset_name, sample_name in picks:
+            resolve_sample(h5, sample_name, dataset_name if with_dataset_name else "")[()]
+        read_seconds = time.perf_counter() - start
+
+    return lookup_seconds, read_seconds
+
+
+def run_benchmark(num_samples: int = 1_000_000, num_lookups: int = 100_000, work_dir: str | None = None) -> dict:
+    """
+    Compares the flat key layout in the default file format against the hierarchical layout in the latest file
+    format on files with num_samples objects: creation time, file size, time to open and random lookups.
+    """
+    names = _synthetic_names(num_samples)
+    results = {}
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        for layout, hierarchical in [("flat", False), ("hierarchical", True)]:
+            path = os.path.join(tmp_dir, f"{layout}.hdf5")
+            create_seconds = create_file(path, names, hierarchical)
+
+            start = time.perf_counter()
+            with h5py.File(path, "r") as h5:
+                h5.attrs.get(LAYOUT_ATTR)
+            open_seconds = time.perf_counter() - start
+
+            lookup_seconds, read_seconds = time_lookups(path, names, num_lookups)
+            results[layout] = {
+                "create_s": create_seconds,
+                "size_mb": os.path.getsize(path) / 1024 ** 2,
+                "open_s": open_seconds,
+                "lookup_s": lookup_seconds,
+                "read_s": read_seconds,
+            }
+            if hierarchical:
+                results[layout]["lookup_without_dataset_s"] = time_lookups(path, names, num_lookups, False)[0]
+
+    for layout, result in results.items():
+        logger.info(f"{layout}: " + ", ".join(f"{name}={value:.2f}" for name, value in result.items()))
+    logger.info(f"Speedup of lookups: {results['flat']['lookup_s'] / results['hierarchical']['lookup_s']:.2f}x, "
+                f"of creation: {results['flat']['create_s'] / results['hierarchical']['create_s']:.2f}x")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_samples", type=int, default=1_000_000, help="Number of synthetic samples per file")
+    parser.add_argument("--num_lookups", type=int, default=100_000, help="Random membership checks and reads")
+    parser.add_argument("--work_dir", type=str, default=None, help="Directory for temporary hdf5 files")
+    args = parser.parse_args()
+    run_benchmark(args.num_samples, args.num_lookups, args.work_dir)
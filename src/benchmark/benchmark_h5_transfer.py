@@ -0,0 +1,101 @@
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from src.processing.h5_transfer import transfer_samples
+from src.utils.logger import get_logger
+
+SAMPLING_RATE = 16000
+MIN_SAMPLE_DURATION = 2.0
+MAX_SAMPLE_DURATION = 15.0
+
+logger = get_logger(__name__)
+
+
+def create_synthetic_h5(h5_path: str, num_samples: int, seed: int = 42) -> list[str]:
+    """
+    Creates an hdf5 looking like a segmented podcast: float samples of 2-15s with the attributes set by the pipeline.
+    :return: Keys of the created samples
+    """
+    rng = np.random.default_rng(seed)
+    keys = []
+    with h5py.File(h5_path, "w") as h5:
+        for i in range(num_samples):
+            key = f"episode_{1000 + i}"
+            length = int(rng.uniform(MIN_SAMPLE_DURATION, MAX_SAMPLE_DURATION) * SAMPLING_RATE)
+            h5_entry = h5.create_dataset(key, dtype=float, data=rng.standard_normal(length))
+            h5_entry.attrs["dataset_name"] = "synthetic"
+            h5_entry.attrs["speaker"] = f"SPEAKER_{i % 10:02d}"
+            h5_entry.attrs["duration"] = length / SAMPLING_RATE
+            h5_entry.attrs["de_text"] = "Das isch en Test."
+            h5_entry.attrs["phoneme"] = "d a s ɪ ʃ ə n t ɛ s t"
+            keys.append(key)
+    return keys
+
+
+def legacy_copy(source_path: str, target_path: str, keys: list[str]) -> None:
+    """Mirrors the per sample decode / create / attribute loop used before the bulk transfer."""
+    with h5py.File(source_path, "r") as h5_source, h5py.File(target_path, "a") as h5_target:
+        for key in keys:
+            if key in h5_target:
+                continue
+            h5_content = h5_source[key]
+            new_h5_entry = h5_target.create_dataset(key, dtype=float, data=h5_content[()])
+            for attr_name, attr_value in h5_content.attrs.items():
+                new_h5_entry.attrs[attr_name] = attr_value
+            h5_target.flush()
+
+
+def bulk_copy(source_path: str, target_path: str, keys: list[str], compression: str | None = None) -> None:
+    with h5py.File(source_path, "r") as h5_source, h5py.File(target_path, "a") as h5_target:
+        transfer_samples(h5_source, h5_target, [(key, key) for key in keys], compression=compression)
+
+
+def _time_copy(copy_fn, source_path: str, target_path: str, keys: list[str], repeats: int, **kwargs) -> float:
+    timings = []
+    for _ in range(repeats):
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        start = time.perf_counter()
+        copy_fn(source_path, target_path, keys, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmark(num_samples: int = 2000, repeats: int = 3, work_dir: str | None = None) -> dict:
+    """
+    Compares the throughput of the old per sample copy loop against the bulk HDF5 object copy and against the
+    chunk-wise fallback (triggered by requesting gzip compression in the target).
+    """
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        source_path = os.path.join(tmp_dir, "source.hdf5")
+        target_path = os.path.join(tmp_dir, "target.hdf5")
+        keys = create_synthetic_h5(source_path, num_samples)
+
+        with h5py.File(source_path, "r") as h5:
+            total_bytes = sum(h5[key].nbytes for key in keys)
+        total_mb = total_bytes / (1024 ** 2)
+
+        results = {
+            "legacy": _time_copy(legacy_copy, source_path, target_path, keys, repeats),
+            "object_copy": _time_copy(bulk_copy, source_path, target_path, keys, repeats),
+            "chunked_fallback": _time_copy(bulk_copy, source_path, target_path, keys, repeats, compression="gzip"),
+        }
+
+    for name, seconds in results.items():
+        logger.info(f"{name}: {seconds:.2f}s, {num_samples / seconds:.1f} samples/s, {total_mb / seconds:.1f} MB/s")
+    logger.info(f"Speedup of object copy over legacy loop: {results['legacy'] / results['object_copy']:.2f}x")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_samples", type=int, default=2000, help="Number of synthetic samples to copy")
+    parser.add_argument("--repeats", type=int, default=3, help="Repetitions per method, the fastest run is reported")
+    parser.add_argument("--work_dir", type=str, default=None, help="Directory for temporary hdf5 files")
+    args = parser.parse_args()
+    run_benchmark(args.num_samples, args.repeats, args.work_dir)
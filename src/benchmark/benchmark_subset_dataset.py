@@ -0,0 +1,103 @@
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+from torch.utils.data import DataLoader
+
+from src.processing.packed_subsets import convert_subset_to_packed, get_packed_subset_file
+from src.training.subset_dataset import (SubsetDataset, SubsetIterableDataset, DurationBatchSampler,
+                                         collate_subset_batch)
+from src.utils import catalog
+from src.utils.data_points import DialectDataPoint
+from src.utils.logger import get_logger
+
+SAMPLING_RATE = 16000
+MIN_SAMPLE_DURATION = 2.0
+MAX_SAMPLE_DURATION = 15.0
+DIALECTS = ["Zürich", "Bern", "Basel", "Wallis", "Graubünden", "Ostschweiz", "Innerschweiz"]
+
+logger = get_logger(__name__)
+
+
+def create_synthetic_subset(folder: str, idx: int, num_samples: int, seed: int = 42) -> str:
+    """
+    Creates subset_{idx}.hdf5 and subset_{idx}.txt as written by move_to_subsets, float samples of 2-15s.
+    :return: Path to the subset hdf5
+    """
+    rng = np.random.default_rng((seed, idx))
+    h5_path = os.path.join(folder, f"subset_{idx}.hdf5")
+    meta_data = []
+    with h5py.File(h5_path, "w") as h5:
+        for i in range(num_samples):
+            key = f"episode{idx}_{1000 + i}"
+            length = int(rng.uniform(MIN_SAMPLE_DURATION, MAX_SAMPLE_DURATION) * SAMPLING_RATE)
+            h5_entry = h5.create_dataset(key, dtype=float, data=rng.standard_normal(length))
+            h5_entry.attrs["phoneme"] = "d a s ɪ ʃ ə n t ɛ s t"
+            meta_data.append(DialectDataPoint("synthetic", key, length / SAMPLING_RATE, f"SPEAKER_{i % 10:02d}",
+                                              DIALECTS[i % len(DIALECTS)], "Das isch en Test."))
+
+    with open(h5_path.replace(".hdf5", ".txt"), "wt", encoding="utf-8") as f:
+        f.writelines(sample.to_string() for sample in meta_data)
+    return h5_path
+
+
+def _time_loader(loader: DataLoader, max_batches: int) -> tuple[float, float]:
+    audio_seconds = 0.0
+    start = time.perf_counter()
+    for i, batch in enumerate(loader):
+        audio_seconds += float(batch["duration"].sum())
+        if i + 1 >= max_batches:
+            break
+    return audio_seconds, time.perf_counter() - start
+
+
+def run_benchmark(num_subsets: int = 4, samples_per_subset: int = 1000, max_batch_seconds: float = 120.0,
+                  batch_size: int = 16, num_workers: int = 4, max_batches: int = 200,
+                  work_dir: str | None = None) -> dict:
+    """
+    Measures the reading throughput in seconds of audio per second for the map-style dataset with the duration batch
+    sampler and for the iterable dataset, on per clip subsets and on packed shards.
+    """
+    catalog.CATALOG_ENABLED = False  # synthetic files must not end up in the sample catalog
+
+    results = {}
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        subset_paths = [create_synthetic_subset(tmp_dir, idx, samples_per_subset) for idx in range(num_subsets)]
+        packed_paths = []
+        for idx, path in enumerate(subset_paths):
+            packed_paths.append(get_packed_subset_file(idx, tmp_dir))
+            convert_subset_to_packed(path, path.replace(".hdf5", ".txt"), packed_paths[-1])
+
+        for layout, paths in [("per_clip", subset_paths), ("packed", packed_paths)]:
+            dataset = SubsetDataset(paths, with_phoneme=True)
+            sampler = DurationBatchSampler(dataset, max_batch_seconds)
+            loader = DataLoader(dataset, batch_sampler=sampler, num_workers=num_workers,
+                                collate_fn=collate_subset_batch)
+            results[f"{layout}_map"] = _time_loader(loader, max_batches)
+
+            iterable = SubsetIterableDataset(paths, with_phoneme=True)
+            loader = DataLoader(iterable, batch_size=batch_size, num_workers=num_workers,
+                                collate_fn=collate_subset_batch)
+            results[f"{layout}_iterable"] = _time_loader(loader, max_batches)
+
+    for name, (audio_seconds, seconds) in results.items():
+        logger.info(f"{name}: {audio_seconds / 3600:.2f}h of audio in {seconds:.2f}s, "
+                    f"{audio_seconds / seconds:.0f} seconds of audio per second")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_subsets", type=int, default=4, help="Number of synthetic subsets")
+    parser.add_argument("--samples_per_subset", type=int, default=1000, help="Samples per synthetic subset")
+    parser.add_argument("--max_batch_seconds", type=float, default=120.0, help="Audio seconds per sampler batch")
+    parser.add_argument("--batch_size", type=int, default=16, help="Batch size of the iterable dataset")
+    parser.add_argument("--num_workers", type=int, default=4, help="DataLoader workers")
+    parser.add_argument("--max_batches", type=int, default=200, help="Batches read per configuration")
+    parser.add_argument("--work_dir", type=str, default=None, help="Directory for temporary hdf5 files")
+    args = parser.parse_args()
+    run_benchmark(args.num_subsets, args.samples_per_subset, args.max_batch_seconds, args.batch_size,
+                  args.num_workers, args.max_batches, args.work_dir)
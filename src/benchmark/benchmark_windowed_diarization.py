@@ -0,0 +1,51 @@
+import argparse
+import multiprocessing
+import time
+
+from src.download.utils import get_podcast_path
+from src.segmentation.filter_strategies import filter_segments_using_strats
+from src.segmentation.segmentation import diarize_episode_segments, get_episode_path, log_peak_memory
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _run_mode(episode_path: str, window_duration: float | None) -> dict:
+    start = time.perf_counter()
+    segments, _, duration = diarize_episode_segments(episode_path, window_duration=window_duration)
+    mode = f"windows of {window_duration / 60:.0f} min" if window_duration else "full episode"
+    result = log_peak_memory(f"Diarization of {duration / 60:.0f} min with {mode}")
+    result["seconds"] = time.perf_counter() - start
+    result["segments"] = len(segments)
+    result["filtered_segments"] = len(filter_segments_using_strats(segments))
+    result["speakers"] = len({word["speaker"] for segment in segments for word in segment.get("words", [])
+                              if "speaker" in word})
+    return result
+
+
+def run_benchmark(podcast: str, episode_id: str, window_minutes: float = 30.0) -> dict:
+    """
+    Diarizes an episode once in full and once in windows, each in a fresh process so the peak resident memory and peak
+    GPU memory are those of the mode alone. Nothing is written to the diarization of the episode.
+    """
+    episode_path = get_episode_path(get_podcast_path(podcast), episode_id)
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for mode, window_duration in (("full", None), ("windowed", window_minutes * 60)):
+        with context.Pool(1) as pool:
+            results[mode] = pool.apply(_run_mode, (episode_path, window_duration))
+
+    for mode, result in results.items():
+        logger.info(f"{mode}: peak RSS {result['peak_rss_mib']:.0f} MiB, peak GPU {result['peak_gpu_mib']:.0f} MiB, "
+                    f"{result['seconds']:.0f}s, {result['segments']} segments ({result['filtered_segments']} after "
+                    f"filtering), {result['speakers']} speakers")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--podcast", type=str, required=True)
+    parser.add_argument("--episode_id", type=str, required=True)
+    parser.add_argument("--window_minutes", type=float, default=30.0, help="Window length of the windowed mode")
+    args = parser.parse_args()
+    run_benchmark(args.podcast, args.episode_id, args.window_minutes)
@@ -3,14 +3,14 @@ import os
 import random
 
 import h5py
-import librosa
 import pandas as pd
 from datasets import load_dataset
-from pydub import AudioSegment
-from transformers import Wav2Vec2Processor, Wav2Vec2ForCTC, pipeline
 
-from src.transcription.transcribe_to_phoneme import MODEL_AUDIO_PHONEME
-from src.transcription.utils import setup_gpu_device
+from src.transcription.batch_executor import BatchExecutor
+from src.transcription.phoneme_engine import PhonemeEngine
+from src.transcription.transcribe_to_phoneme import ENGINE_DECODING, MODEL_AUDIO_PHONEME
+from src.utils.audio import DecoderPool, get_audio_duration
+from src.utils.inference_cache import InferenceCache, get_model_key
 from src.utils.logger import get_logger
 
 SAMPLING_RATE = 16000
@@ -177,31 +177,29 @@ def create_dataset_of_30_hours(language: str, split: str):
     h5_file = _load_h5(dataset_name, language)
     json_data = []
 
-    for index, row in df_set.iterrows():
-        clip_path = os.path.join(audio_path, row['path'])
-        clip_path_wav = clip_path.replace(".mp3", ".wav")
-
-        entry = {"corpus_name": "CommonVoice",
-                 "dataset_name": dataset_name,
-                 "sample_name": row["path"].replace(".mp3", ""),
-                 "class_name": language,
-                 "class_nr": class_instance[language],
-                 "speaker_id": row["client_id"],
-                 "text": row["sentence"],
-                 "phonemes": "",
-                 "gender": row["gender"],
-                 "age": row["age"],
-                 "accents": row["accents"]
-                 }
-
-        sound = AudioSegment.from_mp3(clip_path)
-        sound.export(clip_path_wav, format="wav")  # write segment to os
-        speech, _ = librosa.load(clip_path_wav, sr=SAMPLING_RATE)
-
-        _ = h5_file.create_dataset(entry["sample_name"], dtype=float, data=speech)
-        h5_file.flush()
-        json_data.append(entry)
-        os.remove(clip_path_wav)  # keep disk space clean
+    clip_paths = [os.path.join(audio_path, path) for path in df_set["path"]]
+    with DecoderPool() as pool:
+        decoded = pool.imap(clip_paths)
+        for (index, row), (_, speech) in zip(df_set.iterrows(), decoded):
+            if speech is None:
+                continue
+
+            entry = {"corpus_name": "CommonVoice",
+                     "dataset_name": dataset_name,
+                     "sample_name": row["path"].replace(".mp3", ""),
+                     "class_name": language,
+                     "class_nr": class_instance[language],
+                     "speaker_id": row["client_id"],
+                     "text": row["sentence"],
+                     "phonemes": "",
+                     "gender": row["gender"],
+                     "age": row["age"],
+                     "accents": row["accents"]
+                     }
+
+            _ = h5_file.create_dataset(entry["sample_name"], dtype=float, data=speech)
+            h5_file.flush()
+            json_data.append(entry)
 
     # Open the file in write mode
     with open(get_jsonl_path(split, language), "w", encoding="utf-8") as f:
@@ -221,40 +219,33 @@ def cv_audio_to_phoneme(split: str, language: str) -> None:
         meta_data = [json.loads(line) for line in f]
 
     num_samples = len(meta_data)
-    device, torch_dtype = setup_gpu_device()
-
-    processor = Wav2Vec2Processor.from_pretrained(MODEL_AUDIO_PHONEME)
-    model = Wav2Vec2ForCTC.from_pretrained(MODEL_AUDIO_PHONEME)
-
-    pipe = pipeline(
-        "automatic-speech-recognition",
-        model=model,
-        tokenizer=processor.tokenizer,
-        feature_extractor=processor.feature_extractor,
-        torch_dtype=torch_dtype,
-        device=device,
-    )
+    engine = PhonemeEngine(MODEL_AUDIO_PHONEME, BATCH_SIZE)
 
+    cache = InferenceCache(get_model_key(MODEL_AUDIO_PHONEME, decoding=ENGINE_DECODING))
+    executor = BatchExecutor("cv_phoneme", os.path.join(datapath, f"{split}_{language}_quarantine.jsonl"))
     try:
-        with h5py.File(get_h5_path(split, language), "r+") as h5:
+        with h5py.File(get_h5_path(split, language), "r+") as h5, cache:
+            def infer(entries: list[dict]) -> list[dict]:
+                return cache.run([h5[entry["sample_name"]][:] for entry in entries], engine.transcribe)
+
             for start_idx in range(0, num_samples, BATCH_SIZE):
                 end_idx = min(start_idx + BATCH_SIZE, num_samples)
-                # Load batch of audio data
-                audio_batch = [h5[meta_data[i]["sample_name"]][:] for i in range(start_idx, end_idx)]
-
-                results = pipe(audio_batch, batch_size=BATCH_SIZE)
+                # a failing sample is isolated and quarantined, the rest of the batch and the run continue
+                results = executor.run(meta_data[start_idx:end_idx], infer, get_name=lambda entry: entry["sample_name"])
                 # Save results
                 for idx, result in enumerate(results):
+                    if result is None:
+                        continue
                     phoneme = result["text"].strip()
                     meta_data[start_idx + idx]["phonemes"] = phoneme
                     logger.info(f"NAME: {meta_data[start_idx + idx]['sample_name']}, PHON: {phoneme}")
 
-    except Exception as e:
-        logger.error(f"ERROR: {type(e).__name__} with error {str(e)}")
-
-    with open(os.path.join(datapath, f"{split}_{language}_enriched.jsonl"), "wt", encoding="utf-8") as f:
-        for entry in meta_data:
-            f.write(json.dumps(entry) + "\n")
+    finally:
+        cache.log_stats()
+        executor.log_stats()
+        with open(os.path.join(datapath, f"{split}_{language}_enriched.jsonl"), "wt", encoding="utf-8") as f:
+            for entry in meta_data:
+                f.write(json.dumps(entry) + "\n")
 
 
 def filter_common_voice(language: str, split: str):
@@ -277,7 +268,7 @@ def filter_common_voice(language: str, split: str):
         selected = []
         total_duration = 0.0
         for sample in samples:
-            duration = librosa.get_duration(path=sample["audio"]["path"])
+            duration = get_audio_duration(sample["audio"]["path"])
             if total_duration + duration > target_duration:
                 break
             selected.append({
@@ -308,11 +299,11 @@ def filter_common_voice(language: str, split: str):
 
     h5_file = f"{split}_{language}.hdf5"
     json_data = []
-    with h5py.File(h5_file, "a" if os.path.exists(h5_file) else "w") as h5:
-        for i, sample in merged_df.iterrow():
-            # Save as .wav (resampled)
-            clip_path = os.path.join(sample["path"])
-            clip_path_wav = clip_path.replace(".mp3", ".wav")
+    with h5py.File(h5_file, "a" if os.path.exists(h5_file) else "w") as h5, DecoderPool() as pool:
+        decoded = pool.imap(merged_df["path"].tolist())
+        for (i, sample), (_, speech) in zip(merged_df.iterrows(), decoded):
+            if speech is None:
+                continue
 
             entry = {"corpus_name": "CommonVoice",
                      "dataset_name": split,
@@ -329,14 +320,10 @@ def filter_common_voice(language: str, split: str):
                      "accent": sample["accent"]
                      }
 
-            sound = AudioSegment.from_mp3(clip_path)
-            sound.export(clip_path_wav, format="wav")  # write segment to os
-            speech, _ = librosa.load(clip_path_wav, sr=SAMPLING_RATE)
             _ = h5.create_dataset(entry["sample_name"], dtype=float, data=speech)
             h5.flush()
 
             json_data.append(entry)
-            os.remove(clip_path_wav)  # keep disk space clean
 
             # Open the file in write mode
     with open(f"cv_{language}_{split}.jsonl", "w", encoding="utf-8") as f:
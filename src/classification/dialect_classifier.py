@@ -3,6 +3,7 @@ from collections import Counter, defaultdict
 
 from joblib import load
 
+from src.classification.speaker_index import SpeakerIndex
 from src.transcription.utils import load_meta_data, get_metadata_path, write_meta_data
 from src.utils.logger import get_logger
 from src.utils.paths import MODEL_PATH
@@ -51,7 +52,11 @@ def assign_samples_to_speaker(meta_data: list, max_length: float = 30.0) -> dict
     return speaker_to_episodes
 
 
-def dialect_identification_naive_bayes_majority_voting(podcast: str) -> None:
+def dialect_identification_naive_bayes_majority_voting(podcast: str, use_speaker_index: bool = False) -> None:
+    """
+    :param use_speaker_index: Link speakers across episodes by their voice and reuse the pooled DID decision of a
+    recurring speaker instead of classifying them again in every episode
+    """
     logger.info("Run Dialect Identification based on phonemes with Majority Voting of 100s samples")
     meta_data, _ = load_meta_data(get_metadata_path(podcast))
     speaker_merged_phoneme = assign_samples_to_speaker(meta_data, max_length=100.0)
@@ -59,14 +64,31 @@ def dialect_identification_naive_bayes_majority_voting(podcast: str) -> None:
     text_clf = load(MODEL_PATH_DID)
     text_clf["clf"].set_params(n_jobs=BATCH_SIZE)
 
+    index = None
+    if use_speaker_index:
+        index = SpeakerIndex.load(podcast, num_classes=len(PHON_DID_CLS))
+        index.embed_missing_speakers({(episode, speaker): [s for group in groups for s in group.samples]
+                                      for episode, segments in speaker_merged_phoneme.items()
+                                      for speaker, groups in segments.items()})
+        index.cluster()
+    num_texts = 0
+
     # since Python 3.7 dicts are OrderPreserving, as such OK
     for episode, segments in speaker_merged_phoneme.items():
         for speaker, samples in segments.items():
             texts = merge_phoneme_of_speaker_samples(samples)
+            num_texts += len(texts)
+
+            reused = index.get_decision(episode, speaker) if index is not None else None
+            if reused is not None:
+                index.record_reuse(len(texts))
+                most_common = reused
+            else:
+                predicted = text_clf.predict(texts)
+                if index is not None:
+                    index.add_votes(episode, speaker, predicted)
+                most_common = Counter(predicted).most_common(1)[0][0]  # Get the most common prediction
 
-            predicted = text_clf.predict(texts)
-
-            most_common = Counter(predicted).most_common(1)[0][0]  # Get the most common prediction
             string_most_common = PHON_DID_CLS[most_common]
             logger.info(f"Most common prediction for {speaker}: {most_common}, which is {string_most_common}")
 
@@ -77,3 +99,6 @@ def dialect_identification_naive_bayes_majority_voting(podcast: str) -> None:
                     logger.info(f"NAME: {sample.sample_name}, DID: {string_most_common}")
 
     write_meta_data(podcast, meta_data)
+    if index is not None:
+        index.save()
+        index.log_stats(num_texts)
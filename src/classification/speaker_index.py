@@ -0,0 +1,168 @@
+import os
+
+import h5py
+import numpy as np
+
+from src.segmentation.speaker_embeddings import SpeakerEmbedder, cosine_similarity
+from src.transcription.utils import get_h5_file, setup_gpu_device
+from src.utils.h5_layout import resolve_sample
+from src.utils.logger import get_logger
+from src.utils.paths import PODCAST_AUDIO_FOLDER
+
+MIN_EMBEDDING_DURATION = 5.0  # seconds of speech a diarized speaker needs to be indexed
+MAX_EMBEDDING_DURATION = 60.0  # seconds of the longest samples of a speaker which are embedded
+# stricter than SPEAKER_MATCH_THRESHOLD of the window stitching, a wrong link hands a dialect to another speaker
+LINK_THRESHOLD = 0.7
+MIN_REUSE_VOTES = 5  # DID votes of a cluster before its decision is reused, one vote per merged 100s text
+MIN_REUSE_SHARE = 0.8  # share of the votes of a cluster for its majority class
+
+logger = get_logger(__name__)
+
+
+def get_speaker_index_path(podcast: str) -> str:
+    return os.path.join(PODCAST_AUDIO_FOLDER, f"{podcast}_speaker_index.npz")
+
+
+class SpeakerIndex:
+    """
+    Voice embeddings of the diarized speakers (episode, speaker_id) of a podcast, persisted next to the podcast hdf5.
+    Speakers are clustered across episodes so recurring hosts are linked, the DID votes of every speaker are stored
+    and pooled per cluster, a confident cluster decision is reused for its speakers in further episodes.
+
+        index = SpeakerIndex.load(podcast, num_classes=len(PHON_DID_CLS))
+        index.embed_missing_speakers(speaker_samples)
+        index.cluster()
+        decision = index.get_decision(episode, speaker)
+    """
+
+    def __init__(self, podcast: str, num_classes: int, embeddings: np.ndarray | None = None,
+                 keys: list[tuple[str, str]] | None = None, durations: np.ndarray | None = None,
+                 votes: np.ndarray | None = None):
+        self.podcast = podcast
+        self.num_classes = num_classes
+        self.embeddings = embeddings if embeddings is not None else np.zeros((0, 0), dtype=np.float32)
+        self.keys = keys or []
+        self.durations = durations if durations is not None else np.zeros(0)
+        self.votes = votes if votes is not None else np.zeros((0, num_classes), dtype=np.int64)
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+        self.clusters = np.arange(len(self.keys))
+        self.num_reused = 0
+        self.num_predictions_avoided = 0
+
+    @classmethod
+    def load(cls, podcast: str, num_classes: int) -> "SpeakerIndex":
+        index_path = get_speaker_index_path(podcast)
+        if not os.path.exists(index_path):
+            return cls(podcast, num_classes)
+
+        data = np.load(index_path)
+        keys = list(zip(data["episodes"].tolist(), data["speakers"].tolist()))
+        return cls(podcast, num_classes, data["embeddings"], keys, data["durations"], data["votes"])
+
+    def save(self) -> None:
+        episodes = [episode for episode, _ in self.keys]
+        speakers = [speaker for _, speaker in self.keys]
+        np.savez(get_speaker_index_path(self.podcast), embeddings=self.embeddings,
+                 episodes=np.array(episodes, dtype=str), speakers=np.array(speakers, dtype=str),
+                 durations=self.durations, votes=self.votes)
+
+    def add(self, episode: str, speaker: str, embedding: np.ndarray, duration: float) -> None:
+        embedding = embedding.astype(np.float32)[None, :]
+        self.embeddings = embedding if len(self.keys) == 0 else np.concatenate([self.embeddings, embedding])
+        self.durations = np.append(self.durations, duration)
+        self.votes = np.concatenate([self.votes, np.zeros((1, self.num_classes), dtype=np.int64)])
+        self.positions[(episode, speaker)] = len(self.keys)
+        self.keys.append((episode, speaker))
+        self.clusters = np.append(self.clusters, len(self.keys) - 1)
+
+    def embed_missing_speakers(self, speaker_samples: dict[tuple[str, str], list]) -> None:
+        """
+        Embeds the speakers which are not indexed yet from the audio of their longest samples in the podcast hdf5.
+        :param speaker_samples: (episode, speaker_id) to its DatasetDataPoints
+        """
+        missing = {key: samples for key, samples in speaker_samples.items()
+                   if key not in self.positions and sum(s.duration for s in samples) >= MIN_EMBEDDING_DURATION}
+        if not missing:
+            return
+
+        logger.info(f"Embedding {len(missing)} speakers of {self.podcast} for the speaker index.")
+        embedder = SpeakerEmbedder(setup_gpu_device()[0])
+        with h5py.File(get_h5_file(self.podcast), "r") as h5:
+            for (episode, speaker), samples in missing.items():
+                parts, embedded = [], 0.0
+                for sample in sorted(samples, key=lambda s: s.duration, reverse=True):
+                    dataset = resolve_sample(h5, sample.sample_name)
+                    if dataset is None:
+                        continue
+                    parts.append(dataset[:])
+                    embedded += sample.duration
+                    if embedded >= MAX_EMBEDDING_DURATION:
+                        break
+                if parts:
+                    self.add(episode, speaker, embedder.embed(np.concatenate(parts)),
+                             sum(s.duration for s in samples))
+        self.save()
+
+    def search(self, embedding: np.ndarray, top_k: int = 5) -> list[tuple[tuple[str, str], float]]:
+        """:return: The top_k indexed speakers most similar to the embedding with their cosine similarity"""
+        if len(self.keys) == 0:
+            return []
+        similarity = cosine_similarity(embedding[None, :], self.embeddings)[0]
+        best = np.argsort(similarity)[::-1][:top_k]
+        return [(self.keys[i], float(similarity[i])) for i in best]
+
+    def cluster(self) -> int:
+        """
+        Leader clustering in order of speaking time: a speaker joins the most similar cluster above LINK_THRESHOLD
+        which has no speaker of the same episode, diarization already separated the speakers of an episode.
+        :return: Number of clusters
+        """
+        if len(self.keys) == 0:
+            return 0
+
+        similarity = cosine_similarity(self.embeddings, self.embeddings)
+        self.clusters = np.full(len(self.keys), -1)
+        leaders, cluster_episodes = [], []
+        for i in np.argsort(self.durations)[::-1]:
+            episode = self.keys[i][0]
+            if leaders:
+                candidates = similarity[i, leaders].copy()
+                candidates[[episode in episodes for episodes in cluster_episodes]] = -1.0
+                best = int(np.argmax(candidates))
+                if candidates[best] >= LINK_THRESHOLD:
+                    self.clusters[i] = best
+                    cluster_episodes[best].add(episode)
+                    continue
+            self.clusters[i] = len(leaders)
+            leaders.append(i)
+            cluster_episodes.append({episode})
+
+        recurring = sum(len(episodes) > 1 for episodes in cluster_episodes)
+        logger.info(f"Speaker index of {self.podcast}: {len(self.keys)} speakers in {len(leaders)} clusters, "
+                    f"{recurring} voices recur across episodes.")
+        return len(leaders)
+
+    def get_decision(self, episode: str, speaker: str) -> int | None:
+        """:return: DID class of the cluster of the speaker if its pooled votes are confident, None otherwise"""
+        position = self.positions.get((episode, speaker))
+        if position is None:
+            return None
+
+        votes = self.votes[self.clusters == self.clusters[position]].sum(axis=0)
+        total = votes.sum()
+        if total < MIN_REUSE_VOTES or votes.max() < MIN_REUSE_SHARE * total:
+            return None
+        return int(np.argmax(votes))
+
+    def add_votes(self, episode: str, speaker: str, predicted: list[int]) -> None:
+        position = self.positions.get((episode, speaker))
+        if position is not None:
+            self.votes[position] = np.bincount(np.asarray(predicted, dtype=np.int64), minlength=self.num_classes)
+
+    def record_reuse(self, num_texts: int) -> None:
+        self.num_reused += 1
+        self.num_predictions_avoided += num_texts
+
+    def log_stats(self, num_texts: int) -> None:
+        logger.info(f"Speaker index reused the DID decision of {self.num_reused} speakers, avoided "
+                    f"{self.num_predictions_avoided} of {num_texts} classifier predictions.")
@@ -0,0 +1,128 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+
+from src.transcription.utils import load_meta_data
+from src.utils.audio import SAMPLING_RATE
+from src.utils.catalog import register_samples, LOCATION_PODCAST
+from src.utils.h5_layout import resolve_sample
+from src.utils.logger import get_logger
+from src.utils.paths import PODCAST_AUDIO_FOLDER, TTS_PODCASTS_PATH
+
+SHAPE_CHUNK_SIZE = 20000  # keys per worker task, large enough to amortize opening the hdf5
+FORMAT_DIALECT = "dialect"
+FORMAT_PODCAST = "podcast"
+
+logger = get_logger(__name__)
+
+
+def read_sample_lengths(h5_path: str, keys: list[tuple[str, str]]) -> np.ndarray:
+    """
+    Reads the number of audio values of every sample from the dataset shape only, no audio is read.
+    :param keys: Pairs of (sample name, dataset name), the dataset name saves the search in hierarchical files
+    :return: Lengths in the order of keys, -1 for keys which do not exist
+    """
+    lengths = np.full(len(keys), -1, dtype=np.int64)
+    with h5py.File(h5_path, "r") as h5:
+        for i, (sample_name, dataset_name) in enumerate(keys):
+            h5_content = resolve_sample(h5, sample_name, dataset_name)
+            if h5_content is not None:
+                lengths[i] = h5_content.shape[0]
+    return lengths
+
+
+def is_dialect_folder(folder: str) -> bool:
+    """Metadata next to the podcast audio is in the detailed podcast format, moved podcasts and dialects are not."""
+    return os.path.abspath(folder) != os.path.abspath(PODCAST_AUDIO_FOLDER)
+
+
+def backfill_durations(meta_data_path: str, h5_path: str | None = None, location: str = LOCATION_PODCAST,
+                       only_missing: bool = True, num_workers: int | None = None,
+                       load_as_dialect: bool | None = None) -> int:
+    """
+    Sets the duration of samples without a valid duration (0.0 or -1.0, e.g. SwissDial or SNF without parsed TSVs) to
+    the length of their audio. The metadata file is rewritten and the catalog updated.
+    :param meta_data_path: Metadata file in the dialect or podcast format
+    :param h5_path: hdf5 holding the samples, defaults to the hdf5 next to the metadata file
+    :param location: Catalog location of the hdf5
+    :param only_missing: Only backfill samples with a duration <= 0, otherwise recompute all durations
+    :param num_workers: Processes reading shapes, defaults to the number of CPUs
+    :param load_as_dialect: Format of the metadata file, derived from its folder if not given, see is_dialect_folder
+    :return: Number of updated samples
+    """
+    h5_path = h5_path or meta_data_path.replace(".txt", ".hdf5")
+    if load_as_dialect is None:
+        load_as_dialect = is_dialect_folder(os.path.dirname(meta_data_path))
+    meta_data, _ = load_meta_data(meta_data_path, load_as_dialect=load_as_dialect)
+
+    to_update = [sample for sample in meta_data if not only_missing or sample.duration <= 0]
+    if not to_update:
+        logger.info(f"All samples of {meta_data_path} have a duration.")
+        return 0
+
+    keys = [(sample.sample_name, sample.dataset_name) for sample in to_update]
+    chunks = [keys[start:start + SHAPE_CHUNK_SIZE] for start in range(0, len(keys), SHAPE_CHUNK_SIZE)]
+    with ProcessPoolExecutor(num_workers) as executor:
+        lengths = np.concatenate(list(executor.map(read_sample_lengths, [h5_path] * len(chunks), chunks)))
+
+    durations = np.round(lengths / SAMPLING_RATE, 4)
+    num_missing = 0
+    for sample, length, duration in zip(to_update, lengths, durations):
+        if length < 0:
+            num_missing += 1
+            continue
+        sample.duration = float(duration)
+
+    if num_missing:
+        logger.warning(f"{num_missing} samples of {meta_data_path} do not exist in {h5_path}.")
+
+    with open(meta_data_path, "wt", encoding="utf-8") as f:
+        f.writelines(sample.to_string() for sample in meta_data)
+    # podcast metadata does not carry the dataset name
+    register_samples(meta_data, h5_path, location, dataset_name=os.path.basename(meta_data_path).replace(".txt", ""))
+
+    num_updated = len(to_update) - num_missing
+    logger.info(f"Backfilled {num_updated} durations ({float(durations[lengths >= 0].sum()) / 3600:.2f}h) of "
+                f"{meta_data_path}.")
+    return num_updated
+
+
+def backfill_folder(folder: str = TTS_PODCASTS_PATH, location: str = LOCATION_PODCAST,
+                    datasets: list[str] | None = None, num_workers: int | None = None,
+                    load_as_dialect: bool | None = None) -> int:
+    """
+    Runs backfill_durations for every metadata file in folder which has an hdf5 next to it.
+    :param datasets: Only these datasets, e.g. ["SwissDial", "STT4SG-350"], all metadata files if not given
+    :param load_as_dialect: Format of the metadata files, derived from the folder if not given
+    """
+    if load_as_dialect is None:
+        load_as_dialect = is_dialect_folder(folder)
+
+    num_updated = 0
+    for metadata_file in sorted(file for file in os.listdir(folder) if file.endswith(".txt")):
+        if datasets is not None and metadata_file.replace(".txt", "") not in datasets:
+            continue
+
+        meta_data_path = os.path.join(folder, metadata_file)
+        if not os.path.exists(meta_data_path.replace(".txt", ".hdf5")):
+            continue
+
+        num_updated += backfill_durations(meta_data_path, location=location, num_workers=num_workers,
+                                          load_as_dialect=load_as_dialect)
+    return num_updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folder", type=str, default=TTS_PODCASTS_PATH, help="Folder with metadata and hdf5 files")
+    parser.add_argument("--location", type=str, default=LOCATION_PODCAST, help="Catalog location of the hdf5s")
+    parser.add_argument("--datasets", type=str, nargs="*", default=None, help="Only backfill these datasets")
+    parser.add_argument("--num_workers", type=int, default=None, help="Processes reading dataset shapes")
+    parser.add_argument("--format", type=str, choices=[FORMAT_DIALECT, FORMAT_PODCAST], default=None,
+                        help="Format of the metadata files, derived from the folder if not given")
+    args = parser.parse_args()
+    backfill_folder(args.folder, args.location, args.datasets, args.num_workers,
+                    None if args.format is None else args.format == FORMAT_DIALECT)
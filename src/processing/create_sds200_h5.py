@@ -1,20 +1,18 @@
 import os
-import shutil
 
 import h5py
-import librosa
-import numpy as np
 import pandas as pd
-from pydub import AudioSegment
 
+from src.utils.audio import DecoderPool, SAMPLING_RATE
+from src.utils.catalog import register_samples, LOCATION_PODCAST
 from src.utils.data_points import DialectDataPoint
 from src.utils.logger import get_logger
-from src.utils.paths import TTS_PODCASTS_PATH, SCRATCH_PATH, CLUSTER_PROJECTS_TTS
+from src.utils.paths import TTS_PODCASTS_PATH, CLUSTER_PROJECTS_TTS
 
 DATASET_NAME = "SDS-200"
 SDS200_DATASET_PATH = os.path.join(CLUSTER_PROJECTS_TTS, "sds-200")
-SDS200_SCRATCH = os.path.join(SCRATCH_PATH, "sds-200")
-SAMPLING_RATE = 16000
+DURATION_TOLERANCE = 0.1  # seconds the decoded audio may differ from the duration in train.tsv
+FLUSH_INTERVAL = 256  # samples written between flushes of the hdf5 and the metadata
 
 CANTON_TO_REGION_ALIGNMENT = {
     "AG": "Zürich",
@@ -44,61 +42,99 @@ CANTON_TO_REGION_ALIGNMENT = {
 logger = get_logger(__name__)
 
 
-def move_sds200_to_h5() -> None:
-    logger.info(f"Starting move of {DATASET_NAME} into single h5")
-    train_meta_data = load_sds200_train_metadata()
-    shutil.copytree(SDS200_DATASET_PATH, SDS200_SCRATCH, dirs_exist_ok=True)
+def get_sds200_h5_path() -> str:
+    return os.path.join(TTS_PODCASTS_PATH, f"{DATASET_NAME}.hdf5")
 
-    h5_file_name = f"{DATASET_NAME}.hdf5"
-    h5_file_path = os.path.join(TTS_PODCASTS_PATH, h5_file_name)
-    meta_data = []
 
-    with h5py.File(h5_file_path, "a") as h5_sds_200:
-        for i, sample in enumerate(train_meta_data):
-            sample_name_split = sample.sample_name.split("/")
-            speaker_folder = sample_name_split[0]
-            sample_name = sample_name_split[-1].replace(".mp3", "")
-            sample.sample_name = f"{speaker_folder}_{sample_name}" # set correct sample name
+def get_sds200_meta_data_path() -> str:
+    return os.path.join(TTS_PODCASTS_PATH, f"{DATASET_NAME}.txt")
 
-            audio_path = os.path.join(SDS200_SCRATCH, speaker_folder, f"{sample_name}.mp3")
-            wav_path = audio_path.replace(".mp3", ".wav")
 
-            audio_segment = AudioSegment.from_file(audio_path)
-            audio_segment.export(wav_path, format="wav")  # write segment to os for librosa to load in target SR
+def _write_sds200_meta_data(meta_data: list[DialectDataPoint]) -> None:
+    with open(get_sds200_meta_data_path(), "wt", encoding="utf-8") as f:
+        f.writelines(sample.to_string() for sample in meta_data)
 
-            speech, _ = librosa.load(wav_path, sr=SAMPLING_RATE)
 
-            h5_entry = h5_sds_200.create_dataset(sample.sample_name, dtype=float, data=speech)
-            h5_entry.attrs["dataset_name"] = DATASET_NAME
-            h5_entry.attrs["speaker"] = sample.speaker_id
-            h5_entry.attrs["duration"] = sample.duration
-            h5_entry.attrs["de_text"] = sample.de_text
-            h5_entry.attrs["did"] = sample.dialect
-            h5_sds_200.flush()
+def move_sds200_to_h5(num_workers: int | None = None) -> None:
+    """
+    Imports the train split of SDS-200 into a single hdf5. Only the clips referenced in train.tsv are read, directly
+    from projects, and decoded in a DecoderPool while this process is the only writer of the hdf5. Samples already in
+    the hdf5 are skipped, so an interrupted import can simply be restarted. Clips whose decoded length differs from
+    the duration in train.tsv by more than DURATION_TOLERANCE are not imported.
+    :param num_workers: Decoder processes, defaults to the number of CPUs
+    :return:
+    """
+    logger.info(f"Starting move of {DATASET_NAME} into single h5")
+    train_meta_data = load_sds200_train_metadata()
 
-            os.remove(wav_path)  # keep disk space clean
-            meta_data.append(sample)
+    # clip_path is <speaker folder>/<sentence>.mp3, the key becomes <speaker folder>_<sentence>. Only the first and the
+    # last component form the key, as in hdf5s imported before, so resuming them does not duplicate samples
+    audio_paths = []
+    for sample in train_meta_data:
+        audio_paths.append(os.path.join(SDS200_DATASET_PATH, sample.sample_name))
+        sample_name_split = sample.sample_name.split("/")
+        speaker_folder = sample_name_split[0]
+        sample_name = sample_name_split[-1].replace(".mp3", "")
+        sample.sample_name = f"{speaker_folder}_{sample_name}"  # set correct sample name
 
-    meta_data_sds200_path = os.path.join(TTS_PODCASTS_PATH, f"{DATASET_NAME}.txt")
-    with open(meta_data_sds200_path, "wt", encoding="utf-8") as f:
-        f.writelines(sample.to_string() for sample in meta_data)
+    meta_data = []
+    num_mismatches = 0
+    with h5py.File(get_sds200_h5_path(), "a") as h5_sds_200:
+        existing = set(h5_sds_200.keys())
+        meta_data.extend(sample for sample in train_meta_data if sample.sample_name in existing)
+        to_import = [(sample, audio_path) for sample, audio_path in zip(train_meta_data, audio_paths)
+                     if sample.sample_name not in existing]
+        logger.info(f"{len(meta_data)} samples already imported, decoding {len(to_import)} samples.")
+
+        try:
+            with DecoderPool(num_workers) as pool:
+                decoded = pool.imap(audio_path for _, audio_path in to_import)
+                for (sample, _), (audio_path, speech) in zip(to_import, decoded):
+                    if speech is None:
+                        continue
+
+                    decoded_duration = len(speech) / SAMPLING_RATE
+                    if abs(decoded_duration - sample.duration) > DURATION_TOLERANCE:
+                        logger.warning(f"Decoded {decoded_duration:.2f}s instead of {sample.duration:.2f}s for "
+                                       f"{audio_path}, skipping it.")
+                        num_mismatches += 1
+                        continue
+
+                    h5_entry = h5_sds_200.create_dataset(sample.sample_name, dtype=float, data=speech)
+                    h5_entry.attrs["dataset_name"] = DATASET_NAME
+                    h5_entry.attrs["speaker"] = sample.speaker_id
+                    h5_entry.attrs["duration"] = sample.duration
+                    h5_entry.attrs["de_text"] = sample.de_text
+                    h5_entry.attrs["did"] = sample.dialect
+                    meta_data.append(sample)
+
+                    if len(meta_data) % FLUSH_INTERVAL == 0:
+                        h5_sds_200.flush()
+                        _write_sds200_meta_data(meta_data)
+        finally:
+            # everything in the hdf5 is covered by the metadata, also if the import was interrupted
+            _write_sds200_meta_data(meta_data)
+
+    register_samples(meta_data, get_sds200_h5_path(), LOCATION_PODCAST, dataset_name=DATASET_NAME)
+    logger.info(f"Imported {len(meta_data)} of {len(train_meta_data)} samples, {num_mismatches} were skipped as their "
+                f"duration did not match.")
 
 
 def load_sds200_train_metadata() -> list[DialectDataPoint]:
-    data = []
     train_path = os.path.join(SDS200_DATASET_PATH, "train.tsv")
-    df = pd.read_csv(train_path, sep="\t")
-    for index, row in df.iterrows():
-        canton = row["canton"]
-        if canton is None or canton == "" or (isinstance(canton, float) and np.isnan(canton)):
-            continue
-
-        data.append(DialectDataPoint(
-            dataset_name=DATASET_NAME,
-            sample_name=row["clip_path"],  # here clip path, should be fixed afterwards and only sentence_id remain
-            duration=row["duration"],
-            speaker_id=row["client_id"],
-            dialect=CANTON_TO_REGION_ALIGNMENT[canton],
-            de_text=row["sentence"],
-        ))
-    return data
+    df = pd.read_csv(train_path, sep="\t", usecols=["clip_path", "duration", "client_id", "canton", "sentence"])
+    df = df[df["canton"].notna() & (df["canton"] != "")]
+
+    df["dialect"] = df["canton"].map(CANTON_TO_REGION_ALIGNMENT)
+    unknown = df["dialect"].isna()
+    if unknown.any():
+        logger.warning(f"Skipping {int(unknown.sum())} samples of unknown cantons "
+                       f"{df.loc[unknown, 'canton'].unique()}.")
+        df = df[~unknown]
+
+    # here clip path, should be fixed afterwards and only sentence_id remain
+    return [
+        DialectDataPoint(DATASET_NAME, clip_path, duration, client_id, dialect, sentence)
+        for clip_path, duration, client_id, dialect, sentence in zip(
+            df["clip_path"], df["duration"], df["client_id"], df["dialect"], df["sentence"])
+    ]
@@ -1,10 +1,11 @@
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 import h5py
-import pandas as pd
 
-from src.processing.utils import SNF_DATASET_PATH
+from src.processing.h5_transfer import transfer_samples
+from src.processing.utils import SNF_DATASET_PATH, load_snf_duration_index
 from src.transcription.utils import DIALECT_TO_TAG
 from src.utils.data_points import DialectDataPoint
 from src.utils.logger import get_logger
@@ -14,7 +15,17 @@ DATASET_NAME = "STT4SG-350"
 logger = get_logger(__name__)
 
 
-def move_stt4sg_to_h5():
+def _create_speaker_datapoints(dialect: str, speaker: str) -> tuple[str, list[DialectDataPoint]]:
+    speaker_path = f"{SNF_DATASET_PATH}/speakers/{speaker}"
+    return speaker_path, create_datapoints_for_stt4sg_corpus_speaker(dialect, speaker, speaker_path, True)
+
+
+def move_stt4sg_to_h5(num_workers: int | None = None):
+    """
+    Speaker metadata is parsed in a process pool, while this process copies the audio of one speaker after the other
+    into the single STT4SG hdf5.
+    :param num_workers: Processes parsing speaker metadata, defaults to the number of CPUs
+    """
     logger.info(f"Starting move of {DATASET_NAME} into single h5")
 
     with open(os.path.join(SNF_DATASET_PATH, "speaker_to_dialect.json"), "rt", encoding="utf-8") as f:
@@ -30,31 +41,25 @@ def move_stt4sg_to_h5():
     h5_file_path = os.path.join(TTS_PODCASTS_PATH, h5_file_name)
     meta_data = []
 
-    with h5py.File(h5_file_path, "a") as h5_stt4sg:
-        for dialect, speakers in dialects.items():
-            for speaker in speakers:
-                speaker_path = f"{SNF_DATASET_PATH}/speakers/{speaker}"
-                meta_data_speaker = create_datapoints_for_stt4sg_corpus_speaker(dialect, speaker, speaker_path, True)
-                with h5py.File(f"{speaker_path}/audio.h5", "r") as h5_read:
-                    for entry in meta_data_speaker:
-                        # I want uniformity in hdf5 keys of type SAMPLE_CUTID with only one underscore or just SAMPLE
-                        new_sample_name = entry.sample_name.split("-")[-1]
-                        if new_sample_name in h5_stt4sg:
-                            continue
-
-                        h5_content = h5_read[entry.sample_name]
-                        # specifically using [()] instead of [:] to reduce operation time as we are not slicing
-                        new_h5_entry = h5_stt4sg.create_dataset(new_sample_name, dtype=float, data=h5_content[()])
-
-                        # Create essential attributes
-                        new_h5_entry.attrs["dataset_name"] = entry.dataset_name
-                        new_h5_entry.attrs["speaker"] = entry.speaker_id
-                        new_h5_entry.attrs["de_text"] = entry.de_text
-                        new_h5_entry.attrs["did"] = dialect
-                        h5_stt4sg.flush()
-
-                        entry.sample_name = new_sample_name
-                        meta_data.append(entry)
+    speaker_jobs = [(dialect, speaker) for dialect, speakers in dialects.items() for speaker in speakers]
+    load_snf_duration_index()  # built once here, the workers inherit it on fork
+
+    with h5py.File(h5_file_path, "a") as h5_stt4sg, ProcessPoolExecutor(num_workers) as executor:
+        speaker_meta_data = executor.map(_create_speaker_datapoints, *zip(*speaker_jobs))
+        for (dialect, _), (speaker_path, meta_data_speaker) in zip(speaker_jobs, speaker_meta_data):
+            # I want uniformity in hdf5 keys of type SAMPLE_CUTID with only one underscore or just SAMPLE
+            keys = [(entry.sample_name, entry.sample_name.split("-")[-1]) for entry in meta_data_speaker]
+            # Create essential attributes
+            attrs = [{"dataset_name": entry.dataset_name, "speaker": entry.speaker_id, "de_text": entry.de_text,
+                      "did": dialect} for entry in meta_data_speaker]
+
+            with h5py.File(f"{speaker_path}/audio.h5", "r") as h5_read:
+                written = set(transfer_samples(h5_read, h5_stt4sg, keys, attrs, without_attrs=True))
+
+            for entry, (_, new_sample_name) in zip(meta_data_speaker, keys):
+                if new_sample_name in written:
+                    entry.sample_name = new_sample_name
+                    meta_data.append(entry)
 
     meta_data_stt4sg_path = os.path.join(TTS_PODCASTS_PATH, f"{DATASET_NAME}.txt")
     with open(meta_data_stt4sg_path, "wt", encoding="utf-8") as f:
@@ -63,20 +68,6 @@ def move_stt4sg_to_h5():
     logger.info(f"Finished move for {DATASET_NAME} to hdf5.")
 
 
-def _load_snf_tsv_for_duration() -> dict:
-    train = os.path.join(SNF_DATASET_PATH, "train_all.tsv")
-    test = os.path.join(SNF_DATASET_PATH, "test.tsv")
-    valid = os.path.join(SNF_DATASET_PATH, "valid.tsv")
-    sample_to_duration = {}
-
-    for file in [train, test, valid]:
-        df = pd.read_csv(file, sep="\t")
-        for index, row in df.iterrows():
-            # path thingy is something custom because I just copy ready made h5s, check your env and replace as needed
-            sample_to_duration[row["path"].replace("/", "-").replace(".flac", "")] = round(float(row["duration"]), 4)
-    return sample_to_duration
-
-
 def create_datapoints_for_stt4sg_corpus_speaker(dialect: str, speaker: str, speaker_path: str,
                                                 parse_duration: bool = False) -> list[DialectDataPoint]:
     """
@@ -89,8 +80,7 @@ def create_datapoints_for_stt4sg_corpus_speaker(dialect: str, speaker: str, spea
     :return:
     """
     data = []
-    if parse_duration:
-        sample_to_duration = _load_snf_tsv_for_duration()
+    sample_to_duration = load_snf_duration_index() if parse_duration else {}
     with open(f"{speaker_path}/metadata.txt", "rt", encoding="utf-8") as meta_file:
         for line in meta_file:
             split_line = line.split("|")
@@ -0,0 +1,211 @@
+import fcntl
+import os
+import queue
+from contextlib import contextmanager
+from multiprocessing import Event, Process, Queue
+from typing import Callable, Iterator
+
+import h5py
+
+from src.processing.h5_transfer import transfer_samples
+from src.processing.h5_views import add_samples_as_view, open_view
+from src.transcription.utils import DIALECT_DATA_PATH, DIALECT_TO_TAG, load_meta_data, META_WRITE_ITERATIONS
+from src.utils.audio import SAMPLING_RATE
+from src.utils.catalog import register_samples, LOCATION_DIALECT
+from src.utils.data_points import DialectDataPoint
+from src.utils.h5_layout import open_h5, resolve_sample, get_layout, HIERARCHICAL_LAYOUT
+from src.utils.logger import get_logger
+
+DIALECT_VIEW_PATH = os.path.join(DIALECT_DATA_PATH, "views")
+WRITER_LOCK_FILE = ".dialect_writer.lock"
+QUEUE_SIZE = 32  # jobs per dialect queue, bounds memory if readers are faster than the writer
+PUT_TIMEOUT = 5  # seconds after which a blocked reader or writer checks whether the move was aborted
+
+logger = get_logger(__name__)
+
+
+class DialectMoveJob:
+    """
+    Batch of samples from a single source hdf5 which should end up in one dialect hdf5. Only references are passed to
+    the writer, the audio itself is copied by the writer with HDF5 object copy.
+    """
+
+    def __init__(self, h5_source_path: str, keys: list[tuple[str, str]], meta_data: list[DialectDataPoint],
+                 attrs: list[dict] | None = None, without_attrs: bool = False):
+        self.h5_source_path = h5_source_path
+        self.keys = keys
+        self.meta_data = meta_data
+        self.attrs = attrs
+        self.without_attrs = without_attrs
+
+
+def _get_dialect_folder(as_view: bool = False) -> str:
+    return DIALECT_VIEW_PATH if as_view else DIALECT_DATA_PATH
+
+
+def get_dialect_meta_data_path(dialect: str, as_view: bool = False) -> str:
+    return os.path.join(_get_dialect_folder(as_view), f"{dialect}.txt")
+
+
+def write_dialect_meta_data(dialect: str, dialect_content: list[DialectDataPoint], as_view: bool = False) -> None:
+    with open(get_dialect_meta_data_path(dialect, as_view), "wt", encoding="utf-8") as f:
+        f.writelines(line.to_string() for line in dialect_content)
+
+
+def get_dialect_h5_path(dialect: str, as_view: bool = False) -> str:
+    return os.path.join(_get_dialect_folder(as_view), f"{dialect}.hdf5")
+
+
+def get_dialect_files(dialect, as_view: bool = False) -> tuple[list, str]:
+    meta_data_dialect_path = get_dialect_meta_data_path(dialect, as_view)
+    h5_file_dialect = get_dialect_h5_path(dialect, as_view)
+
+    if os.path.exists(meta_data_dialect_path):
+        meta_data_dialect, _ = load_meta_data(meta_data_dialect_path)
+    else:
+        meta_data_dialect = []
+
+    return meta_data_dialect, h5_file_dialect
+
+
+@contextmanager
+def dialect_write_lock(as_view: bool = False):
+    """
+    Prevents a second run from writing into the same dialect hdf5s. The lock is released by the OS if the owning
+    process dies, so no stale lock files have to be cleaned up.
+    """
+    folder = _get_dialect_folder(as_view)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, WRITER_LOCK_FILE), "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(f"Another dialect move is already writing into {folder}.")
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _put(job_queue: Queue, item, abort: Event) -> None:
+    while True:
+        try:
+            job_queue.put(item, timeout=PUT_TIMEOUT)
+            return
+        except queue.Full:
+            if abort.is_set():
+                raise RuntimeError("A dialect writer stopped unexpectedly, aborting reader.")
+
+
+def _run_reader(tasks: list[tuple[Callable, tuple]], queues: dict[str, Queue], abort: Event) -> None:
+    try:
+        for produce_jobs, args in tasks:
+            for dialect, job in produce_jobs(*args):
+                if dialect not in queues:
+                    logger.warning(f"No dialect hdf5 for '{dialect}', skipping {len(job.keys)} samples.")
+                    continue
+                _put(queues[dialect], job, abort)
+    finally:
+        # always signal the writers, otherwise they would wait forever on a crashed reader
+        if not abort.is_set():
+            for job_queue in queues.values():
+                _put(job_queue, None, abort)
+
+
+def _run_writer(dialect: str, job_queue: Queue, num_readers: int, as_view: bool, abort: Event,
+                hierarchical: bool = False) -> None:
+    h5_dialect = None
+    meta_data_dialect = []
+    finished_readers = 0
+    iteration_count = 0
+
+    try:
+        while finished_readers < num_readers:
+            try:
+                job = job_queue.get(timeout=PUT_TIMEOUT)
+            except queue.Empty:
+                if abort.is_set():
+                    raise RuntimeError(f"Aborting writer for dialect '{dialect}' as another writer failed.")
+                continue
+
+            if job is None:
+                finished_readers += 1
+                continue
+
+            if h5_dialect is None:
+                logger.info(f"Writer for dialect '{dialect}' received its first job.")
+                meta_data_dialect, h5_file_dialect = get_dialect_files(dialect, as_view)
+                h5_dialect = open_view(h5_file_dialect) if as_view else open_h5(h5_file_dialect, "a", hierarchical)
+
+            if as_view:
+                written = set(add_samples_as_view(job.h5_source_path, h5_dialect, job.keys, job.attrs,
+                                                      job.without_attrs))
+            else:
+                with h5py.File(job.h5_source_path, "r") as h5_source:
+                    written = set(transfer_samples(h5_source, h5_dialect, job.keys, job.attrs, job.without_attrs))
+
+            for entry, (_, new_sample_name) in zip(job.meta_data, job.keys):
+                if new_sample_name not in written:
+                    continue
+
+                entry.sample_name = new_sample_name
+                if entry.duration <= 0:
+                    # SwissDial and SNF without parsed TSVs carry no duration, the dataset shape is free to read
+                    entry.duration = round(resolve_sample(h5_dialect, new_sample_name, entry.dataset_name).shape[0]
+                                           / SAMPLING_RATE, 4)
+                meta_data_dialect.append(entry)
+
+            iteration_count += 1
+            if iteration_count >= META_WRITE_ITERATIONS:
+                write_dialect_meta_data(dialect, meta_data_dialect, as_view)
+                iteration_count = 0
+
+    except Exception:
+        abort.set()
+        raise
+
+    finally:
+        if h5_dialect is not None:
+            is_hierarchical = get_layout(h5_dialect) == HIERARCHICAL_LAYOUT
+            h5_dialect.close()
+            write_dialect_meta_data(dialect, meta_data_dialect, as_view)
+            register_samples(meta_data_dialect, get_dialect_h5_path(dialect, as_view), LOCATION_DIALECT,
+                             hierarchical=is_hierarchical)
+            logger.info(f"Finished move for dialect '{dialect}'.")
+
+
+def run_dialect_move(tasks: list[tuple[Callable[..., Iterator[tuple[str, DialectMoveJob]]], tuple]],
+                     as_view: bool = False, num_readers: int = 4, hierarchical: bool = False) -> None:
+    """
+    Moves samples of any number of podcasts and corpora into the dialect hdf5s. Every dialect hdf5 is owned by exactly
+    one writer process which is fed through a queue, so readers never open a dialect file and any combination of
+    sources can be moved concurrently. A file lock prevents a second run from writing into the same dialect files.
+    :param tasks: Pairs of (job producer, arguments). A producer yields (dialect, DialectMoveJob) and is run in one of
+    the reader processes
+    :param as_view: Create dialect views instead of physical copies, see h5_views
+    :param num_readers: Number of reader processes the tasks are distributed to
+    :param hierarchical: Create new dialect hdf5s with samples grouped by dataset and episode, see h5_layout
+    :return:
+    """
+    num_readers = max(1, min(num_readers, len(tasks)))
+
+    with dialect_write_lock(as_view):
+        abort = Event()
+        queues = {dialect: Queue(maxsize=QUEUE_SIZE) for dialect in DIALECT_TO_TAG.keys()}
+
+        writers = [Process(target=_run_writer, args=(dialect, job_queue, num_readers, as_view, abort, hierarchical))
+                   for dialect, job_queue in queues.items()]
+        readers = [Process(target=_run_reader, args=(tasks[i::num_readers], queues, abort))
+                   for i in range(num_readers)]
+
+        logger.info(f"Starting dialect move of {len(tasks)} sources with {num_readers} readers.")
+
+        for process in writers + readers:
+            process.start()
+
+        for process in readers + writers:
+            process.join()
+
+        failed = [process.name for process in readers + writers if process.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Dialect move failed in processes {failed}, check the log for details.")
@@ -0,0 +1,129 @@
+import os
+
+import h5py
+import numpy as np
+
+from src.utils.h5_layout import contains_sample, get_sample_key, resolve_sample
+from src.utils.logger import get_logger
+
+COPY_BLOCK_SIZE = 1 << 20  # number of values per block when a dataset has to be re-encoded instead of copied
+
+logger = get_logger(__name__)
+
+
+def has_matching_layout(h5_content: h5py.Dataset, dtype=float, compression: str | None = None,
+                        compression_opts=None) -> bool:
+    """
+    Checks whether a dataset can be copied as is (HDF5 object copy) or has to be re-encoded. Datasets are re-encoded
+    if the stored dtype differs from the requested one or if a compression filter was requested which differs from
+    the one of the source dataset. No requested compression means "keep whatever the source uses". Virtual datasets are
+    always re-encoded, as an object copy would only copy the mapping and not the audio.
+    :param h5_content: Source dataset
+    :param dtype: Target dtype, all corpora in this project are stored as float
+    :param compression: Requested compression filter of the target, None to keep the source filters
+    :param compression_opts: Requested compression options of the target
+    :return:
+    """
+    if h5_content.is_virtual or h5_content.dtype != np.dtype(dtype):
+        return False
+    if compression is None:
+        return True
+    return h5_content.compression == compression and h5_content.compression_opts == compression_opts
+
+
+def copy_dataset_by_chunks(h5_content: h5py.Dataset, h5_target: h5py.Group, target_key: str, dtype=float,
+                           compression: str | None = None, compression_opts=None) -> h5py.Dataset:
+    """
+    Fallback if native object copy is not possible as filters or dtype differ. The data is moved chunk by chunk (or
+    block by block for contiguous datasets) so only a single chunk is decoded at once instead of the whole sample.
+    :param h5_content: Source dataset
+    :param h5_target: Group in which the new dataset is created
+    :param target_key: Name of the new dataset
+    :param dtype: Target dtype
+    :param compression: Target compression filter, None to keep the filter of the source
+    :param compression_opts: Target compression options
+    :return: The newly created dataset
+    """
+    if compression is None:
+        compression = h5_content.compression
+        compression_opts = h5_content.compression_opts
+
+    chunks = h5_content.chunks
+    if chunks is None and compression is not None:
+        chunks = True  # filters require a chunked layout, let h5py guess a reasonable chunk shape
+
+    new_h5_entry = h5_target.create_dataset(target_key, shape=h5_content.shape, dtype=dtype, chunks=chunks,
+                                            compression=compression, compression_opts=compression_opts)
+
+    if h5_content.size == 0:
+        return new_h5_entry
+
+    if h5_content.ndim == 0:
+        new_h5_entry[()] = h5_content[()]
+    elif h5_content.chunks is not None:
+        for chunk_slice in h5_content.iter_chunks():
+            new_h5_entry[chunk_slice] = h5_content[chunk_slice]
+    else:
+        block_size = max(1, COPY_BLOCK_SIZE // max(1, h5_content.size // h5_content.shape[0]))
+        for start in range(0, h5_content.shape[0], block_size):
+            end = min(start + block_size, h5_content.shape[0])
+            new_h5_entry[start:end] = h5_content[start:end]
+
+    return new_h5_entry
+
+
+def transfer_samples(h5_source: h5py.File, h5_target: h5py.Group, keys: list[tuple[str, str]],
+                     attrs: list[dict] | None = None, without_attrs: bool = False, dtype=float,
+                     compression: str | None = None, compression_opts=None) -> list[str]:
+    """
+    Bulk copy of a batch of samples from one hdf5 into another. Instead of decoding every sample into a NumPy array and
+    re-creating it attribute by attribute, HDF5 native object copy (H5Ocopy) is used which copies raw storage,
+    attributes and filters in one go. Samples whose layout does not match the requested one are copied chunk-wise.
+    Keys which already exist in the target are skipped. Keys are sample names, they are resolved according to the key
+    layout of source and target, see h5_layout.
+    :param h5_source: Opened hdf5 to read from
+    :param h5_target: Opened hdf5 (or group) to write to
+    :param keys: Pairs of (source sample name, target sample name)
+    :param attrs: Optional attributes per sample which are set in addition to (or instead of) the copied attributes
+    :param without_attrs: Do not copy the attributes of the source dataset
+    :param dtype: Target dtype
+    :param compression: Target compression filter, None keeps the filters of the source dataset
+    :param compression_opts: Target compression options
+    :return: Target keys that were written
+    """
+    written = []
+    reencoded = 0
+    source_dataset_name = os.path.splitext(os.path.basename(h5_source.filename))[0]
+
+    for i, (source_key, target_key) in enumerate(keys):
+        h5_content = resolve_sample(h5_source, source_key)
+        if h5_content is None:
+            raise KeyError(f"Sample {source_key} does not exist in {h5_source.filename}.")
+
+        dataset_name = ((attrs[i] if attrs is not None and attrs[i] else {}).get("dataset_name")
+                        or h5_content.attrs.get("dataset_name") or source_dataset_name)
+        if contains_sample(h5_target, target_key, dataset_name):
+            continue
+
+        target_path = get_sample_key(h5_target, target_key, dataset_name, create_groups=True)
+        if has_matching_layout(h5_content, dtype, compression, compression_opts):
+            h5_target.copy(h5_content, target_path, without_attrs=without_attrs)
+            new_h5_entry = h5_target[target_path]
+        else:
+            new_h5_entry = copy_dataset_by_chunks(h5_content, h5_target, target_path, dtype, compression,
+                                                  compression_opts)
+            if not without_attrs:
+                new_h5_entry.attrs.update(h5_content.attrs)
+            reencoded += 1
+
+        if attrs is not None and attrs[i]:
+            new_h5_entry.attrs.update(attrs[i])
+
+        written.append(target_key)
+
+    h5_target.file.flush()
+
+    if reencoded:
+        logger.debug(f"Re-encoded {reencoded} of {len(written)} samples as layouts did not match.")
+
+    return written
@@ -0,0 +1,106 @@
+import argparse
+import os
+import shutil
+
+import h5py
+
+from src.processing.h5_transfer import transfer_samples
+from src.utils.h5_layout import contains_sample, get_sample_key, list_sample_names, resolve_sample
+from src.utils.logger import get_logger
+
+VIRTUAL_LINK = "virtual"
+EXTERNAL_LINK = "external"
+
+logger = get_logger(__name__)
+
+
+def add_samples_as_view(h5_source_path: str, h5_view: h5py.File, keys: list[tuple[str, str]],
+                        attrs: list[dict] | None = None, without_attrs: bool = False,
+                        link_type: str = VIRTUAL_LINK) -> list[str]:
+    """
+    Adds samples to a view file without copying audio. Either as HDF5 virtual datasets mapping the full sample of the
+    source file (attributes are copied as they are not part of the mapping) or as external links which resolve to the
+    source dataset including its attributes. Sources are referenced by absolute path, so views can be moved freely as
+    long as the podcast hdf5s stay in place.
+    :param h5_source_path: Path to the podcast / corpus hdf5 holding the audio
+    :param h5_view: Opened view hdf5 to write to
+    :param keys: Pairs of (source key, view key)
+    :param attrs: Optional attributes per sample, only applicable to virtual datasets as links have no own attributes
+    :param without_attrs: Do not copy the attributes of the source dataset, only applicable to virtual datasets
+    :param link_type: Either VIRTUAL_LINK or EXTERNAL_LINK
+    :return: View keys that were written, already existing keys are skipped
+    """
+    assert link_type in [VIRTUAL_LINK, EXTERNAL_LINK], f"Unknown link type '{link_type}'."
+    assert not without_attrs or link_type == VIRTUAL_LINK, "External links always resolve to the source attributes."
+    h5_source_path = os.path.abspath(h5_source_path)
+    written = []
+
+    with h5py.File(h5_source_path, "r") as h5_source:
+        source_dataset_name = os.path.splitext(os.path.basename(h5_source_path))[0]
+        for i, (source_key, view_key) in enumerate(keys):
+            # links and mappings need the actual path of the sample in the source file
+            h5_content = resolve_sample(h5_source, source_key)
+            if h5_content is None:
+                raise KeyError(f"Sample {source_key} does not exist in {h5_source_path}.")
+
+            dataset_name = ((attrs[i] if attrs is not None and attrs[i] else {}).get("dataset_name")
+                            or h5_content.attrs.get("dataset_name") or source_dataset_name)
+            if contains_sample(h5_view, view_key, dataset_name):
+                continue
+
+            view_path = get_sample_key(h5_view, view_key, dataset_name, create_groups=True)
+
+            if link_type == EXTERNAL_LINK:
+                h5_view[view_path] = h5py.ExternalLink(h5_source_path, h5_content.name)
+            else:
+                layout = h5py.VirtualLayout(shape=h5_content.shape, dtype=h5_content.dtype)
+                layout[...] = h5py.VirtualSource(h5_source_path, h5_content.name, shape=h5_content.shape,
+                                                 dtype=h5_content.dtype)
+                new_h5_entry = h5_view.create_virtual_dataset(view_path, layout)
+                if not without_attrs:
+                    new_h5_entry.attrs.update(h5_content.attrs)
+                if attrs is not None and attrs[i]:
+                    new_h5_entry.attrs.update(attrs[i])
+
+            written.append(view_key)
+
+    h5_view.attrs["is_view"] = True
+    h5_view.flush()
+    return written
+
+
+def open_view(h5_view_path: str, mode: str = "a") -> h5py.File:
+    # virtual datasets require at least the HDF5 1.10 file format
+    return h5py.File(h5_view_path, mode, libver=("v110", "latest"))
+
+
+def materialize_view(h5_view_path: str, h5_target_path: str, compression: str | None = None) -> None:
+    """
+    Produces a physical copy of a dialect or subset view, e.g. for a training node which needs its data locally.
+    Virtual datasets are read through and written chunk-wise, external links are resolved and copied natively. The
+    metadata file next to the view is copied as well.
+    :param h5_view_path: View hdf5 created by add_samples_as_view
+    :param h5_target_path: Physical hdf5 which will be created or appended to
+    :param compression: Optional compression filter of the physical copy
+    :return:
+    """
+    logger.info(f"Materializing view {h5_view_path} into {h5_target_path}.")
+
+    with h5py.File(h5_view_path, "r") as h5_view, h5py.File(h5_target_path, "a") as h5_target:
+        keys = [(key, key) for key in list_sample_names(h5_view)]
+        written = transfer_samples(h5_view, h5_target, keys, compression=compression)
+
+    meta_data_view_path = h5_view_path.replace(".hdf5", ".txt")
+    if os.path.exists(meta_data_view_path):
+        shutil.copy2(meta_data_view_path, h5_target_path.replace(".hdf5", ".txt"))
+
+    logger.info(f"Materialized {len(written)} of {len(keys)} samples.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--view", type=str, required=True, help="Path to the dialect or subset view hdf5")
+    parser.add_argument("--target", type=str, required=True, help="Path of the physical hdf5 to create")
+    parser.add_argument("--compression", type=str, default=None, help="Optional compression, e.g. gzip or lzf")
+    args = parser.parse_args()
+    materialize_view(args.view, args.target, args.compression)
@@ -1,128 +1,86 @@
 import json
 import os
-from multiprocessing import Process
+from collections import defaultdict
+from typing import Iterator
 
-import h5py
-import pandas as pd
-
-from src.processing.utils import SWISSDIAL_CANTON_TO_DIALECT, SWISSDIAL_DATASET_PATH, SNF_DATASET_PATH
-from src.transcription.utils import DIALECT_DATA_PATH, load_meta_data, get_h5_file, get_metadata_path, DIALECT_TO_TAG
+from src.processing.dialect_writer import DialectMoveJob, run_dialect_move
+from src.processing.utils import (SWISSDIAL_CANTON_TO_DIALECT, SWISSDIAL_DATASET_PATH, SNF_DATASET_PATH,
+                                  load_snf_duration_index)
+from src.transcription.utils import load_meta_data, get_h5_file, get_metadata_path
 from src.utils.data_points import DialectDataPoint
 from src.utils.logger import get_logger
 
-logger = get_logger(__name__)
-
-
-def get_dialect_meta_data_path(dialect: str) -> str:
-    return os.path.join(DIALECT_DATA_PATH, f"{dialect}.txt")
-
-
-def write_dialect_meta_data(dialect: str, dialect_content: list[DialectDataPoint]) -> None:
-    with open(get_dialect_meta_data_path(dialect), "wt", encoding="utf-8") as f:
-        f.writelines(line.to_string() for line in dialect_content)
-
+JOB_BATCH_SIZE = 256  # samples per job handed to a dialect writer
 
-def get_dialect_h5_path(dialect: str) -> str:
-    return os.path.join(DIALECT_DATA_PATH, f"{dialect}.hdf5")
-
-
-def get_dialect_files(dialect) -> tuple[list, str]:
-    meta_data_dialect_path = get_dialect_meta_data_path(dialect)
-    h5_file_dialect = get_dialect_h5_path(dialect)
-
-    if os.path.exists(meta_data_dialect_path):
-        meta_data_dialect, _ = load_meta_data(meta_data_dialect_path)
-    else:
-        meta_data_dialect = []
-
-    return meta_data_dialect, h5_file_dialect
+logger = get_logger(__name__)
 
 
-def start_podcast_move(podcast: str, dialect: str, samples: list) -> None:
-    logger.info(f"Performing move for dialect '{dialect}'.")
+def _podcast_jobs(podcast: str) -> Iterator[tuple[str, DialectMoveJob]]:
     h5_file_podcast = get_h5_file(podcast)
-    with h5py.File(h5_file_podcast, "r") as h5_podcast:
-        meta_data_dialect, h5_file_dialect = get_dialect_files(dialect)
-
-        with h5py.File(h5_file_dialect, "a") as h5_dialect:
-            for entry in samples:
-                if entry.sample_name in h5_dialect:
-                    continue
-
-                h5_content = h5_podcast[entry.sample_name]
-                # specifically using [()] instead of [:] to reduce operation time as we are not slicing
-                new_h5_entry = h5_dialect.create_dataset(entry.sample_name, dtype=float, data=h5_content[()])
-
-                # Copy attributes such as DID, phoneme, mel spec etc.
-                for attr_name, attr_value in h5_content.attrs.items():
-                    new_h5_entry.attrs[attr_name] = attr_value
-
-                h5_dialect.flush()
-                entry.dataset_name = podcast
-                meta_data_dialect.append(entry.convert_to_dialect_datapoint())
+    meta_data, _ = load_meta_data(get_metadata_path(podcast))
 
-        write_dialect_meta_data(dialect, meta_data_dialect)
+    # Group metadata by dialect
+    dialects = defaultdict(list)
+    for entry in meta_data:
+        entry.dataset_name = podcast
+        dialects[entry.dialect].append(entry)
 
-    logger.info(f"Finished move for dialect '{dialect}'.")
+    for dialect, samples in dialects.items():
+        for start_idx in range(0, len(samples), JOB_BATCH_SIZE):
+            batch = samples[start_idx:start_idx + JOB_BATCH_SIZE]
+            # Copies attributes such as DID, phoneme, mel spec etc. together with the audio
+            yield dialect, DialectMoveJob(h5_file_podcast, [(e.sample_name, e.sample_name) for e in batch],
+                                          [e.convert_to_dialect_datapoint() for e in batch])
 
 
-def move_podcast_to_dialect(podcast: str) -> None:
+def move_podcast_to_dialect(podcast: str, as_view: bool = False, hierarchical: bool = False) -> None:
     """
-    Runs move of dialect data in parallel to reduce time
+    Moves a single podcast into the dialect hdf5s.
     :param podcast:
+    :param as_view: Do not duplicate audio but create dialect views referencing the podcast hdf5, see h5_views
+    :param hierarchical: Create new dialect hdf5s with samples grouped by dataset and episode, see h5_layout
     :return:
     """
-    logger.info(f"Starting concurrent move of podcast '{podcast}' to dialect hdf5.")
-
-    # Load metadata and initialize dialects
-    meta_data, _ = load_meta_data(get_metadata_path(podcast))
-    dialects = {key: [] for key in DIALECT_TO_TAG.keys()}
-    os.makedirs(DIALECT_DATA_PATH, exist_ok=True)
-
-    # Group metadata by dialect
-    for entry in meta_data:
-        dialects[entry.dialect].append(entry)
-
-    processes = [
-        Process(target=start_podcast_move, args=(podcast, dialect, samples))
-        for dialect, samples in dialects.items() if samples  # if contains entries then make process
-    ]
+    move_to_dialects([podcast], as_view=as_view, hierarchical=hierarchical)
 
-    for process in processes:
-        process.start()
-
-    for process in processes:
-        process.join()
 
+def move_to_dialects(podcasts: list[str], include_stt4sg: bool = False, include_swissdial: bool = False,
+                     as_view: bool = False, num_readers: int = 4, hierarchical: bool = False) -> None:
+    """
+    Runs move of dialect data in parallel to reduce time. Any number of podcasts and corpora are read concurrently
+    while every dialect hdf5 is written by a single writer, see dialect_writer.
+    :param podcasts: Podcasts to move
+    :param include_stt4sg: Also move the SNF / STT4SG corpus
+    :param include_swissdial: Also move the SwissDial corpus
+    :param as_view: Do not duplicate audio but create dialect views referencing the source hdf5s, see h5_views
+    :param num_readers: Number of processes reading source metadata
+    :param hierarchical: Create new dialect hdf5s with samples grouped by dataset and episode, see h5_layout
+    :return:
+    """
+    logger.info(f"Starting concurrent move of {len(podcasts)} podcasts to dialect hdf5.")
 
-def _load_snf_tsv_for_duration() -> dict:
-    path = "src/config"
-    train = f"{path}/train_all.tsv"
-    test = f"{path}/test.tsv"
-    valid = f"{path}/valid.tsv"
-    sample_to_duration = {}
+    tasks = [(_podcast_jobs, (podcast,)) for podcast in podcasts]
+    if include_stt4sg:
+        tasks.extend(_get_stt4sg_tasks())
+    if include_swissdial:
+        tasks.extend((_swissdial_canton_jobs, (canton,)) for canton in SWISSDIAL_CANTON_TO_DIALECT.keys())
 
-    for file in [train, test, valid]:
-        df = pd.read_csv(file, sep="\t")
-        for index, row in df.iterrows():
-            # path thingy is something custom because I just copy ready made h5s, check your env and replace as needed
-            sample_to_duration[row["path"].replace("/", "-").replace(".flac", "")] = round(float(row["duration"]), 4)
-    return sample_to_duration
+    run_dialect_move(tasks, as_view=as_view, num_readers=num_readers, hierarchical=hierarchical)
 
 
-def create_datapoints_for_stt4sg_corpus_speaker(speaker: str, speaker_path: str, parse_duration: bool = False) -> list[
-    DialectDataPoint]:
+def create_datapoints_for_stt4sg_corpus_speaker(speaker: str, speaker_path: str, parse_duration: bool = False,
+                                                dialect: str = "") -> list[DialectDataPoint]:
     """
     As SNF / STT4SG corpus was prepared to be used with a speaker based folder structure its required to parse through
     each speaker and load their samples into the hdf5
     :param speaker:
     :param speaker_path:
     :param parse_duration:
+    :param dialect:
     :return:
     """
     data = []
-    if parse_duration:
-        sample_to_duration = _load_snf_tsv_for_duration()
+    sample_to_duration = load_snf_duration_index() if parse_duration else {}
     with open(f"{speaker_path}/metadata.txt", "rt", encoding="utf-8") as meta_file:
         for line in meta_file:
             split_line = line.split("|")
@@ -132,65 +90,33 @@ def create_datapoints_for_stt4sg_corpus_speaker(speaker: str, speaker_path: str,
                 sample_name=sample_name,
                 duration=sample_to_duration[sample_name] if parse_duration else -1.0,
                 speaker_id=speaker,
+                dialect=dialect,
                 de_text=split_line[1],
             ))
     return data
 
 
-def load_stt4sg_speakers_to_dialect(dialect: str, speakers: list) -> None:
-    logger.info(f"Starting move for dialect '{dialect}' for SNF.")
-    meta_data_dialect, h5_file_dialect = get_dialect_files(dialect)
-
-    with h5py.File(h5_file_dialect, "a") as h5_dialect:
-        for speaker in speakers:
-            speaker_path = f"{SNF_DATASET_PATH}/speakers/{speaker}"
-            meta_data_speaker = create_datapoints_for_stt4sg_corpus_speaker(speaker, speaker_path, True)
-            with h5py.File(f"{speaker_path}/audio.h5", "r") as h5_read:
-                for entry in meta_data_speaker:
-                    # I want uniformity in hdf5 keys of type SAMPLE_CUTID with only one underscore or just SAMPLE
-                    new_sample_name = entry.sample_name.split("-")[-1]
-                    if new_sample_name in h5_dialect:
-                        continue
-
-                    h5_content = h5_read[entry.sample_name]
-                    # specifically using [()] instead of [:] to reduce operation time as we are not slicing
-                    new_h5_entry = h5_dialect.create_dataset(new_sample_name, dtype=float, data=h5_content[()])
-
-                    # Create essential attributes
-                    new_h5_entry.attrs["dataset_name"] = entry.dataset_name
-                    new_h5_entry.attrs["speaker"] = entry.speaker_id
-                    new_h5_entry.attrs["de_text"] = entry.de_text
-                    new_h5_entry.attrs["did"] = dialect
-                    h5_dialect.flush()
+def _stt4sg_speaker_jobs(dialect: str, speaker: str) -> Iterator[tuple[str, DialectMoveJob]]:
+    speaker_path = f"{SNF_DATASET_PATH}/speakers/{speaker}"
+    meta_data_speaker = create_datapoints_for_stt4sg_corpus_speaker(speaker, speaker_path, True, dialect)
+    # I want uniformity in hdf5 keys of type SAMPLE_CUTID with only one underscore or just SAMPLE
+    keys = [(entry.sample_name, entry.sample_name.split("-")[-1]) for entry in meta_data_speaker]
+    # Create essential attributes
+    attrs = [{"dataset_name": entry.dataset_name, "speaker": entry.speaker_id, "de_text": entry.de_text,
+              "did": dialect} for entry in meta_data_speaker]
+    yield dialect, DialectMoveJob(f"{speaker_path}/audio.h5", keys, meta_data_speaker, attrs, without_attrs=True)
 
-                    entry.sample_name = new_sample_name
-                    meta_data_dialect.append(entry)
 
-        write_dialect_meta_data(dialect, meta_data_dialect)
-        logger.info(f"Finished move for dialect '{dialect}'.")
-
-
-def move_stt4sg_corpus_to_dialect() -> None:
+def _get_stt4sg_tasks() -> list[tuple]:
     with open(os.path.join(SNF_DATASET_PATH, "speaker_to_dialect.json"), "rt", encoding="utf-8") as f:
         speaker_to_dialect = json.loads(f.read())
 
-    dialects = {key: [] for key in DIALECT_TO_TAG.keys()}
-    os.makedirs(DIALECT_DATA_PATH, exist_ok=True)
-
-    # Group metadata by dialect
-    for speaker, dialect in speaker_to_dialect.items():
-        dialects[dialect].append(speaker)
-
-    processes = [
-        Process(target=load_stt4sg_speakers_to_dialect, args=(dialect, samples))
-        for dialect, samples in dialects.items() if samples  # if contains entries then make process
-    ]
+    load_snf_duration_index()  # built once here, the reader processes inherit it on fork
+    return [(_stt4sg_speaker_jobs, (dialect, speaker)) for speaker, dialect in speaker_to_dialect.items()]
 
-    for process in processes:
-        process.start()
 
-    for process in processes:
-        process.join()
+def move_stt4sg_corpus_to_dialect() -> None:
+    move_to_dialects([], include_stt4sg=True)
 
 
 def create_datapoint_for_canton(canton: str) -> list[DialectDataPoint]:
@@ -209,60 +135,25 @@ def create_datapoint_for_canton(canton: str) -> list[DialectDataPoint]:
                 sample_name=split_line[0],
                 duration=-1.0,
                 speaker_id=f"SPEAKER_ch_{canton}",
+                dialect=SWISSDIAL_CANTON_TO_DIALECT[canton],
                 de_text=split_line[1],
             ))
     return data
 
 
-def move_swissdial_canton_to_dialect(canton: str) -> None:
+def _swissdial_canton_jobs(canton: str) -> Iterator[tuple[str, DialectMoveJob]]:
     dialect = SWISSDIAL_CANTON_TO_DIALECT[canton]
-    logger.info(f"Starting move for dialect '{dialect}' for SwissDial.")
-
     meta_data = create_datapoint_for_canton(canton)
     canton_path = f"{SWISSDIAL_DATASET_PATH}/{canton}"
 
-    with h5py.File(f"{canton_path}/audio.h5", "r") as h5_read:
-        meta_data_dialect, h5_file_dialect = get_dialect_files(dialect)
-
-        with h5py.File(h5_file_dialect, "a") as h5_dialect:
-            for entry in meta_data:
-
-                # I want uniformity in hdf5 keys of type SAMPLE_CUTID with only one underscore
-                new_sample_name = entry.sample_name.replace(f"ch_{canton}", f"ch-{canton}")
-
-                if new_sample_name in h5_dialect:
-                    continue
-
-                h5_content = h5_read[entry.sample_name]
-                # specifically using [()] instead of [:] to reduce operation time as we are not slicing
-                new_h5_entry = h5_dialect.create_dataset(new_sample_name, dtype=float, data=h5_content[()])
-
-                # Create essential attributes
-                new_h5_entry.attrs["dataset_name"] = entry.dataset_name
-                new_h5_entry.attrs["speaker"] = entry.speaker_id
-                new_h5_entry.attrs["de_text"] = entry.de_text
-                new_h5_entry.attrs["did"] = dialect
-                h5_dialect.flush()
-
-                entry.sample_name = new_sample_name
-                meta_data_dialect.append(entry)
-
-        write_dialect_meta_data(dialect, meta_data_dialect)
-
-    logger.info(f"Finished move for dialect '{dialect}'.")
+    # I want uniformity in hdf5 keys of type SAMPLE_CUTID with only one underscore
+    keys = [(entry.sample_name, entry.sample_name.replace(f"ch_{canton}", f"ch-{canton}")) for entry in meta_data]
+    # Create essential attributes
+    attrs = [{"dataset_name": entry.dataset_name, "speaker": entry.speaker_id, "de_text": entry.de_text,
+              "did": dialect} for entry in meta_data]
+    yield dialect, DialectMoveJob(f"{canton_path}/audio.h5", keys, meta_data, attrs, without_attrs=True)
 
 
 def move_swissdial_to_dialect() -> None:
-    aargau = "ag"
-    processes = [
-        Process(target=move_swissdial_canton_to_dialect, args=(canton,))
-        for canton, dialect in SWISSDIAL_CANTON_TO_DIALECT.items() if canton != aargau
-    ]
-
-    for process in processes:
-        process.start()
-
-    for process in processes:
-        process.join()
-
-    move_swissdial_canton_to_dialect(aargau)  # wait for Zurich to be done so no issues with concurrency occur
+    # Aargau and Zürich share a dialect hdf5, the single writer per dialect makes this safe to run concurrently
+    move_to_dialects([], include_swissdial=True)
@@ -4,7 +4,10 @@ from collections import defaultdict
 
 import h5py
 
+from src.processing.h5_transfer import transfer_samples
 from src.transcription.utils import load_meta_data, MISSING_TEXT
+from src.utils.catalog import register_samples, LOCATION_SUBSET
+from src.utils.h5_layout import contains_sample, open_h5
 from src.utils.logger import get_logger
 from src.utils.paths import TTS_PODCASTS_PATH, TTS_TRAINING_SUBSETS_PATH
 
@@ -32,31 +35,25 @@ def move_to_h5(grouped_samples: list) -> None:
             logger.error("Tried to create new h5 group")
             return
 
-        with h5py.File(h5_subset_file, "a") as h5_subset:
+        with open_h5(h5_subset_file, "a") as h5_subset:
             for podcast, samples in dataset_grouped.items():
                 swissnlp_dataset_h5_path = os.path.join(TTS_PODCASTS_PATH, f"{podcast}.hdf5")
 
                 with h5py.File(swissnlp_dataset_h5_path, "r") as h5_swiss_nlp:
                     for sample in samples:
-                        if sample.sample_name in h5_subset:
-                            logger.warning(f"Sample {sample.sample_name} already exists in subset file. "
-                                           f"Skipping or overwriting.")
-                            # Optionally: del h5_subset[sample.sample_name]
+                        if contains_sample(h5_subset, sample.sample_name, sample.dataset_name):
+                            logger.warning(f"Sample {sample.sample_name} already exists in subset file. Skipping.")
 
-                        h5_content = h5_swiss_nlp[sample.sample_name]
-                        # specifically using [()] instead of [:] to reduce operation time as we are not slicing
-                        new_h5_entry = h5_subset.create_dataset(sample.sample_name, dtype=float, data=h5_content[()])
-
-                        # Copy attributes such as DID, phoneme, mel spec etc.
-                        for attr_name, attr_value in h5_content.attrs.items():
-                            new_h5_entry.attrs[attr_name] = attr_value
-
-                        h5_subset.flush()
-                        meta_data_subset.append(sample)
+                    # Copies attributes such as DID, phoneme, mel spec etc. together with the audio
+                    written = set(transfer_samples(h5_swiss_nlp, h5_subset,
+                                                   [(s.sample_name, s.sample_name) for s in samples]))
+                    meta_data_subset.extend(sample for sample in samples if sample.sample_name in written)
 
         with open(meta_data_subset_path, "wt", encoding="utf-8") as f:
             f.writelines(line.to_string() for line in meta_data_subset)
 
+        register_samples(meta_data_subset, h5_subset_file, LOCATION_SUBSET)
+
 
 def add_swissdial_dataset(grouped_samples: list) -> list:
     podcast_samples, _ = load_meta_data(os.path.join(TTS_PODCASTS_PATH, f"SwissDial.txt"), load_as_dialect=True)
@@ -1,13 +1,18 @@
 import os
-import random
 import shutil
 from collections import defaultdict
 from multiprocessing import Process
 
 import h5py
 
-from src.transcription.utils import load_meta_data, MISSING_TEXT
+from src.processing.h5_transfer import transfer_samples
+from src.processing.h5_views import add_samples_as_view, open_view
+from src.processing.subset_balancer import plan_balanced_subsets
+from src.processing.subset_planner import plan_subsets_streaming, iter_podcast_samples, get_subset_plan_file
+from src.transcription.utils import load_meta_data
+from src.utils.catalog import register_samples, LOCATION_SUBSET
 from src.utils.data_points import DialectDataPoint
+from src.utils.h5_layout import open_h5, get_layout, HIERARCHICAL_LAYOUT
 from src.utils.logger import get_logger
 from src.utils.paths import SCRATCH_PATH, TTS_PODCASTS_PATH, TTS_TRAINING_SUBSETS_PATH, CLUSTER_PROJECTS_TTS
 
@@ -15,6 +20,8 @@ TARGET_HOURS = 1107  # This is approximately 500GB of audio when sampled at 16kH
 # TARGET_HOURS = 11.07  # This is approximately 5GB of audio when sampled at 16kHz
 TARGET_DURATION = TARGET_HOURS * 3600  # convert to seconds
 SCRATCH_H5_PATH = os.path.join(SCRATCH_PATH, "transcribed")
+SUBSET_PLAN_PATH = os.path.join(SCRATCH_PATH, "subset_plan")
+TTS_TRAINING_SUBSET_VIEWS_PATH = os.path.join(TTS_TRAINING_SUBSETS_PATH, "views")
 
 logger = get_logger(__name__)
 
@@ -31,104 +38,133 @@ def get_subset_metadata(idx: int) -> str:
     return os.path.join(SCRATCH_PATH, f"subset_{idx}.txt")
 
 
+def get_subset_view_file(idx: int) -> str:
+    return os.path.join(TTS_TRAINING_SUBSET_VIEWS_PATH, f"subset_{idx}.hdf5")
+
+
 def write_subset_metadata(samples: list[DialectDataPoint], subset_path: str) -> None:
     with open(subset_path, "wt", encoding="utf-8") as f:
         f.writelines(line.to_string() for line in samples)
 
 
-def create_h5_subsets(h5_subset_idx: int, samples: list[DialectDataPoint]) -> None:
-    logger.info(f"Creating subset {h5_subset_idx} with {len(samples)} samples.")
+def create_h5_subset_view(h5_subset_idx: int, samples: list[DialectDataPoint]) -> None:
+    """
+    Same as create_h5_subsets but the subset only references the podcast hdf5s on projects instead of duplicating the
+    audio. Use h5_views.materialize_view to get a physical copy on the training node.
+    :param h5_subset_idx:
+    :param samples:
+    :return:
+    """
+    logger.info(f"Creating subset view {h5_subset_idx} with {len(samples)} samples.")
 
-    # group by podcast to reduce opening and closing podcast h5s due to read operations
     dataset_grouped = defaultdict(list)
     for s in samples:
         dataset_grouped[s.dataset_name].append(s)
 
-    h5_subset_file = get_h5_subset_file(h5_subset_idx)
-    meta_data_subset_path = get_subset_metadata(h5_subset_idx)
+    h5_subset_file = get_subset_view_file(h5_subset_idx)
+    meta_data_subset_path = h5_subset_file.replace(".hdf5", ".txt")
 
     if os.path.exists(meta_data_subset_path):
         meta_data_subset, _ = load_meta_data(meta_data_subset_path, load_as_dialect=True)
     else:
         meta_data_subset = []
 
-    with h5py.File(h5_subset_file, "a") as h5_subset:
+    with open_view(h5_subset_file) as h5_subset:
+        is_hierarchical = get_layout(h5_subset) == HIERARCHICAL_LAYOUT
         for podcast, samples in dataset_grouped.items():
-            with h5py.File(get_podcast_h5_on_scratch(podcast), "r") as h5_podcast:
-                for i, sample in enumerate(samples):
-                    if sample.sample_name in h5_subset:
-                        continue
-
-                    h5_content = h5_podcast[sample.sample_name]
-                    # specifically using [()] instead of [:] to reduce operation time as we are not slicing
-                    new_h5_entry = h5_subset.create_dataset(sample.sample_name, dtype=float, data=h5_content[()])
-
-                    # Copy attributes such as DID, phoneme, mel spec etc.
-                    for attr_name, attr_value in h5_content.attrs.items():
-                        new_h5_entry.attrs[attr_name] = attr_value
-
-                    h5_subset.flush()
-                    meta_data_subset.append(sample)
+            h5_podcast_file = os.path.join(TTS_PODCASTS_PATH, f"{podcast}.hdf5")
+            written = set(add_samples_as_view(h5_podcast_file, h5_subset, [(s.sample_name, s.sample_name)
+                                                                            for s in samples]))
+            meta_data_subset.extend(sample for sample in samples if sample.sample_name in written)
 
     write_subset_metadata(meta_data_subset, meta_data_subset_path)
-    shutil.copy2(h5_subset_file, TTS_TRAINING_SUBSETS_PATH)
-    shutil.copy2(meta_data_subset_path, TTS_TRAINING_SUBSETS_PATH)
-
-    logger.info(f"Finished creation of subset {h5_subset_idx}.")
+    register_samples(meta_data_subset, h5_subset_file, LOCATION_SUBSET, hierarchical=is_hierarchical)
 
+    logger.info(f"Finished creation of subset view {h5_subset_idx}.")
 
-def move_podcasts_to_subset() -> None:
-    shutil.copytree(TTS_PODCASTS_PATH, SCRATCH_H5_PATH, dirs_exist_ok=True)
-    # shutil.copytree(os.path.join(CLUSTER_PROJECTS_TTS, "test_h5_dir"), SCRATCH_H5_PATH, dirs_exist_ok=True)
 
-    # Load all metadata and shuffle samples
-    metadata_files = [file for file in os.listdir(SCRATCH_H5_PATH) if file.endswith(".txt")]
+def create_h5_subsets(h5_subset_idx: int, samples: list[DialectDataPoint], hierarchical: bool = False) -> None:
+    logger.info(f"Creating subset {h5_subset_idx} with {len(samples)} samples.")
 
-    all_samples = []
-    for metadata_file in metadata_files:
-        podcast_samples, _ = load_meta_data(os.path.join(SCRATCH_H5_PATH, metadata_file))
-        for sample in podcast_samples:
-            sample.dataset_name = metadata_file.replace(".txt", "")
+    # group by podcast to reduce opening and closing podcast h5s due to read operations
+    dataset_grouped = defaultdict(list)
+    for s in samples:
+        dataset_grouped[s.dataset_name].append(s)
 
-        podcast_samples = [sample.convert_to_dialect_datapoint()
-                           for sample in podcast_samples
-                           if sample.de_text != MISSING_TEXT
-                           and sample.dialect and sample.dialect != "English"
-                           and sample.dataset_name]
+    h5_subset_file = get_h5_subset_file(h5_subset_idx)
+    meta_data_subset_path = get_subset_metadata(h5_subset_idx)
 
-        assert len(podcast_samples) > 0, (f"Filtering lead to no actual samples being loaded for move to subset h5s"
-                                          f"in podcast {metadata_file}.")
-        all_samples.extend(podcast_samples)
+    if os.path.exists(meta_data_subset_path):
+        meta_data_subset, _ = load_meta_data(meta_data_subset_path, load_as_dialect=True)
+    else:
+        meta_data_subset = []
 
-    logger.info(f"Collected {len(all_samples)} samples from {len(metadata_files)} podcasts.")
+    with open_h5(h5_subset_file, "a", hierarchical) as h5_subset:
+        is_hierarchical = get_layout(h5_subset) == HIERARCHICAL_LAYOUT
+        for podcast, samples in dataset_grouped.items():
+            with h5py.File(get_podcast_h5_on_scratch(podcast), "r") as h5_podcast:
+                # Copies attributes such as DID, phoneme, mel spec etc. together with the audio
+                written = set(transfer_samples(h5_podcast, h5_subset, [(s.sample_name, s.sample_name) for s in samples]))
+                meta_data_subset.extend(sample for sample in samples if sample.sample_name in written)
 
-    random.seed(18670209)  # Sōseki!
-    random.shuffle(all_samples)
+    write_subset_metadata(meta_data_subset, meta_data_subset_path)
+    shutil.copy2(h5_subset_file, TTS_TRAINING_SUBSETS_PATH)
+    shutil.copy2(meta_data_subset_path, TTS_TRAINING_SUBSETS_PATH)
+    register_samples(meta_data_subset, os.path.join(TTS_TRAINING_SUBSETS_PATH, os.path.basename(h5_subset_file)),
+                     LOCATION_SUBSET, hierarchical=is_hierarchical)
 
-    # Create groups
-    grouped_samples = []
-    current_group = []
-    current_duration = 0.0
+    logger.info(f"Finished creation of subset {h5_subset_idx}.")
 
-    for sample in all_samples:
-        current_group.append(sample)
-        current_duration += sample.duration
 
-        if current_duration >= TARGET_DURATION:
-            grouped_samples.append(current_group)
-            current_group = []
-            current_duration = 0.0
+def create_subset_from_plan(h5_subset_idx: int, plan_file: str, as_view: bool = False,
+                            hierarchical: bool = False) -> None:
+    # the plan is loaded in the subset process so the parent never holds all samples at once
+    samples, _ = load_meta_data(plan_file, load_as_dialect=True)
+    if as_view:
+        create_h5_subset_view(h5_subset_idx, samples)
+    else:
+        create_h5_subsets(h5_subset_idx, samples, hierarchical)
+
+
+def move_podcasts_to_subset(as_view: bool = False, balanced: bool = False, keep_speakers_together: bool = True,
+                            hierarchical: bool = False) -> None:
+    """
+    Shuffles all podcast samples and distributes them into subsets of TARGET_HOURS, see subset_planner.
+    :param as_view: Do not duplicate audio but create subset views referencing the podcast hdf5s on projects
+    :param balanced: Use the stratified planner which balances hours per dialect over all subsets, see subset_balancer
+    :param keep_speakers_together: Only for the balanced planner, never split a speaker over multiple subsets
+    :param hierarchical: Create subset hdf5s with samples grouped by dataset and episode, see h5_layout
+    :return:
+    """
+    if as_view:
+        # views reference the podcast hdf5s on projects, copying them to scratch would be pointless
+        metadata_folder = TTS_PODCASTS_PATH
+        os.makedirs(TTS_TRAINING_SUBSET_VIEWS_PATH, exist_ok=True)
+    else:
+        shutil.copytree(TTS_PODCASTS_PATH, SCRATCH_H5_PATH, dirs_exist_ok=True)
+        # shutil.copytree(os.path.join(CLUSTER_PROJECTS_TTS, "test_h5_dir"), SCRATCH_H5_PATH, dirs_exist_ok=True)
+        metadata_folder = SCRATCH_H5_PATH
 
-    # Handle the last group
-    if current_group:
-        grouped_samples.append(current_group)
+    if balanced:
+        subsets = plan_balanced_subsets(iter_podcast_samples(metadata_folder), SUBSET_PLAN_PATH,
+                                        target_duration=TARGET_DURATION, keep_speakers_together=keep_speakers_together)
+    else:
+        # Stream all metadata through a seeded external shuffle and group into subsets of TARGET_DURATION
+        subsets = plan_subsets_streaming(iter_podcast_samples(metadata_folder), TARGET_DURATION, SUBSET_PLAN_PATH,
+                                         work_dir=SCRATCH_PATH)
+    logger.info(f"Collected {sum(count for _, count, _ in subsets)} samples into {len(subsets)} subsets.")
 
     os.makedirs(TTS_TRAINING_SUBSETS_PATH, exist_ok=True)
 
+    # the balanced planner spreads all samples evenly, only the remainder of the streaming planner can be tiny
+    skipped = [(i, count) for i, count, _ in subsets if count <= 1000]
+    for i, count in skipped:
+        logger.warning(f"Skipping subset {i} as it only contains {count} samples.")
+
     processes = [
-        Process(target=create_h5_subsets, args=(i, group))
-        for i, group in enumerate(grouped_samples) if len(group) > 1000  # if contains entries then make process
-        # for i, group in enumerate(grouped_samples)
+        Process(target=create_subset_from_plan, args=(i, get_subset_plan_file(SUBSET_PLAN_PATH, i), as_view,
+                                                      hierarchical))
+        for i, count, _ in subsets if count > 1000  # if contains entries then make process
     ]
 
     for process in processes:
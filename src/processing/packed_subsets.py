@@ -0,0 +1,214 @@
+import argparse
+import os
+import re
+
+import h5py
+import numpy as np
+
+from src.transcription.utils import load_meta_data
+from src.utils.catalog import register_samples, LOCATION_PACKED
+from src.utils.h5_layout import resolve_sample
+from src.utils.logger import get_logger
+from src.utils.paths import TTS_TRAINING_SUBSETS_PATH
+
+PACKED_DTYPE = np.float32
+PACKED_CHUNK_SIZE = 4 * 16000  # 4s of audio per chunk if the shard is compressed
+WRITE_BUFFER_SIZE = 64 * PACKED_CHUNK_SIZE  # values collected before a single write into the audio array
+
+# columns taken over from the per sample metadata and the per sample hdf5 attributes
+META_COLUMNS = ["sample_name", "dataset_name", "speaker_id", "dialect", "de_text"]
+ATTR_COLUMNS = ["phoneme", "ch_text"]
+
+logger = get_logger(__name__)
+
+
+def get_packed_subset_file(idx: int, folder: str = TTS_TRAINING_SUBSETS_PATH) -> str:
+    return os.path.join(folder, f"subset_{idx}_packed.hdf5")
+
+
+def is_packed_shard(h5: h5py.File) -> bool:
+    return "audio" in h5 and "offsets" in h5 and isinstance(h5["audio"], h5py.Dataset)
+
+
+class PackedShard:
+    """
+    Reader for a packed shard: all clips of a subset are stored back to back in a single 1-D "audio" array and are
+    located through the "offsets" and "lengths" columns. Uncompressed shards are read zero-copy through np.memmap,
+    compressed shards are read in whole chunks of which the last one is kept, so sequential reads decode every chunk
+    only once. The hdf5 handle is opened lazily per process, which makes the reader safe to use after a fork.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pid = None
+        self._h5 = None
+        self._audio = None
+        self._memmap = None
+        self._block = (0, 0, None)  # start, end and content of the last chunk aligned read
+
+        with h5py.File(path, "r") as h5:
+            self.offsets = h5["offsets"][:]
+            self.lengths = h5["lengths"][:]
+            self.sample_rate = int(h5.attrs.get("sample_rate", 16000))
+            self.columns = {name: h5[name].asstr()[:] for name in META_COLUMNS + ATTR_COLUMNS if name in h5}
+            self.durations = h5["duration"][:] if "duration" in h5 else self.lengths / self.sample_rate
+
+        self._index = {name: i for i, name in enumerate(self.columns["sample_name"])}
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __contains__(self, sample_name: str) -> bool:
+        return sample_name in self._index
+
+    def _open(self) -> None:
+        if self._pid == os.getpid():
+            return
+
+        self._pid = os.getpid()
+        self._h5 = h5py.File(self.path, "r")
+        self._audio = self._h5["audio"]
+        self._block = (0, 0, None)
+
+        file_offset = self._audio.id.get_offset()
+        if self._audio.chunks is None and file_offset is not None:
+            self._memmap = np.memmap(self.path, dtype=self._audio.dtype, mode="r", offset=file_offset,
+                                     shape=self._audio.shape)
+        else:
+            self._memmap = None
+
+    def index_of(self, sample_name: str) -> int:
+        return self._index[sample_name]
+
+    def get_audio(self, idx: int) -> np.ndarray:
+        """
+        Returns the audio of the clip at position idx. For uncompressed shards this is a read-only view into the
+        memory mapped file, copy it if it needs to be modified.
+        """
+        self._open()
+        start = int(self.offsets[idx])
+        end = start + int(self.lengths[idx])
+
+        if self._memmap is not None:
+            return self._memmap[start:end]
+        if self._audio.chunks is None:
+            # contiguous but without allocated storage (empty shard), nothing to memory map
+            return self._audio[start:end]
+
+        block_start, block_end, block = self._block
+        if block is None or start < block_start or end > block_end:
+            chunk_size = self._audio.chunks[0]
+            block_start = (start // chunk_size) * chunk_size
+            block_end = min(-(-end // chunk_size) * chunk_size, self._audio.shape[0])
+            block = self._audio[block_start:block_end]
+            self._block = (block_start, block_end, block)
+
+        return block[start - block_start:end - block_start]
+
+    def get_sample(self, sample_name: str) -> np.ndarray:
+        return self.get_audio(self.index_of(sample_name))
+
+    def get_column(self, column: str, idx: int) -> str:
+        return self.columns[column][idx] if column in self.columns else ""
+
+    def close(self) -> None:
+        if self._h5 is not None and self._pid == os.getpid():
+            self._h5.close()
+        self._h5 = None
+        self._audio = None
+        self._memmap = None
+        self._pid = None
+
+
+def _write_string_column(h5: h5py.File, name: str, values: list[str]) -> None:
+    h5.create_dataset(name, data=np.array(values, dtype=object), dtype=h5py.string_dtype())
+
+
+def _get_str_attr(h5_content: h5py.Dataset, attr: str) -> str:
+    value = h5_content.attrs.get(attr, "")
+    return value if isinstance(value, str) else ""
+
+
+def convert_subset_to_packed(subset_h5_path: str, meta_data_path: str, packed_path: str,
+                             compression: str | None = None) -> None:
+    """
+    Converts a subset in the one-dataset-per-clip layout into a packed shard. Clips are stored in metadata order.
+    :param subset_h5_path: Path to subset_{i}.hdf5
+    :param meta_data_path: Path to subset_{i}.txt
+    :param packed_path: Path of the packed shard to create
+    :param compression: Optional compression filter, uncompressed shards can be memory mapped
+    :return:
+    """
+    logger.info(f"Packing {subset_h5_path} into {packed_path}.")
+    meta_data, _ = load_meta_data(meta_data_path, load_as_dialect=True)
+
+    with h5py.File(subset_h5_path, "r") as h5_subset:
+        h5_contents = [resolve_sample(h5_subset, sample.sample_name, sample.dataset_name) for sample in meta_data]
+        num_missing = sum(h5_content is None for h5_content in h5_contents)
+        if num_missing:
+            logger.warning(f"{num_missing} samples of the metadata are missing in {subset_h5_path}, skipping them.")
+            meta_data = [sample for sample, h5_content in zip(meta_data, h5_contents) if h5_content is not None]
+            h5_contents = [h5_content for h5_content in h5_contents if h5_content is not None]
+
+        # only shapes are read here, the audio is read once in the loop below
+        lengths = np.array([h5_content.shape[0] for h5_content in h5_contents], dtype=np.int64)
+        offsets = np.zeros_like(lengths)
+        offsets[1:] = np.cumsum(lengths)[:-1]
+        total_length = int(lengths.sum())
+
+        attr_columns = {attr: [] for attr in ATTR_COLUMNS}
+
+        with h5py.File(packed_path, "w") as h5_packed:
+            audio = h5_packed.create_dataset(
+                "audio", shape=(total_length,), dtype=PACKED_DTYPE,
+                chunks=(min(PACKED_CHUNK_SIZE, max(1, total_length)),) if compression else None,
+                compression=compression)
+
+            buffer = []
+            buffer_start = 0
+            buffer_length = 0
+            for h5_content in h5_contents:
+                buffer.append(h5_content[()].astype(PACKED_DTYPE, copy=False))
+                buffer_length += buffer[-1].shape[0]
+                for attr in ATTR_COLUMNS:
+                    attr_columns[attr].append(_get_str_attr(h5_content, attr))
+
+                if buffer_length >= WRITE_BUFFER_SIZE:
+                    audio[buffer_start:buffer_start + buffer_length] = np.concatenate(buffer)
+                    buffer_start += buffer_length
+                    buffer, buffer_length = [], 0
+
+            if buffer:
+                audio[buffer_start:buffer_start + buffer_length] = np.concatenate(buffer)
+
+            h5_packed.create_dataset("offsets", data=offsets)
+            h5_packed.create_dataset("lengths", data=lengths)
+            h5_packed.create_dataset("duration", data=np.array([s.duration for s in meta_data], dtype=np.float64))
+            for column in META_COLUMNS:
+                _write_string_column(h5_packed, column, [getattr(sample, column) for sample in meta_data])
+            for attr, values in attr_columns.items():
+                _write_string_column(h5_packed, attr, values)
+
+            h5_packed.attrs["sample_rate"] = 16000
+            h5_packed.attrs["source"] = os.path.basename(subset_h5_path)
+
+    register_samples(meta_data, packed_path, LOCATION_PACKED, offsets=offsets.tolist(), lengths=lengths.tolist())
+
+    logger.info(f"Packed {len(meta_data)} samples with {total_length / 16000 / 3600:.2f}h of audio.")
+
+
+def convert_subsets_to_packed(folder: str = TTS_TRAINING_SUBSETS_PATH, compression: str | None = None) -> None:
+    subset_files = [file for file in os.listdir(folder) if re.fullmatch(r"subset_\d+\.hdf5", file)]
+    for subset_file in sorted(subset_files):
+        idx = int(re.findall(r"\d+", subset_file)[0])
+        convert_subset_to_packed(os.path.join(folder, subset_file),
+                                 os.path.join(folder, subset_file.replace(".hdf5", ".txt")),
+                                 get_packed_subset_file(idx, folder), compression)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folder", type=str, default=TTS_TRAINING_SUBSETS_PATH, help="Folder with subset_{i}.hdf5")
+    parser.add_argument("--compression", type=str, default=None, help="Optional compression, e.g. gzip or lzf")
+    args = parser.parse_args()
+    convert_subsets_to_packed(args.folder, args.compression)
@@ -0,0 +1,157 @@
+import math
+import os
+import re
+import shutil
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from src.processing.subset_planner import SUBSET_SEED, get_subset_plan_file
+from src.utils.data_points import DialectDataPoint
+from src.utils.logger import get_logger
+
+BALANCE_TOLERANCE = 0.02  # allowed relative deviation of a subset from the mean per dialect and in total
+DIARIZATION_SPEAKER = re.compile(r"SPEAKER_\d+")
+
+logger = get_logger(__name__)
+
+
+def _speaker_key(sample: DialectDataPoint) -> str:
+    # diarization labels such as SPEAKER_00 are only unique within an episode, corpus speaker ids are global
+    if DIARIZATION_SPEAKER.fullmatch(sample.speaker_id):
+        return f"{sample.dataset_name}/{sample.orig_episode_name}/{sample.speaker_id}"
+    return f"{sample.dataset_name}/{sample.speaker_id}"
+
+
+def samples_to_frame(samples: Iterator[DialectDataPoint]) -> pd.DataFrame:
+    columns = {"speaker": [], "dialect": [], "duration": [], "line": []}
+    for sample in samples:
+        columns["speaker"].append(_speaker_key(sample))
+        columns["dialect"].append(sample.dialect)
+        columns["duration"].append(sample.duration)
+        columns["line"].append(sample.to_string())
+
+    df = pd.DataFrame(columns)
+    df["speaker"] = df["speaker"].astype("category")
+    df["dialect"] = df["dialect"].astype("category")
+    return df
+
+
+def _assign_speakers_lpt(df: pd.DataFrame, num_subsets: int) -> np.ndarray:
+    """
+    Leakage guarded assignment: all samples of a speaker go into the same subset. Speakers are assigned largest first
+    (LPT) to the subset with the fewest hours of the speakers' main dialect, ties broken by the total hours.
+    """
+    speaker_codes = df["speaker"].cat.codes.to_numpy()
+    dialect_codes = df["dialect"].cat.codes.to_numpy()
+    durations = df["duration"].to_numpy()
+    num_speakers = len(df["speaker"].cat.categories)
+
+    speaker_duration = np.bincount(speaker_codes, weights=durations, minlength=num_speakers)
+    # main dialect of a speaker, DID runs per episode so a speaker can rarely carry more than one
+    main_dialect = (pd.DataFrame({"speaker": speaker_codes, "dialect": dialect_codes, "duration": durations})
+                    .groupby(["speaker", "dialect"])["duration"].sum().reset_index()
+                    .sort_values("duration", kind="stable").drop_duplicates("speaker", keep="last"))
+    speaker_dialect = np.zeros(num_speakers, dtype=np.int64)
+    speaker_dialect[main_dialect["speaker"].to_numpy()] = main_dialect["dialect"].to_numpy()
+
+    dialect_load = np.zeros((len(df["dialect"].cat.categories), num_subsets))
+    total_load = np.zeros(num_subsets)
+    speaker_subset = np.zeros(num_speakers, dtype=np.int64)
+
+    for speaker in np.argsort(-speaker_duration, kind="stable"):
+        load = dialect_load[speaker_dialect[speaker]]
+        candidates = np.flatnonzero(load == load.min())
+        subset = candidates[np.argmin(total_load[candidates])]
+        speaker_subset[speaker] = subset
+        dialect_load[speaker_dialect[speaker], subset] += speaker_duration[speaker]
+        total_load[subset] += speaker_duration[speaker]
+
+    return speaker_subset[speaker_codes]
+
+
+def _assign_samples_snake(df: pd.DataFrame, num_subsets: int, seed: int) -> np.ndarray:
+    """
+    Unguarded assignment: within every dialect samples are ordered by duration (random among equal durations) and dealt
+    out in snake order 0..N-1, N-1..0, which balances hours per dialect and in total. Samples of a speaker land at random
+    positions of that order and are therefore spread evenly over all subsets.
+    """
+    dialect_codes = df["dialect"].cat.codes.to_numpy()
+    tie_breaker = np.random.default_rng(seed).permutation(len(df))
+    order = np.lexsort((tie_breaker, -df["duration"].to_numpy(), dialect_codes))
+
+    # position of every sample within its dialect in the sorted order
+    sorted_dialects = dialect_codes[order]
+    rank = np.empty(len(df), dtype=np.int64)
+    rank[order] = np.arange(len(df)) - np.searchsorted(sorted_dialects, sorted_dialects, side="left")
+
+    cycle, position = np.divmod(rank, num_subsets)
+    return np.where(cycle % 2 == 0, position, num_subsets - 1 - position)
+
+
+def report_balance(df: pd.DataFrame, subset: np.ndarray, tolerance: float) -> bool:
+    hours = pd.crosstab(df["dialect"], subset, values=df["duration"] / 3600, aggfunc="sum").fillna(0.0)
+    hours.loc["Total"] = hours.sum(axis=0)
+    logger.info(f"Hours per dialect and subset:\n{hours.round(2)}")
+
+    deviation = (hours.sub(hours.mean(axis=1), axis=0).abs().max(axis=1) / hours.mean(axis=1)).fillna(0.0)
+    within_tolerance = bool((deviation <= tolerance).all())
+    if not within_tolerance:
+        logger.warning(f"Subsets exceed the balance tolerance of {tolerance:.1%}:\n{deviation[deviation > tolerance]}")
+
+    subsets_per_speaker = pd.Series(subset).groupby(df["speaker"].cat.codes.to_numpy()).nunique()
+    logger.info(f"{int((subsets_per_speaker > 1).sum())} of {len(subsets_per_speaker)} speakers are spread over more "
+                f"than one subset, on average over {subsets_per_speaker.mean():.2f} subsets.")
+    return within_tolerance
+
+
+def plan_balanced_subsets(samples: Iterator[DialectDataPoint], plan_dir: str, num_subsets: int | None = None,
+                          target_duration: float | None = None, keep_speakers_together: bool = True,
+                          tolerance: float = BALANCE_TOLERANCE, seed: int = SUBSET_SEED) -> list[tuple[int, int, float]]:
+    """
+    Stratified planner assigning every sample to one of num_subsets subsets so that per dialect hours and total hours
+    are balanced. With keep_speakers_together all samples of a speaker end up in the same subset (leakage guard),
+    otherwise samples are dealt out per dialect which additionally balances the hours of every speaker. No sample is
+    dropped. The plan is written in the same format as plan_subsets_streaming, see subset_planner.list_subset_plan.
+    Raises a ValueError and writes no plan if a subset deviates from the mean hours by more than the tolerance.
+    :param samples: Stream of candidate samples
+    :param plan_dir: Folder the subset plan is written to, existing plan files are replaced
+    :param num_subsets: Number of subsets, derived from target_duration if not given
+    :param target_duration: Approximate duration of a subset in seconds, used if num_subsets is not given
+    :param keep_speakers_together: Leakage guard, never split a speaker over multiple subsets
+    :param tolerance: Allowed relative deviation from the mean hours per dialect and in total
+    :param seed: Seed for ties
+    :return: Tuples of (subset index, number of samples, duration in seconds)
+    """
+    df = samples_to_frame(samples)
+    assert len(df) > 0, "No samples to plan subsets for."
+
+    if num_subsets is None:
+        assert target_duration is not None, "Either num_subsets or target_duration is required."
+        num_subsets = max(1, math.ceil(df["duration"].sum() / target_duration))
+
+    if keep_speakers_together:
+        subset = _assign_speakers_lpt(df, num_subsets)
+    else:
+        subset = _assign_samples_snake(df, num_subsets, seed)
+
+    if not report_balance(df, subset, tolerance):
+        raise ValueError(f"Subsets exceed the balance tolerance of {tolerance:.1%}, plan fewer subsets, allow "
+                         f"splitting speakers or raise the tolerance.")
+
+    if os.path.exists(plan_dir):
+        shutil.rmtree(plan_dir)
+    os.makedirs(plan_dir)
+
+    subsets = []
+    for idx in range(num_subsets):
+        mask = subset == idx
+        with open(get_subset_plan_file(plan_dir, idx), "wt", encoding="utf-8") as f:
+            f.writelines(df["line"].to_numpy()[mask])
+        subsets.append((idx, int(mask.sum()), float(df["duration"].to_numpy()[mask].sum())))
+
+    for idx, count, duration in subsets:
+        logger.info(f"Planned subset {idx} with {count} samples and {duration / 3600:.2f}h.")
+
+    return subsets
@@ -0,0 +1,143 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from typing import Iterator
+
+from src.transcription.utils import MISSING_TEXT
+from src.utils.data_points import DatasetDataPoint, DialectDataPoint
+from src.utils.logger import get_logger
+
+SUBSET_SEED = 18670209  # Sōseki!
+NUM_SHUFFLE_BUCKETS = 256  # peak memory of the planner is roughly 1 / NUM_SHUFFLE_BUCKETS of all metadata
+
+logger = get_logger(__name__)
+
+
+def get_subset_plan_file(plan_dir: str, idx: int) -> str:
+    return os.path.join(plan_dir, f"subset_{idx}.txt")
+
+
+def list_subset_plan(plan_dir: str) -> list[tuple[int, str]]:
+    """
+    A subset plan is a folder with one metadata file per subset in the dialect metadata format. It is the manifest
+    the copy stage (create_h5_subsets) consumes, independent of the planner which produced it.
+    :return: Pairs of (subset index, plan file) sorted by index
+    """
+    plan = [(int(re.findall(r"\d+", file)[0]), os.path.join(plan_dir, file))
+            for file in os.listdir(plan_dir) if re.fullmatch(r"subset_\d+\.txt", file)]
+    return sorted(plan)
+
+
+def _shuffle_key(seed: int, sample: DialectDataPoint) -> int:
+    digest = hashlib.blake2b(f"{seed}/{sample.dataset_name}/{sample.sample_name}".encode("utf-8"), digest_size=8)
+    return int.from_bytes(digest.digest(), "big")
+
+
+def is_subset_candidate(sample: DialectDataPoint) -> bool:
+    return (sample.de_text != MISSING_TEXT
+            and sample.dialect and sample.dialect != "English"
+            and sample.dataset_name != "")
+
+
+def iter_podcast_samples(metadata_folder: str) -> Iterator[DialectDataPoint]:
+    """
+    Streams the samples of all podcast metadata files line by line instead of loading them all at once. Only samples
+    which may end up in a training subset are returned.
+    """
+    metadata_files = sorted(file for file in os.listdir(metadata_folder) if file.endswith(".txt"))
+    for metadata_file in metadata_files:
+        podcast = metadata_file.replace(".txt", "")
+        num_samples = 0
+
+        with open(os.path.join(metadata_folder, metadata_file), "rt", encoding="utf-8") as meta_file:
+            for line in meta_file:
+                sample = DatasetDataPoint.load_single_datapoint(line.replace('\n', '').split('\t'))
+                sample.dataset_name = podcast
+                sample = sample.convert_to_dialect_datapoint()
+                if not is_subset_candidate(sample):
+                    continue
+
+                num_samples += 1
+                yield sample
+
+        assert num_samples > 0, (f"Filtering lead to no actual samples being loaded for move to subset h5s"
+                                 f"in podcast {metadata_file}.")
+
+
+def plan_subsets_streaming(samples: Iterator[DialectDataPoint], target_duration: float, plan_dir: str,
+                           seed: int = SUBSET_SEED, num_buckets: int = NUM_SHUFFLE_BUCKETS,
+                           work_dir: str | None = None) -> list[tuple[int, int, float]]:
+    """
+    Seeded external shuffle of all samples followed by grouping into subsets of target_duration seconds, in bounded
+    memory. Every sample gets a 64-bit key from hashing the seed with its dataset and sample name. In the first pass
+    samples are spilled into num_buckets files by the top bits of their key, in the second pass every bucket is sorted
+    by key on its own and the samples are assigned to subsets in key order. The assignment is therefore reproducible
+    and independent of the order in which metadata files are read.
+    :param samples: Stream of candidate samples
+    :param target_duration: Duration of a subset in seconds
+    :param plan_dir: Folder the subset plan is written to, existing plan files are replaced
+    :param seed: Shuffle seed
+    :param num_buckets: Number of spill files, a power of two
+    :param work_dir: Folder for the spill files, defaults to the system temp folder
+    :return: Tuples of (subset index, number of samples, duration in seconds)
+    """
+    assert num_buckets & (num_buckets - 1) == 0, "num_buckets must be a power of two."
+    bucket_shift = 64 - (num_buckets.bit_length() - 1)
+
+    if os.path.exists(plan_dir):
+        shutil.rmtree(plan_dir)
+    os.makedirs(plan_dir)
+
+    subsets = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as spill_dir:
+        bucket_files = [open(os.path.join(spill_dir, f"bucket_{b}.txt"), "wt", encoding="utf-8")
+                        for b in range(num_buckets)]
+        num_samples = 0
+        try:
+            for sample in samples:
+                key = _shuffle_key(seed, sample)
+                bucket_files[key >> bucket_shift].write(f"{key}\t{sample.to_string()}")
+                num_samples += 1
+        finally:
+            for bucket_file in bucket_files:
+                bucket_file.close()
+
+        logger.info(f"Spilled {num_samples} samples into {num_buckets} buckets.")
+
+        subset_idx = 0
+        subset_samples = 0
+        subset_duration = 0.0
+        subset_file = open(get_subset_plan_file(plan_dir, subset_idx), "wt", encoding="utf-8")
+        try:
+            for b in range(num_buckets):
+                with open(os.path.join(spill_dir, f"bucket_{b}.txt"), "rt", encoding="utf-8") as bucket_file:
+                    lines = [line.split("\t", 1) for line in bucket_file]
+                lines.sort(key=lambda x: int(x[0]))
+
+                for _, sample_line in lines:
+                    subset_file.write(sample_line)
+                    subset_samples += 1
+                    subset_duration += float(sample_line.split("\t", 3)[2])  # dialect format, duration is third
+
+                    if subset_duration >= target_duration:
+                        subsets.append((subset_idx, subset_samples, subset_duration))
+                        subset_file.close()
+                        subset_idx += 1
+                        subset_samples = 0
+                        subset_duration = 0.0
+                        subset_file = open(get_subset_plan_file(plan_dir, subset_idx), "wt", encoding="utf-8")
+        finally:
+            subset_file.close()
+
+    # Handle the last group
+    if subset_samples > 0:
+        subsets.append((subset_idx, subset_samples, subset_duration))
+    else:
+        os.remove(get_subset_plan_file(plan_dir, subset_idx))
+
+    for idx, count, duration in subsets:
+        logger.info(f"Planned subset {idx} with {count} samples and {duration / 3600:.2f}h.")
+
+    return subsets
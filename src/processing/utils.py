@@ -1,6 +1,10 @@
 import os
+import pickle
+from functools import lru_cache
 
-from src.utils.paths import CLUSTER_PROJECTS_PATH, CLUSTER_PROJECTS_TTS
+import pandas as pd
+
+from src.utils.paths import CLUSTER_PROJECTS_PATH, CLUSTER_PROJECTS_TTS, SCRATCH_PATH
 
 CLUSTER_PROJECTS_DERI = os.path.join(CLUSTER_PROJECTS_PATH, "deri_tts")
 
@@ -17,3 +21,48 @@ SWISSDIAL_CANTON_TO_DIALECT = {
     "bs": "Basel",
     "ag": "Zürich",
 }
+
+SNF_DURATION_TSVS = ["train_all.tsv", "test.tsv", "valid.tsv"]
+SNF_DURATION_CACHE_PATH = os.path.join(SCRATCH_PATH, "snf_duration_index.pkl")
+
+
+def _get_tsv_signature(tsv_paths: list[str]) -> list[tuple[str, float, int]]:
+    return [(path, os.path.getmtime(path), os.path.getsize(path)) for path in tsv_paths]
+
+
+def _build_snf_duration_index(tsv_paths: list[str]) -> dict[str, float]:
+    df = pd.concat([pd.read_csv(path, sep="\t", usecols=["path", "duration"]) for path in tsv_paths],
+                   ignore_index=True)
+    # path thingy is something custom because I just copy ready made h5s, check your env and replace as needed
+    keys = df["path"].str.replace("/", "-", regex=False).str.replace(".flac", "", regex=False)
+    return dict(zip(keys, df["duration"].astype(float).round(4)))
+
+
+@lru_cache(maxsize=4)
+def load_snf_duration_index(folder: str = SNF_DATASET_PATH,
+                            cache_path: str | None = SNF_DURATION_CACHE_PATH) -> dict[str, float]:
+    """
+    Maps SNF / STT4SG sample names to their duration from the corpus TSVs. The index is built once per process and
+    cached on disk, the disk cache is rebuilt as soon as the modification time or size of one of the TSVs changes.
+    Build it in the parent before forking workers so they inherit it.
+    :param folder: Folder holding the TSVs of the corpus
+    :param cache_path: Pickle holding the index, None to disable the disk cache
+    :return:
+    """
+    tsv_paths = [os.path.join(folder, tsv) for tsv in SNF_DURATION_TSVS]
+    signature = _get_tsv_signature(tsv_paths)
+
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+        if cached["signature"] == signature:
+            return cached["index"]
+
+    index = _build_snf_duration_index(tsv_paths)
+    if cache_path is not None:
+        # write to a temporary file first so concurrent readers never see a partial cache
+        with open(f"{cache_path}.{os.getpid()}", "wb") as f:
+            pickle.dump({"signature": signature, "index": index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{cache_path}.{os.getpid()}", cache_path)
+
+    return index
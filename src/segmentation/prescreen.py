@@ -0,0 +1,125 @@
+import os
+
+import numpy as np
+import pandas as pd
+from joblib import load
+
+from src.classification.dialect_classifier import MODEL_PATH_DID, PHON_DID_CLS
+from src.download.utils import load_podcast_metadata_from_csv, save_podcast_metadata_to_csv, get_podcast_path
+from src.transcription.phoneme_engine import PhonemeEngine
+from src.transcription.transcribe_to_phoneme import MODEL_AUDIO_PHONEME
+from src.transcription.utils import META_WRITE_ITERATIONS
+from src.utils.audio import DecoderPool, get_audio_duration
+from src.utils.logger import get_logger
+
+NUM_WINDOWS = 8
+WINDOW_DURATION = 15.0  # seconds, same as the maximal segment length
+EPISODE_MARGIN = 60.0  # seconds skipped at start and end of an episode, intros and outros are often jingles
+MIN_WINDOW_PHONEMES = 20  # windows with fewer phonemes contain music or silence and do not vote
+MIN_VOTING_WINDOWS = 3
+
+SKIP_LANGUAGES = ("English",)  # DID classes which are out of scope for SwissGPC
+MIN_SKIP_PROBABILITY = 0.8  # mean DID probability of the language over the voting windows
+MIN_SKIP_AGREEMENT = 0.75  # share of voting windows predicting the language
+
+COLUMN_LANGUAGE = "prescreen_language"
+COLUMN_PROBABILITY = "prescreen_probability"
+COLUMN_SKIP = "prescreen_skip"
+
+logger = get_logger(__name__)
+
+
+def get_window_offsets(duration: float) -> list[float]:
+    """:return: Start of exactly NUM_WINDOWS windows spread evenly over the episode without its margins"""
+    margin = EPISODE_MARGIN if duration > 2 * EPISODE_MARGIN + WINDOW_DURATION else 0.0
+    last_start = max(duration - margin - WINDOW_DURATION, margin)
+    return np.linspace(margin, last_start, NUM_WINDOWS).round(2).tolist()
+
+
+def classify_windows(phonemes: list[str], text_clf) -> tuple[str | None, float, float]:
+    """
+    :param phonemes: Phoneme transcripts of the windows of an episode
+    :return: Most probable DID class over the voting windows, its mean probability and the share of windows voting for
+    it, None if too few windows contain speech
+    """
+    texts = [phoneme.replace(" ", "") for phoneme in phonemes if len(phoneme.replace(" ", "")) >= MIN_WINDOW_PHONEMES]
+    if len(texts) < MIN_VOTING_WINDOWS:
+        return None, 0.0, 0.0
+
+    probabilities = text_clf.predict_proba(texts)
+    mean_probabilities = probabilities.mean(axis=0)
+    best = int(np.argmax(mean_probabilities))
+    agreement = float(np.mean(probabilities.argmax(axis=1) == best))
+    return PHON_DID_CLS[text_clf.classes_[best]], float(mean_probabilities[best]), agreement
+
+
+def is_out_of_scope(language: str | None, probability: float, agreement: float) -> bool:
+    return language in SKIP_LANGUAGES and probability >= MIN_SKIP_PROBABILITY and agreement >= MIN_SKIP_AGREEMENT
+
+
+def prescreen_podcast(podcast: str, episode_ids: list[str] | None = None) -> pd.DataFrame:
+    """
+    Runs phoneme recognition and the DID classifier on NUM_WINDOWS short windows of every episode before it is
+    diarized. Episodes classified as out of scope with high confidence are marked to be skipped, the decisions are
+    written to the podcast metadata CSV and episodes with a decision are not screened again.
+    :param episode_ids: Episodes to screen, all episodes of the podcast if None
+    :return: Podcast metadata with the prescreen columns
+    """
+    df = load_podcast_metadata_from_csv(podcast)
+    podcast_path = get_podcast_path(podcast)
+    for column, default in ((COLUMN_LANGUAGE, ""), (COLUMN_PROBABILITY, np.nan), (COLUMN_SKIP, False)):
+        if column not in df.columns:
+            df[column] = default
+    df[COLUMN_LANGUAGE] = df[COLUMN_LANGUAGE].fillna("").astype(str)
+    df[COLUMN_SKIP] = df[COLUMN_SKIP].fillna(False).astype(bool)
+
+    to_screen = df[df[COLUMN_PROBABILITY].isna()]
+    if episode_ids is not None:
+        to_screen = to_screen[to_screen["id"].isin(episode_ids)]
+    episode_paths = {i: os.path.join(podcast_path, f"{ep_id}.mp3") for i, ep_id in to_screen["id"].items()}
+    episode_paths = {i: path for i, path in episode_paths.items() if os.path.exists(path)}
+    if not episode_paths:
+        return df
+
+    logger.info(f"Prescreening {len(episode_paths)} episodes of {podcast} on {NUM_WINDOWS} windows each.")
+    engine = PhonemeEngine(MODEL_AUDIO_PHONEME)
+    text_clf = load(MODEL_PATH_DID)
+
+    # windows arrive in job order, every episode is classified as soon as its NUM_WINDOWS windows are decoded
+    jobs = ((path, offset, WINDOW_DURATION) for path in episode_paths.values()
+            for offset in get_window_offsets(get_audio_duration(path)))
+    episodes = iter(episode_paths.items())
+    windows = []
+    skipped_minutes = 0.0
+    iteration_count = 0
+    with DecoderPool() as pool:
+        for window_idx, (_, audio) in enumerate(pool.imap(jobs)):
+            if audio is not None and len(audio):
+                windows.append(audio)
+            if (window_idx + 1) % NUM_WINDOWS:
+                continue
+
+            i, path = next(episodes)
+            phonemes = [result["text"] for result in engine.transcribe(windows)]
+            windows = []
+            language, probability, agreement = classify_windows(phonemes, text_clf)
+            skip = is_out_of_scope(language, probability, agreement)
+
+            df.at[i, COLUMN_LANGUAGE] = language or ""
+            df.at[i, COLUMN_PROBABILITY] = round(probability, 4)
+            df.at[i, COLUMN_SKIP] = skip
+            if skip:
+                skipped_minutes += get_audio_duration(path) / 60
+                logger.info(f"Skipping episode {df.at[i, 'id']}, classified as {language} with p={probability:.2f} "
+                            f"in {agreement:.0%} of the windows.")
+
+            # Save progress of the prescreen in case of failure
+            iteration_count += 1
+            if iteration_count >= META_WRITE_ITERATIONS:
+                save_podcast_metadata_to_csv(podcast, df)
+                iteration_count = 0
+
+    save_podcast_metadata_to_csv(podcast, df)
+    logger.info(f"Prescreen skips {int(df.loc[list(episode_paths), COLUMN_SKIP].sum())} of {len(episode_paths)} "
+                f"episodes of {podcast} ({skipped_minutes:.1f} audio minutes).")
+    return df
@@ -1,29 +1,37 @@
 import json
 import os
+import resource
 import shutil
 from typing import TextIO
 
 import h5py
-import librosa
+import numpy as np
+import soundfile as sf
+import torch
 import whisperx
-from pydub import AudioSegment
 
 from src.download.utils import PODCAST_AUDIO_FOLDER, load_podcast_metadata_from_csv, get_podcast_path
 from src.segmentation.filter_strategies import filter_segments_using_strats
+from src.segmentation.prescreen import prescreen_podcast, COLUMN_SKIP
+from src.segmentation.speaker_embeddings import SpeakerEmbedder, SpeakerStitcher
+from src.segmentation.vad import get_speech_regions, trim_to_speech, remap_segments, save_speech_regions, \
+    report_skipped_minutes
+from src.utils.audio import DecoderPool, decode_audio, get_audio_duration
+from src.utils.catalog import register_samples, LOCATION_PODCAST
+from src.utils.data_points import DatasetDataPoint
 from src.utils.logger import get_logger
 from src.utils.paths import SCRATCH_PATH, TTS_PODCASTS_PATH, MODEL_PATH, TTS_RAW_AUDIO_PATH
 
 HF_ACCESS_TOKEN = os.getenv("HF_ACCESS_TOKEN")
 
 SAMPLING_RATE = 16000
+# whole episodes are decoded ahead for cutting, a 3h episode is ~690MB as float32
+EPISODE_DECODER_WORKERS = 2
+WINDOW_OVERLAP = 60.0  # seconds diarized by both neighbouring windows of windowed diarization
 
 logger = get_logger(__name__)
 
 
-def _load_sample(path: str) -> AudioSegment:
-    return AudioSegment.from_file(path)
-
-
 def _load_txt_meta(podcast: str) -> [TextIO, set]:
     """
     Built as sample_name -> track_id -> duration -> track_start -> track_end -> speaker -> de_text
@@ -56,17 +64,32 @@ def get_hdf5_file(podcast: str, copy_to_projects: bool = False) -> str:
 
 
 def diarize_and_segment_podcast(podcast: str, do_diarization: bool = True, do_segmentation: bool = True,
-                                copy_to_projects: bool = False) -> None:
+                                copy_to_projects: bool = False, use_vad: bool = False, prescreen: bool = False,
+                                window_duration: float | None = None) -> None:
+    """
+    :param use_vad: Only pass the speech regions found by the VAD pre-pass to transcription and diarization
+    :param window_duration: Diarize episodes longer than this many seconds in overlapping windows with bounded memory
+    :param prescreen: Screen episodes which are not diarized yet for their language and skip out of scope episodes
+    """
     df = load_podcast_metadata_from_csv(podcast)
     podcast_path = get_podcast_path(podcast)
 
+    if do_diarization and prescreen:
+        not_diarized = [ep_id for ep_id in df["id"] if not os.path.exists(get_diarized_file_path(podcast_path, ep_id))]
+        df = prescreen_podcast(podcast, not_diarized)
+    skipped_episodes = set(df.loc[df[COLUMN_SKIP].astype(bool), "id"]) if COLUMN_SKIP in df.columns else set()
+
     if do_diarization:
         for i, row in df.iterrows():
             ep_id = row["id"]
             episode_path = get_episode_path(podcast_path, ep_id)
             diarized_file_path = get_diarized_file_path(podcast_path, ep_id)
 
-            if not os.path.exists(episode_path):
+            if ep_id in skipped_episodes:
+                logger.info(f"Episode {ep_id} is out of scope according to the prescreen.")
+                continue
+
+            elif not os.path.exists(episode_path):
                 logger.error(f"Episode {ep_id} does not exist in {podcast} audio.")
                 continue
 
@@ -75,7 +98,10 @@ def diarize_and_segment_podcast(podcast: str, do_diarization: bool = True, do_se
                 continue
 
             else:
-                diarize_episode(podcast_path, ep_id)
+                diarize_episode(podcast, ep_id, use_vad=use_vad, window_duration=window_duration)
+
+        if use_vad:
+            report_skipped_minutes(podcast_path, df["id"].tolist())
 
     if do_segmentation:
         if copy_to_projects:
@@ -83,67 +109,186 @@ def diarize_and_segment_podcast(podcast: str, do_diarization: bool = True, do_se
             shutil.copytree(podcast_path, os.path.join(SCRATCH_PATH, podcast), dirs_exist_ok=True)
             podcast_path = os.path.join(SCRATCH_PATH, podcast)
 
-        h5_file_path = get_hdf5_file(podcast, copy_to_projects)
-        with h5py.File(h5_file_path, "a" if os.path.exists(h5_file_path) else "w") as h5:
-            for i, row in df.iterrows():
-                ep_id = row["id"]
-                diarized_file_path = get_diarized_file_path(podcast_path, ep_id)
+        episodes = []
+        for ep_id in df["id"]:
+            if ep_id in skipped_episodes:
+                continue
+            elif not os.path.exists(get_diarized_file_path(podcast_path, ep_id)):
+                logger.error(f"Episode {ep_id} diarization does not exist in {podcast} folder.")
+            else:
+                episodes.append(ep_id)
 
-                if not os.path.exists(diarized_file_path):
-                    logger.error(f"Episode {ep_id} diarization does not exist in {podcast} folder.")
+        h5_file_path = get_hdf5_file(podcast, copy_to_projects)
+        # the next episodes are decoded in the pool while the current one is cut
+        with h5py.File(h5_file_path, "a" if os.path.exists(h5_file_path) else "w") as h5, \
+                DecoderPool(num_workers=EPISODE_DECODER_WORKERS, max_in_flight=EPISODE_DECODER_WORKERS) as pool:
+            episode_paths = [get_episode_path(podcast_path, ep_id) for ep_id in episodes]
+            for ep_id, (_, audio) in zip(episodes, pool.imap(episode_paths)):
+                if audio is None:
                     continue
-                else:
-                    cut_episode_into_segments(podcast, ep_id, h5, copy_to_projects=copy_to_projects)
+                cut_episode_into_segments(podcast, ep_id, h5, copy_to_projects=copy_to_projects, audio=audio)
 
         if copy_to_projects:
             shutil.copy2(os.path.join(SCRATCH_PATH, f"{podcast}.hdf5"), TTS_PODCASTS_PATH)
             shutil.copy2(os.path.join(PODCAST_AUDIO_FOLDER, f"{podcast}.txt"), TTS_PODCASTS_PATH)
 
 
-def diarize_episode(podcast: str, ep_id: str) -> list:
-    device = "cuda"
-    batch_size = 32  # reduce if low on GPU mem
-    compute_type = "float16"  # change to "int8" if low on GPU mem (may reduce accuracy)
-    podcast_path = get_podcast_path(podcast)
-    episode_path = get_episode_path(podcast_path, ep_id)
+def log_peak_memory(label: str) -> dict:
+    """
+    Logs the peak resident memory of the process and the peak GPU memory allocated through torch (alignment, pyannote)
+    since the last torch.cuda.reset_peak_memory_stats(), allocations of CTranslate2 for whisper are not tracked by
+    torch. The resident peak cannot be reset, it covers everything the process did before.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on linux
+    peak_gpu = torch.cuda.max_memory_allocated() / 1024 ** 2 if torch.cuda.is_available() else 0.0
+    logger.info(f"{label}: peak RSS of the process {peak_rss:.0f} MiB, peak GPU memory {peak_gpu:.0f} MiB.")
+    return {"peak_rss_mib": peak_rss, "peak_gpu_mib": peak_gpu}
 
-    logger.info(f"Diarizing episode {ep_id}")
 
+def _load_whisperx_models(device: str, compute_type: str) -> tuple:
     # 1. Transcribe with original whisper (batched)
     model = whisperx.load_model("large-v3", device, language="de", compute_type=compute_type,
                                 download_root=MODEL_PATH)
+    # 2. Align whisper output
+    model_a, metadata = whisperx.load_align_model(language_code="de", device=device)
+    # 3. Assign speaker labels
+    diarize_model = whisperx.DiarizationPipeline(use_auth_token=HF_ACCESS_TOKEN, device=device)
+    return model, model_a, metadata, diarize_model
 
-    audio = whisperx.load_audio(episode_path)
-    result = model.transcribe(audio, batch_size=batch_size, chunk_size=15, language="de")
-    # logger.info(result["segments"])  # before alignment
 
-    # delete model if low on GPU resources
-    # import gc; gc.collect(); torch.cuda.empty_cache(); del model
+def _diarize_audio(audio: np.ndarray, models: tuple, device: str, batch_size: int, use_vad: bool,
+                   embedder: SpeakerEmbedder | None = None) -> tuple[list, dict, np.ndarray | None]:
+    """
+    :param embedder: Embed the speakers pyannote found, used to stitch windows
+    :return: whisperx segments in time of audio, speaker to (embedding, duration) and the VAD speech regions
+    """
+    model, model_a, metadata, diarize_model = models
+    regions = None
+    if use_vad:
+        regions = get_speech_regions(audio)
+        if len(regions) == 0:
+            return [], {}, regions
+        audio, trimmed_starts = trim_to_speech(audio, regions)
 
-    # 2. Align whisper output
-    model_a, metadata = whisperx.load_align_model(language_code=result["language"], device=device)
+    result = model.transcribe(audio, batch_size=batch_size, chunk_size=15, language="de")
     result = whisperx.align(result["segments"], model_a, metadata, audio, device, return_char_alignments=False)
 
-    # logger.info(result["segments"])  # after alignment
-    # delete model if low on GPU resources
-    # import gc; gc.collect(); torch.cuda.empty_cache(); del model_a
-
-    # 3. Assign speaker labels
-    diarize_model = whisperx.DiarizationPipeline(use_auth_token=HF_ACCESS_TOKEN, device=device)
-
     # add min/max number of speakers if known
-    # diarize_segments = diarize_model(audio)
     diarize_segments = diarize_model(audio)
-
     result = whisperx.assign_word_speakers(diarize_segments, result)
+
+    speakers = {}
+    if embedder is not None:
+        turns = [(row.start, row.end, row.speaker) for row in diarize_segments.itertuples()]
+        speakers = embedder.embed_speakers(audio, turns)
+
+    if use_vad:
+        result["segments"] = remap_segments(result["segments"], regions, trimmed_starts)
+    return result["segments"], speakers, regions
+
+
+def _diarize_windows(episode_path: str, duration: float, window_duration: float, models: tuple, device: str,
+                     batch_size: int, use_vad: bool) -> tuple[list, np.ndarray | None]:
+    """
+    Diarizes windows of window_duration seconds overlapping by WINDOW_OVERLAP, only one window is decoded at a time.
+    Speakers are stitched across windows by their embeddings and every segment is kept from the window which contains
+    its middle with the most context, i.e. the window boundaries are in the middle of the overlaps.
+    :return: Segments in episode time and the VAD speech regions
+    """
+    embedder = SpeakerEmbedder(device)
+    stitcher = SpeakerStitcher()
+    offsets = np.arange(0.0, max(duration - WINDOW_OVERLAP, 1.0), window_duration)
+    segments, regions = [], []
+
+    for k, offset in enumerate(offsets):
+        own_start = offset + WINDOW_OVERLAP / 2 if k > 0 else 0.0
+        own_end = offset + window_duration + WINDOW_OVERLAP / 2 if k < len(offsets) - 1 else np.inf
+
+        audio = decode_audio(episode_path, offset, window_duration + WINDOW_OVERLAP)
+        window_segments, speakers, window_regions = _diarize_audio(audio, models, device, batch_size, use_vad,
+                                                                   embedder)
+        del audio
+        mapping = stitcher.assign(speakers)
+
+        for segment in window_segments:
+            # speakers without a turn long enough to embed stay local to their window
+            for item in [segment] + segment.get("words", []):
+                for key in ("start", "end"):
+                    if key in item:
+                        item[key] = round(item[key] + offset, 3)
+                if "speaker" in item:
+                    item["speaker"] = mapping.get(item["speaker"], f"{item['speaker']}_W{k}")
+            if own_start <= (segment["start"] + segment["end"]) / 2 < own_end:
+                segments.append(segment)
+
+        if use_vad and len(window_regions):
+            window_regions = np.clip(window_regions + offset, own_start, own_end)
+            regions.append(window_regions[window_regions[:, 1] > window_regions[:, 0]])
+        logger.info(f"Diarized window {k + 1} of {len(offsets)} ({offset / 60:.0f} min), {len(mapping)} speakers "
+                    f"matched to {len(stitcher.centroids)} episode speakers.")
+
+    if not use_vad:
+        return segments, None
+    return segments, np.concatenate(regions) if regions else np.zeros((0, 2))
+
+
+def diarize_episode_segments(episode_path: str, use_vad: bool = False,
+                             window_duration: float | None = None) -> tuple[list, np.ndarray | None, float]:
+    """
+    Transcribes, aligns and diarizes an episode with whisperx.
+    :param use_vad: Trim jingles, music beds and silences with the VAD pre-pass first, timestamps of the segments are
+    mapped back to episode time
+    :param window_duration: Episodes longer than this (plus WINDOW_OVERLAP) are diarized in windows of this many
+    seconds to bound the memory, None to always diarize the full episode
+    :return: Segments, VAD speech regions (None without VAD) and duration of the episode
+    """
+    device = "cuda"
+    batch_size = 32  # reduce if low on GPU mem
+    compute_type = "float16"  # change to "int8" if low on GPU mem (may reduce accuracy)
+
+    duration = get_audio_duration(episode_path)
+    models = _load_whisperx_models(device, compute_type)
+    if window_duration is not None and duration > window_duration + WINDOW_OVERLAP:
+        segments, regions = _diarize_windows(episode_path, duration, window_duration, models, device, batch_size,
+                                             use_vad)
+    else:
+        audio = whisperx.load_audio(episode_path)
+        segments, _, regions = _diarize_audio(audio, models, device, batch_size, use_vad)
+    return segments, regions, duration
+
+
+def diarize_episode(podcast: str, ep_id: str, use_vad: bool = False, window_duration: float | None = None) -> list:
+    """
+    Diarizes an episode (see diarize_episode_segments) and saves the segments next to the episode.
+    """
+    podcast_path = get_podcast_path(podcast)
+    episode_path = get_episode_path(podcast_path, ep_id)
+
+    logger.info(f"Diarizing episode {ep_id}")
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    segments, regions, duration = diarize_episode_segments(episode_path, use_vad, window_duration)
+
+    if use_vad:
+        skipped = save_speech_regions(podcast_path, ep_id, regions, duration)
+        logger.info(f"VAD kept {len(regions)} speech regions of episode {ep_id}, skipping {skipped / 60:.1f} minutes.")
+        if len(regions) == 0:
+            logger.warning(f"VAD found no speech in episode {ep_id}.")
+
     with open(get_diarized_file_path(podcast_path, ep_id), "w", encoding='utf8') as f:
-        json.dump(result["segments"], f, indent=4)
+        json.dump(segments, f, indent=4)
 
-    return result["segments"]
+    log_peak_memory(f"Diarization of episode {ep_id}")
+    return segments
 
 
 def cut_episode_into_segments(podcast: str, episode_id: str, h5: h5py.File, save_filtered_output: bool = False,
-                              save_cuts_as_mp3: bool = False, copy_to_projects: bool = False) -> None:
+                              save_cuts_as_mp3: bool = False, copy_to_projects: bool = False,
+                              audio: np.ndarray | None = None) -> None:
+    """
+    Cuts the diarized segments of an episode out of the decoded episode and writes them into the podcast hdf5.
+    :param audio: Episode already decoded to float32 mono at SAMPLING_RATE, decoded here if not given
+    """
     logger.info(f"Segmenting episode {episode_id}")
 
     podcast_path = get_podcast_path(podcast)
@@ -166,25 +311,22 @@ def cut_episode_into_segments(podcast: str, episode_id: str, h5: h5py.File, save
         with open(diarized_file_path.replace(".json", "_merged.json"), "w", encoding='utf8') as f:
             json.dump(filtered_segments, f, indent=4)
 
-    audio = _load_sample(episode_path)
+    if audio is None:
+        audio = decode_audio(episode_path)
+    new_samples = []
 
     for i, segment in enumerate(filtered_segments):
         segment_id = start_id + i
         segment_name = f"{episode_id}_{segment_id}"
-        segment_path = os.path.join(podcast_path, f"{segment_name}.wav")
 
         if segment_name in already_processed:
             logger.debug(f"Cut {segment_id} of episode {episode_id} is already cut.")
             continue
 
         duration = segment["end"] - segment["start"]
-        start_ms = segment["start"] * 1000
-        end_ms = segment["end"] * 1000
-
-        audio_segment = audio[start_ms: end_ms]
-        audio_segment.export(segment_path, format="wav")  # write segment to os for librosa to load in target SR
+        speech = audio[int(round(segment["start"] * SAMPLING_RATE)):int(round(segment["end"] * SAMPLING_RATE))]
         if save_cuts_as_mp3:
-            audio_segment.export(segment_path.replace("wav", "mp3"), format="mp3")  # write segment to os
+            sf.write(os.path.join(podcast_path, f"{segment_name}.mp3"), speech, SAMPLING_RATE, format="MP3")
 
         duration = round(duration, 4)
         speaker = segment['speaker']
@@ -192,8 +334,6 @@ def cut_episode_into_segments(podcast: str, episode_id: str, h5: h5py.File, save
         track_end = round(segment['end'], 4)
         de_text = segment["text"].strip()
 
-        speech, _ = librosa.load(segment_path, sr=SAMPLING_RATE)
-
         h5_entry = h5.create_dataset(segment_name, dtype=float, data=speech)
         h5_entry.attrs["dataset_name"] = podcast
         h5_entry.attrs["speaker"] = speaker
@@ -205,7 +345,11 @@ def cut_episode_into_segments(podcast: str, episode_id: str, h5: h5py.File, save
 
         metadata_txt.write(
             f"{segment_name}\t{segment_id}\t{duration}\t{track_start}\t{track_end}\t{speaker}\t{de_text}\n")
-
-        os.remove(segment_path)  # keep disk space clean
+        new_samples.append(DatasetDataPoint(segment_name, duration, track_start, track_end, segment_id, speaker,
+                                            de_text))
 
     metadata_txt.close()
+
+    # the hdf5 on scratch is copied to projects after segmentation, register the final location
+    h5_file = os.path.join(TTS_PODCASTS_PATH, f"{podcast}.hdf5") if copy_to_projects else h5.filename
+    register_samples(new_samples, h5_file, LOCATION_PODCAST, dataset_name=podcast)
@@ -0,0 +1,115 @@
+import os
+
+import numpy as np
+import torch
+from pyannote.audio import Inference, Model
+
+from src.utils.logger import get_logger
+
+HF_ACCESS_TOKEN = os.getenv("HF_ACCESS_TOKEN")
+
+SAMPLING_RATE = 16000
+EMBEDDING_MODEL = "pyannote/wespeaker-voxceleb-resnet34-LM"  # embedding model of pyannote/speaker-diarization-3.1
+MIN_TURN_DURATION = 1.0  # shorter turns are mostly backchannels and overlaps
+MAX_EMBEDDING_DURATION = 60.0  # seconds of the longest turns of a speaker which are embedded
+SPEAKER_MATCH_THRESHOLD = 0.5  # minimal cosine similarity of two embeddings of the same speaker
+
+logger = get_logger(__name__)
+
+
+def cosine_similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """:return: Cosine similarity of every row of a with every row of b, shape (len(a), len(b))"""
+    a = a / np.linalg.norm(a, axis=1, keepdims=True).clip(min=1e-10)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True).clip(min=1e-10)
+    return a @ b.T
+
+
+class SpeakerEmbedder:
+    """
+    Embeds the voice of a speaker from the turns pyannote assigned to them, the embeddings of the same speaker are
+    close in cosine similarity across windows, episodes and podcasts.
+
+        embedder = SpeakerEmbedder()
+        speakers = embedder.embed_speakers(audio, [(start, end, "SPEAKER_00"), ...])
+    """
+
+    def __init__(self, device: str = "cuda"):
+        model = Model.from_pretrained(EMBEDDING_MODEL, use_auth_token=HF_ACCESS_TOKEN)
+        self.inference = Inference(model, window="whole", device=torch.device(device))
+
+    def embed(self, audio: np.ndarray) -> np.ndarray:
+        waveform = torch.from_numpy(np.asarray(audio, dtype=np.float32))[None, :]
+        embedding = np.asarray(self.inference({"waveform": waveform, "sample_rate": SAMPLING_RATE})).reshape(-1)
+        return embedding / max(np.linalg.norm(embedding), 1e-10)
+
+    def embed_speakers(self, audio: np.ndarray, turns: list[tuple[float, float, str]]) -> dict[str, tuple]:
+        """
+        :param audio: Audio the turns refer to, at SAMPLING_RATE
+        :param turns: (start, end, speaker) in seconds
+        :return: Speaker to (embedding, seconds of speech of the speaker), speakers without a turn of at least
+        MIN_TURN_DURATION are left out
+        """
+        speaker_turns = {}
+        for start, end, speaker in turns:
+            speaker_turns.setdefault(speaker, []).append((start, end))
+
+        speakers = {}
+        for speaker, own_turns in speaker_turns.items():
+            duration = sum(end - start for start, end in own_turns)
+            parts, embedded = [], 0.0
+            for start, end in sorted(own_turns, key=lambda turn: turn[0] - turn[1]):
+                if end - start < MIN_TURN_DURATION or embedded >= MAX_EMBEDDING_DURATION:
+                    break
+                end = min(end, start + MAX_EMBEDDING_DURATION - embedded)
+                parts.append(audio[int(start * SAMPLING_RATE):int(end * SAMPLING_RATE)])
+                embedded += end - start
+            if parts:
+                speakers[speaker] = (self.embed(np.concatenate(parts)), duration)
+        return speakers
+
+
+class SpeakerStitcher:
+    """
+    Maps the speaker labels pyannote assigns per window of an episode to labels of the whole episode: every local
+    speaker is matched one to one to the most similar episode speaker above SPEAKER_MATCH_THRESHOLD, unmatched
+    speakers become new episode speakers. Episode speakers are kept as duration weighted centroids.
+    """
+
+    def __init__(self):
+        self.centroids: list[np.ndarray] = []
+        self.durations: list[float] = []
+
+    def get_label(self, index: int) -> str:
+        return f"SPEAKER_{index:02d}"
+
+    def assign(self, speakers: dict[str, tuple]) -> dict[str, str]:
+        """
+        :param speakers: Local speaker to (embedding, duration) as returned by SpeakerEmbedder.embed_speakers
+        :return: Local speaker to episode speaker label
+        """
+        local = list(speakers)
+        mapping = {}
+        if self.centroids and local:
+            similarity = cosine_similarity(np.stack([speakers[s][0] for s in local]), np.stack(self.centroids))
+            # greedy one to one matching in order of similarity, two local speakers are never merged
+            for flat in np.argsort(similarity, axis=None)[::-1]:
+                i, j = np.unravel_index(flat, similarity.shape)
+                if similarity[i, j] < SPEAKER_MATCH_THRESHOLD:
+                    break
+                if local[i] in mapping or self.get_label(j) in mapping.values():
+                    continue
+                mapping[local[i]] = self.get_label(j)
+                self._update(j, *speakers[local[i]])
+
+        for speaker in local:
+            if speaker not in mapping:
+                self.centroids.append(speakers[speaker][0])
+                self.durations.append(speakers[speaker][1])
+                mapping[speaker] = self.get_label(len(self.centroids) - 1)
+        return mapping
+
+    def _update(self, index: int, embedding: np.ndarray, duration: float) -> None:
+        total = self.durations[index] + duration
+        centroid = (self.centroids[index] * self.durations[index] + embedding * duration) / max(total, 1e-10)
+        self.centroids[index] = centroid / max(np.linalg.norm(centroid), 1e-10)
+        self.durations[index] = total
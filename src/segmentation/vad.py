@@ -0,0 +1,207 @@
+import json
+import os
+
+import numpy as np
+
+from src.utils.logger import get_logger
+
+SAMPLING_RATE = 16000
+FRAME_LENGTH = 480  # 30ms
+HOP_LENGTH = 160  # 10ms
+FRAMES_PER_CHUNK = 16384  # frames analysed at once, bounds the memory of the spectra of long episodes
+
+MIN_ENERGY_DB = -55.0  # frames below are silence regardless of the noise floor
+NOISE_FLOOR_PERCENTILE = 10
+ENERGY_MARGIN_DB = 12.0  # speech is at least this much louder than the noise floor of the episode
+MAX_SPECTRAL_FLATNESS = 0.4  # voiced speech is harmonic, noise and hiss are flat
+
+MIN_SPEECH_DURATION = 0.3
+# gaps are only removed if they are longer than this, well above the pauses within an utterance and below
+# MAX_SILENCE_DURATION of the filter strategies so merging of segments is not affected
+MIN_SILENCE_DURATION = 1.0
+SPEECH_PADDING = 0.25  # seconds kept around every speech region
+REGION_SPACER = 0.5  # seconds of silence between regions in the trimmed audio, keeps utterances apart for whisper
+
+EPSILON = 1e-10
+
+logger = get_logger(__name__)
+
+
+def get_vad_file_path(podcast_path: str, ep_id: str) -> str:
+    return os.path.join(podcast_path, f"{ep_id}_vad.json")
+
+
+def _frame_features(audio: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """:return: Energy in dBFS and spectral flatness of every frame"""
+    audio = np.asarray(audio, dtype=np.float32)
+    if len(audio) < FRAME_LENGTH:
+        return np.full(1, -np.inf), np.ones(1)
+
+    frames = np.lib.stride_tricks.sliding_window_view(audio, FRAME_LENGTH)[::HOP_LENGTH]
+    window = np.hanning(FRAME_LENGTH).astype(np.float32)
+    energy_db = np.empty(len(frames), dtype=np.float32)
+    flatness = np.empty(len(frames), dtype=np.float32)
+
+    for start in range(0, len(frames), FRAMES_PER_CHUNK):
+        chunk = frames[start:start + FRAMES_PER_CHUNK]
+        energy_db[start:start + len(chunk)] = 10 * np.log10(np.mean(chunk ** 2, axis=1) + EPSILON)
+        power = np.abs(np.fft.rfft(chunk * window, axis=1)) ** 2 + EPSILON
+        flatness[start:start + len(chunk)] = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+
+    return energy_db, flatness
+
+
+def get_speech_regions(audio: np.ndarray) -> np.ndarray:
+    """
+    Energy and spectral flatness VAD over the whole episode: frames louder than the noise floor of the episode by
+    ENERGY_MARGIN_DB with a harmonic spectrum are speech. Short gaps are closed, short regions dropped and the
+    remaining regions padded.
+    :param audio: Episode at SAMPLING_RATE
+    :return: Speech regions as (start, end) in seconds, shape (n, 2)
+    """
+    energy_db, flatness = _frame_features(audio)
+    finite_energy = energy_db[np.isfinite(energy_db)]
+    if len(finite_energy) == 0:
+        return np.zeros((0, 2))
+
+    threshold = max(MIN_ENERGY_DB, np.percentile(finite_energy, NOISE_FLOOR_PERCENTILE) + ENERGY_MARGIN_DB)
+    is_speech = (energy_db > threshold) & (flatness < MAX_SPECTRAL_FLATNESS)
+
+    edges = np.diff(np.concatenate([[0], is_speech.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1) * HOP_LENGTH / SAMPLING_RATE
+    ends = (np.flatnonzero(edges == -1) * HOP_LENGTH + FRAME_LENGTH) / SAMPLING_RATE
+    if len(starts) == 0:
+        return np.zeros((0, 2))
+
+    # close gaps shorter than MIN_SILENCE_DURATION
+    keep_gap = starts[1:] - ends[:-1] >= MIN_SILENCE_DURATION
+    starts = np.concatenate([starts[:1], starts[1:][keep_gap]])
+    ends = np.concatenate([ends[:-1][keep_gap], ends[-1:]])
+
+    long_enough = ends - starts >= MIN_SPEECH_DURATION
+    starts, ends = starts[long_enough], ends[long_enough]
+
+    episode_duration = len(audio) / SAMPLING_RATE
+    starts = np.maximum(starts - SPEECH_PADDING, 0.0)
+    ends = np.minimum(ends + SPEECH_PADDING, episode_duration)
+    return np.stack([starts, ends], axis=1)
+
+
+def trim_to_speech(audio: np.ndarray, regions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Concatenates the speech regions, separated by REGION_SPACER seconds of silence.
+    :return: Trimmed audio and the start of every region in the trimmed audio in seconds
+    """
+    spacer = np.zeros(int(REGION_SPACER * SAMPLING_RATE), dtype=audio.dtype)
+    parts = []
+    trimmed_starts = np.empty(len(regions))
+    position = 0
+    for i, (start, end) in enumerate(regions):
+        region = audio[int(round(start * SAMPLING_RATE)):int(round(end * SAMPLING_RATE))]
+        trimmed_starts[i] = position / SAMPLING_RATE
+        parts.extend([region, spacer])
+        position += len(region) + len(spacer)
+
+    trimmed = np.concatenate(parts[:-1]) if parts else np.zeros(0, dtype=audio.dtype)
+    return trimmed, trimmed_starts
+
+
+def map_to_episode_time(times: np.ndarray, regions: np.ndarray, trimmed_starts: np.ndarray) -> np.ndarray:
+    """Maps times of the trimmed audio back to episode time, times within a spacer map to the end of the region."""
+    times = np.asarray(times, dtype=float)
+    region_index = np.clip(np.searchsorted(trimmed_starts, times, side="right") - 1, 0, len(regions) - 1)
+    offset = np.clip(times - trimmed_starts[region_index], 0.0, regions[region_index, 1] - regions[region_index, 0])
+    return regions[region_index, 0] + offset
+
+
+def _get_region_index(time: float, trimmed_starts: np.ndarray) -> int:
+    return max(int(np.searchsorted(trimmed_starts, time, side="right")) - 1, 0)
+
+
+def split_at_regions(segments: list[dict], regions: np.ndarray, trimmed_starts: np.ndarray) -> list[dict]:
+    """
+    Splits whisperx segments in trimmed time which cross a spacer into one segment per speech region using the word
+    timestamps, in episode time they would span the removed gap. Words without timestamps stay with the previous word,
+    segments without words are clipped to the region they start in.
+    """
+    region_ends = trimmed_starts + regions[:, 1] - regions[:, 0]
+    split_segments = []
+    for segment in segments:
+        first_region = _get_region_index(segment.get("start", 0.0), trimmed_starts)
+        words = segment.get("words", [])
+        if not words:
+            if "end" in segment:
+                segment["end"] = min(segment["end"], region_ends[first_region])
+            split_segments.append(segment)
+            continue
+
+        pieces, region = {}, first_region
+        for word in words:
+            if "start" in word:
+                region = _get_region_index(word["start"], trimmed_starts)
+            if "end" in word:
+                word["end"] = min(word["end"], region_ends[region])
+            pieces.setdefault(region, []).append(word)
+        if len(pieces) == 1:
+            if "end" in segment:
+                segment["end"] = min(segment["end"], region_ends[region])
+            split_segments.append(segment)
+            continue
+
+        for region, piece in pieces.items():
+            timed = [word for word in piece if "start" in word]
+            split_segment = dict(segment)
+            split_segment["words"] = piece
+            split_segment["text"] = " ".join(word["word"] for word in piece)
+            split_segment["start"] = timed[0]["start"] if timed else segment["start"]
+            split_segment["end"] = min(timed[-1]["end"] if timed else segment["end"], region_ends[region])
+            split_segments.append(split_segment)
+    return split_segments
+
+
+def remap_segments(segments: list[dict], regions: np.ndarray, trimmed_starts: np.ndarray) -> list[dict]:
+    """
+    Splits the whisperx segments at the speech regions and maps their start and end and those of their words from
+    trimmed time to episode time.
+    """
+    if len(regions) == 0:
+        return segments
+
+    segments = split_at_regions(segments, regions, trimmed_starts)
+    items = [segment for segment in segments] + [word for segment in segments for word in segment.get("words", [])]
+    for key in ("start", "end"):
+        with_key = [item for item in items if key in item]
+        mapped = map_to_episode_time(np.array([item[key] for item in with_key]), regions, trimmed_starts)
+        for item, value in zip(with_key, mapped):
+            item[key] = round(float(value), 3)
+    return segments
+
+
+def save_speech_regions(podcast_path: str, ep_id: str, regions: np.ndarray, episode_duration: float) -> float:
+    """
+    Saves the speech region map of an episode next to its diarization.
+    :return: Seconds of the episode skipped as non-speech
+    """
+    speech_duration = float(np.sum(regions[:, 1] - regions[:, 0])) if len(regions) else 0.0
+    with open(get_vad_file_path(podcast_path, ep_id), "w", encoding="utf8") as f:
+        json.dump({"episode_duration": episode_duration, "speech_duration": speech_duration,
+                   "regions": regions.round(3).tolist()}, f)
+    return episode_duration - speech_duration
+
+
+def report_skipped_minutes(podcast_path: str, episode_ids: list[str]) -> float:
+    """:return: Minutes of audio the VAD kept away from transcription and diarization for the episodes of a podcast"""
+    episode_minutes = skipped_minutes = 0.0
+    for ep_id in episode_ids:
+        vad_file_path = get_vad_file_path(podcast_path, ep_id)
+        if not os.path.exists(vad_file_path):
+            continue
+        with open(vad_file_path, "r", encoding="utf8") as f:
+            speech_map = json.load(f)
+        episode_minutes += speech_map["episode_duration"] / 60
+        skipped_minutes += (speech_map["episode_duration"] - speech_map["speech_duration"]) / 60
+
+    if episode_minutes:
+        logger.info(f"VAD skipped {skipped_minutes:.1f} of {episode_minutes:.1f} audio minutes "
+                    f"({skipped_minutes / episode_minutes:.1%}) of {os.path.basename(podcast_path)}.")
+    return skipped_minutes
@@ -8,9 +8,11 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from src.transcription.utils import load_meta_data, get_h5_file, get_metadata_path
+from src.utils.inference_cache import InferenceCache, get_model_key
 from src.utils.logger import get_logger
 
 BATCH_SIZE = 16
+MEL_SAMPLING_RATE = 16000
 
 logger = get_logger(__name__)
 
@@ -44,17 +46,23 @@ def plot_mel_spectrogram(audio_path: str, output_dir: str, sr=16000):
     plt.close()  # Close the plot to avoid memory issues
 
 
+def _convert_batch_to_mel_spec(audio_batch: list[np.ndarray]) -> list[np.ndarray]:
+    jobs = [joblib.delayed(_convert_speech_to_mel_spec)(audio, MEL_SAMPLING_RATE) for audio in audio_batch]
+    return joblib.Parallel(n_jobs=BATCH_SIZE, verbose=1)(jobs)
+
+
 def create_mel_spectrogram(podcast: str, write_to_hdf5: bool = True):
     meta_data, num_samples = load_meta_data(get_metadata_path(podcast))
     h5_file = get_h5_file(podcast)
+    cache = InferenceCache(get_model_key("librosa.melspectrogram", sr=MEL_SAMPLING_RATE, fmax=MEL_SAMPLING_RATE / 2,
+                                         librosa=librosa.__version__))
 
-    with h5py.File(h5_file, "r+") as h5:
+    with h5py.File(h5_file, "r+") as h5, cache:
         for start_idx in range(0, num_samples, BATCH_SIZE):
             end_idx = min(start_idx + BATCH_SIZE, num_samples)
             audio_batch = [h5[meta_data[i].sample_name][:] for i in range(start_idx, end_idx)]
 
-            jobs = [joblib.delayed(_convert_speech_to_mel_spec)(audio) for audio in audio_batch]
-            out = joblib.Parallel(n_jobs=BATCH_SIZE, verbose=1)(jobs)
+            out = cache.run(audio_batch, _convert_batch_to_mel_spec)
 
             # Save results
             for idx, result in enumerate(out):
@@ -63,3 +71,5 @@ def create_mel_spectrogram(podcast: str, write_to_hdf5: bool = True):
                     h5[meta_data[start_idx + idx].sample_name].attrs["mel_spec"] = result[idx]
                     h5.flush()
                 logger.info(f"NAME: {meta_data[start_idx + idx].sample_name}, MelSpec: DONE")
+
+    cache.log_stats()
@@ -0,0 +1,307 @@
+import os
+import re
+
+import h5py
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import Dataset, IterableDataset, Sampler, get_worker_info
+
+from src.processing.packed_subsets import PackedShard, get_packed_subset_file, is_packed_shard
+from src.processing.subset_planner import SUBSET_SEED
+from src.transcription.utils import load_meta_data
+from src.utils.h5_layout import resolve_sample
+from src.utils.logger import get_logger
+from src.utils.paths import TTS_TRAINING_SUBSETS_PATH
+
+MEGABATCH_SIZE = 64  # batches sorted by duration together, fewer padding for a little less randomness
+
+logger = get_logger(__name__)
+
+
+def list_subset_files(folder: str = TTS_TRAINING_SUBSETS_PATH, packed: bool = False) -> list[str]:
+    """
+    :param packed: Return the packed shards subset_{i}_packed.hdf5 instead of subset_{i}.hdf5
+    :return: Subset hdf5s in the folder sorted by subset index
+    """
+    pattern = r"subset_(\d+)_packed\.hdf5" if packed else r"subset_(\d+)\.hdf5"
+    indices = sorted(int(re.fullmatch(pattern, file).group(1)) for file in os.listdir(folder)
+                     if re.fullmatch(pattern, file))
+    if packed:
+        return [get_packed_subset_file(idx, folder) for idx in indices]
+    return [os.path.join(folder, f"subset_{idx}.hdf5") for idx in indices]
+
+
+class SubsetShard:
+    """
+    Read access to a single subset, either a subset_{i}.hdf5 with one dataset per clip and its subset_{i}.txt, or a
+    packed shard. Metadata is loaded on construction, the hdf5 itself is opened lazily per process so a shard can be
+    created before DataLoader workers are forked.
+    """
+
+    def __init__(self, h5_path: str):
+        self.h5_path = h5_path
+        self._pid = None
+        self._h5 = None
+        self._packed = None
+
+        with h5py.File(h5_path, "r") as h5:
+            is_packed = is_packed_shard(h5)
+
+        if is_packed:
+            self._packed = PackedShard(h5_path)
+            self.sample_names = list(self._packed.columns["sample_name"])
+            self.durations = np.asarray(self._packed.durations, dtype=np.float64)
+            self.meta_data = None
+        else:
+            self.meta_data, _ = load_meta_data(h5_path.replace(".hdf5", ".txt"), load_as_dialect=True)
+            self.sample_names = [sample.sample_name for sample in self.meta_data]
+            self.durations = np.array([sample.duration for sample in self.meta_data], dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.sample_names)
+
+    def _open(self) -> h5py.File:
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._h5 = h5py.File(self.h5_path, "r")
+        return self._h5
+
+    def get_item(self, idx: int, with_phoneme: bool = False, with_mel: bool = False) -> dict:
+        if self._packed is not None:
+            item = {
+                "audio": np.array(self._packed.get_audio(idx), dtype=np.float32),
+                **{column: self._packed.get_column(column, idx)
+                   for column in ["sample_name", "dataset_name", "speaker_id", "dialect", "de_text"]},
+            }
+            if with_phoneme:
+                item["phoneme"] = self._packed.get_column("phoneme", idx)
+            if with_mel:
+                item["mel_spec"] = None  # packed shards do not carry mel spectrograms
+        else:
+            sample = self.meta_data[idx]
+            h5_content = resolve_sample(self._open(), sample.sample_name, sample.dataset_name)
+            item = {
+                "audio": h5_content[()].astype(np.float32, copy=False),
+                "sample_name": sample.sample_name,
+                "dataset_name": sample.dataset_name,
+                "speaker_id": sample.speaker_id,
+                "dialect": sample.dialect,
+                "de_text": sample.de_text,
+            }
+            if with_phoneme:
+                item["phoneme"] = h5_content.attrs.get("phoneme", "")
+            if with_mel:
+                mel_spec = h5_content.attrs.get("mel_spec")
+                item["mel_spec"] = None if mel_spec is None else np.asarray(mel_spec, dtype=np.float32)
+
+        item["duration"] = float(self.durations[idx])
+        return item
+
+    def close(self) -> None:
+        if self._h5 is not None and self._pid == os.getpid():
+            self._h5.close()
+        self._h5 = None
+        self._pid = None
+        if self._packed is not None:
+            self._packed.close()
+
+
+class SubsetDataset(Dataset):
+    """
+    Map-style dataset over any number of subset hdf5s. Items are dicts with float32 audio and the sample metadata,
+    phonemes and mel spectrograms are only read if requested. Use together with DurationBatchSampler.
+    """
+
+    def __init__(self, h5_paths: list[str], with_phoneme: bool = False, with_mel: bool = False):
+        self.shards = [SubsetShard(path) for path in h5_paths]
+        self.with_phoneme = with_phoneme
+        self.with_mel = with_mel
+
+        # global index i belongs to shard s if shard_offsets[s] <= i < shard_offsets[s + 1]
+        self.shard_offsets = np.zeros(len(self.shards) + 1, dtype=np.int64)
+        self.shard_offsets[1:] = np.cumsum([len(shard) for shard in self.shards])
+        self.durations = np.concatenate([shard.durations for shard in self.shards]) if self.shards else np.zeros(0)
+
+        logger.info(f"Loaded {len(self)} samples with {self.durations.sum() / 3600:.2f}h from {len(self.shards)} "
+                    f"subsets.")
+
+    def __len__(self) -> int:
+        return int(self.shard_offsets[-1])
+
+    def __getitem__(self, idx: int) -> dict:
+        shard_idx = int(np.searchsorted(self.shard_offsets, idx, side="right")) - 1
+        return self.shards[shard_idx].get_item(idx - int(self.shard_offsets[shard_idx]), self.with_phoneme,
+                                               self.with_mel)
+
+
+def _get_rank_and_world_size(rank: int | None, num_replicas: int | None) -> tuple[int, int]:
+    is_distributed = dist.is_available() and dist.is_initialized()
+    if rank is None:
+        rank = dist.get_rank() if is_distributed else 0
+    if num_replicas is None:
+        num_replicas = dist.get_world_size() if is_distributed else 1
+    return rank, num_replicas
+
+
+class SubsetIterableDataset(IterableDataset):
+    """
+    Streaming dataset over subset hdf5s. Shards are split between ranks and DataLoader workers so every process reads
+    its own files, which keeps reads sequential and lets packed shards reuse their decoded chunks. Shard order and
+    sample order within a shard are shuffled with seed and epoch, call set_epoch before every epoch.
+    """
+
+    def __init__(self, h5_paths: list[str], with_phoneme: bool = False, with_mel: bool = False, shuffle: bool = True,
+                 seed: int = SUBSET_SEED, rank: int | None = None, num_replicas: int | None = None):
+        self.h5_paths = h5_paths
+        self.with_phoneme = with_phoneme
+        self.with_mel = with_mel
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.rank, self.num_replicas = _get_rank_and_world_size(rank, num_replicas)
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+        rng = np.random.default_rng((self.seed, self.epoch))
+
+        paths = list(self.h5_paths)
+        if self.shuffle:
+            rng.shuffle(paths)
+
+        num_readers = self.num_replicas * num_workers
+        if len(paths) < num_readers:
+            logger.warning(f"Only {len(paths)} subsets for {num_readers} readers, some readers stay idle.")
+
+        # every rank and worker draws from the same rng above, so the shard split is consistent among them
+        for path in paths[self.rank * num_workers + worker_id::num_readers]:
+            shard = SubsetShard(path)
+            order = rng.permutation(len(shard)) if self.shuffle else np.arange(len(shard))
+            try:
+                for idx in order:
+                    yield shard.get_item(int(idx), self.with_phoneme, self.with_mel)
+            finally:
+                shard.close()
+
+
+class DurationBatchSampler(Sampler):
+    """
+    Batch sampler for SubsetDataset which fills batches up to max_batch_seconds of audio instead of a fixed number of
+    samples. Shards are shuffled and split between ranks, so every rank reads its own files. Within a rank samples are
+    shuffled, grouped into megabatches and sorted by duration inside a megabatch to reduce padding, the batches are
+    shuffled again afterwards. All ranks yield the same number of batches, which distributed training relies on.
+    """
+
+    def __init__(self, dataset: SubsetDataset, max_batch_seconds: float, shuffle: bool = True, drop_last: bool = False,
+                 seed: int = SUBSET_SEED, rank: int | None = None, num_replicas: int | None = None):
+        self.durations = dataset.durations
+        self.shard_offsets = dataset.shard_offsets
+        self.max_batch_seconds = max_batch_seconds
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.rank, self.num_replicas = _get_rank_and_world_size(rank, num_replicas)
+        self._num_batches = {}  # (epoch, seed) to the number of batches every rank yields
+
+        too_long = int((self.durations > max_batch_seconds).sum())
+        if too_long:
+            logger.warning(f"{too_long} samples are longer than {max_batch_seconds}s and form a batch on their own.")
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def _rank_indices(self, rank: int, rng: np.random.Generator) -> np.ndarray:
+        num_shards = len(self.shard_offsets) - 1
+        shard_order = rng.permutation(num_shards) if self.shuffle else np.arange(num_shards)
+
+        if num_shards >= self.num_replicas:
+            rank_shards = shard_order[rank::self.num_replicas]
+            indices = np.concatenate([np.arange(self.shard_offsets[s], self.shard_offsets[s + 1])
+                                      for s in rank_shards]) if len(rank_shards) else np.zeros(0, dtype=np.int64)
+        else:
+            # fewer shards than ranks, fall back to splitting samples
+            indices = np.arange(self.shard_offsets[-1])[rank::self.num_replicas]
+
+        return rng.permutation(indices) if self.shuffle else indices
+
+    def _build_batches(self, indices: np.ndarray, rng: np.random.Generator) -> list[np.ndarray]:
+        batches = []
+        megabatch_size = max(1, MEGABATCH_SIZE * int(self.max_batch_seconds / max(self.durations.mean(), 1e-6)))
+        for start in range(0, len(indices), megabatch_size):
+            megabatch = indices[start:start + megabatch_size]
+            megabatch = megabatch[np.argsort(self.durations[megabatch], kind="stable")]
+
+            boundaries = []
+            batch_seconds = 0.0
+            for i, duration in enumerate(self.durations[megabatch].tolist()):
+                if batch_seconds + duration > self.max_batch_seconds and batch_seconds > 0:
+                    boundaries.append(i)
+                    batch_seconds = 0.0
+                batch_seconds += duration
+            batches.extend(np.split(megabatch, boundaries))
+
+        if self.drop_last and batches and self.durations[batches[-1]].sum() < self.max_batch_seconds / 2:
+            batches.pop()
+
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def _batches_for_rank(self, rank: int) -> list[np.ndarray]:
+        # the shard split is drawn with the same seed on every rank, the batching with a seed per rank
+        indices = self._rank_indices(rank, np.random.default_rng((self.seed, self.epoch)))
+        return self._build_batches(indices, np.random.default_rng((self.seed, self.epoch, rank)))
+
+    def _min_batches_per_rank(self) -> int:
+        # every rank computes the batches of all ranks, so they agree on the minimum without communication. The
+        # DataLoader calls __len__ repeatedly, the result only changes with epoch and seed
+        key = (self.epoch, self.seed)
+        if key not in self._num_batches:
+            self._num_batches = {key: min(len(self._batches_for_rank(rank)) for rank in range(self.num_replicas))}
+        return self._num_batches[key]
+
+    def __iter__(self):
+        batches = self._batches_for_rank(self.rank)
+        if self.num_replicas > 1:
+            batches = batches[:self._min_batches_per_rank()]
+        for batch in batches:
+            yield batch.tolist()
+
+    def __len__(self) -> int:
+        return self._min_batches_per_rank()
+
+
+def collate_subset_batch(items: list[dict]) -> dict:
+    """
+    Pads audio (and mel spectrograms along time) to the longest item of the batch. Lengths are returned so models can
+    mask the padding, string fields are returned as lists.
+    """
+    audio_lengths = torch.tensor([item["audio"].shape[0] for item in items], dtype=torch.long)
+    audio = torch.zeros(len(items), int(audio_lengths.max()), dtype=torch.float32)
+    for i, item in enumerate(items):
+        audio[i, :item["audio"].shape[0]] = torch.from_numpy(np.asarray(item["audio"], dtype=np.float32))
+
+    batch = {
+        "audio": audio,
+        "audio_lengths": audio_lengths,
+        "duration": torch.tensor([item["duration"] for item in items], dtype=torch.float32),
+    }
+    for key in ["sample_name", "dataset_name", "speaker_id", "dialect", "de_text", "phoneme"]:
+        if key in items[0]:
+            batch[key] = [item[key] for item in items]
+
+    if "mel_spec" in items[0] and all(item["mel_spec"] is not None for item in items):
+        mel_lengths = torch.tensor([item["mel_spec"].shape[-1] for item in items], dtype=torch.long)
+        mel_spec = torch.zeros(len(items), items[0]["mel_spec"].shape[0], int(mel_lengths.max()), dtype=torch.float32)
+        for i, item in enumerate(items):
+            mel_spec[i, :, :item["mel_spec"].shape[-1]] = torch.from_numpy(item["mel_spec"])
+        batch["mel_spec"] = mel_spec
+        batch["mel_lengths"] = mel_lengths
+
+    return batch
+
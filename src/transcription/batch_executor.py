@@ -0,0 +1,114 @@
+import json
+import os
+import time
+from typing import Callable
+
+import torch
+
+from src.utils.logger import get_logger
+from src.utils.paths import PODCAST_AUDIO_FOLDER
+
+QUARANTINE_FOLDER = os.path.join(PODCAST_AUDIO_FOLDER, "quarantine")
+
+logger = get_logger(__name__)
+
+
+def get_quarantine_path(name: str) -> str:
+    return os.path.join(QUARANTINE_FOLDER, f"{name}.jsonl")
+
+
+def load_quarantine(quarantine_path: str) -> list[dict]:
+    if not os.path.exists(quarantine_path):
+        return []
+    with open(quarantine_path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+class BatchExecutor:
+    """
+    Runs inference batch wise and isolates faults: a failing batch is bisected until the samples raising are found,
+    these are quarantined with their error while the rest of the batch is processed. Samples whose results are
+    rejected are retried as batches with the next decoding settings and quarantined once all settings are exhausted.
+
+        executor = BatchExecutor("phoneme", get_quarantine_path(podcast))
+        results = executor.run_with_retries(samples, [decode, decode_alternative], accept, BATCH_SIZE, get_name)
+    """
+
+    def __init__(self, stage: str, quarantine_path: str):
+        self.stage = stage
+        self.quarantine_path = quarantine_path
+        self.num_failed_batches = 0
+        self.num_quarantined = 0
+
+    def quarantine(self, sample_name: str, reason: str) -> None:
+        logger.error(f"{self.stage}: quarantining {sample_name}, {reason}")
+        os.makedirs(os.path.dirname(self.quarantine_path), exist_ok=True)
+        with open(self.quarantine_path, "at", encoding="utf-8") as f:
+            f.write(json.dumps({"sample_name": sample_name, "stage": self.stage, "reason": reason,
+                                "time": time.strftime("%Y-%m-%d %H:%M:%S")}) + "\n")
+        self.num_quarantined += 1
+
+    def run(self, items: list, infer: Callable[[list], list], get_name: Callable[[object], str] = str) -> list:
+        """
+        :param infer: Loads and infers a list of items, returns one result per item
+        :param get_name: Sample name of an item for the quarantine
+        :return: Results in the order of items, None for quarantined items
+        """
+        if not items:
+            return []
+
+        try:
+            return list(infer(items))
+        except Exception as e:
+            self.num_failed_batches += 1
+            if torch.cuda.is_available():
+                # an out of memory error leaves the cached blocks of the failed batch behind
+                torch.cuda.empty_cache()
+
+            if len(items) == 1:
+                self.quarantine(get_name(items[0]), f"{type(e).__name__}: {str(e)}")
+                return [None]
+
+            logger.warning(f"{self.stage}: batch of {len(items)} failed with {type(e).__name__}, bisecting it.")
+            middle = len(items) // 2
+            return self.run(items[:middle], infer, get_name) + self.run(items[middle:], infer, get_name)
+
+    def run_with_retries(self, items: list, attempts: list[Callable[[list], list]],
+                         accept: Callable[[object, object], bool], batch_size: int,
+                         get_name: Callable[[object], str] = str) -> list:
+        """
+        :param attempts: Inference functions with increasingly different decoding settings, tried in order
+        :param accept: Whether the result of an item is usable, rejected items are retried with the next attempt
+        :return: Results in the order of items, None for items which failed or were rejected by all attempts
+        """
+        results = [None] * len(items)
+        pending = list(range(len(items)))
+
+        for attempt, infer in enumerate(attempts):
+            rejected = []
+            num_accepted = 0
+            for start in range(0, len(pending), batch_size):
+                indices = pending[start:start + batch_size]
+                for i, result in zip(indices, self.run([items[i] for i in indices], infer, get_name)):
+                    if result is None:
+                        continue  # raised and is already quarantined
+                    if accept(items[i], result):
+                        results[i] = result
+                        num_accepted += 1
+                    else:
+                        rejected.append(i)
+
+            logger.info(f"{self.stage}: attempt {attempt + 1} of {len(attempts)} accepted "
+                        f"{num_accepted} of {len(pending)} samples.")
+            pending = rejected
+            if not pending:
+                break
+
+        for i in pending:
+            self.quarantine(get_name(items[i]), f"result rejected by all {len(attempts)} attempts")
+        return results
+
+    def log_stats(self) -> None:
+        if self.num_failed_batches or self.num_quarantined:
+            logger.warning(f"{self.stage}: {self.num_failed_batches} failed batches, {self.num_quarantined} samples "
+                           f"quarantined in {self.quarantine_path}.")
@@ -0,0 +1,112 @@
+import json
+import os
+from collections import Counter
+
+from src.download.utils import get_podcast_path
+from src.segmentation.filter_strategies import filter_segments_using_strats
+from src.transcription.hallucination import flag_hallucinations
+from src.utils.data_points import DatasetDataPoint
+from src.utils.logger import get_logger
+
+SEGMENT_START_ID = 1000  # same offset as in cut_episode_into_segments
+
+MIN_MEAN_WORD_SCORE = 0.7  # mean wav2vec2 alignment score of the words of a segment
+LOW_WORD_SCORE = 0.4
+MAX_LOW_SCORE_WORD_RATIO = 0.2  # share of words below LOW_WORD_SCORE
+MAX_UNALIGNED_WORD_RATIO = 0.1  # share of words the aligner could not place, usually hallucinated text
+MAX_TEXT_LENGTH = 390  # same limit as get_missing_transcriptions
+
+REASON_NO_SEGMENT = "no_segment"
+REASON_CUT = "is_cut"
+REASON_LOW_SCORE = "low_score"
+REASON_UNALIGNED = "unaligned"
+REASON_HALLUCINATION = "hallucination"
+REASON_LENGTH = "length"
+
+logger = get_logger(__name__)
+
+
+def load_episode_segments(podcast: str, episode_id: str) -> dict[str, dict]:
+    """
+    Rebuilds the segments an episode was cut into from its diarized file, the filter strategies are deterministic so
+    the i-th filtered segment is sample {episode_id}_{SEGMENT_START_ID + i}.
+    :return: Sample name to whisperx segment, empty if the episode was not diarized
+    """
+    diarized_file_path = os.path.join(get_podcast_path(podcast), f"{episode_id}.json")
+    if not os.path.exists(diarized_file_path):
+        logger.warning(f"Diarization of episode {episode_id} not found, all its samples are re-transcribed.")
+        return {}
+
+    with open(diarized_file_path, "r", encoding="utf8") as f:
+        segments = json.load(f)
+
+    return {f"{episode_id}_{SEGMENT_START_ID + i}": segment
+            for i, segment in enumerate(filter_segments_using_strats(segments))}
+
+
+def get_retranscription_reason(segment: dict | None, suspect: bool = False) -> str | None:
+    """
+    Checks whether the whisperx text of a segment can be trusted.
+    :param suspect: Whether the hallucination scorer flagged the text of the segment
+    :return: Reason why the segment has to be sent through the second Whisper pass, None if its text is kept
+    """
+    if segment is None:
+        return REASON_NO_SEGMENT
+
+    # cut segments are assembled from words, boundary words are often clipped
+    if segment.get("is_cut", False):
+        return REASON_CUT
+
+    text = segment["text"].strip()
+    if not text or len(text) > MAX_TEXT_LENGTH:
+        return REASON_LENGTH
+
+    words = segment.get("words", [])
+    scores = [word["score"] for word in words if "score" in word]
+    if not words or len(scores) < (1 - MAX_UNALIGNED_WORD_RATIO) * len(words):
+        return REASON_UNALIGNED
+    if sum(scores) / len(scores) < MIN_MEAN_WORD_SCORE or \
+            sum(score < LOW_WORD_SCORE for score in scores) > MAX_LOW_SCORE_WORD_RATIO * len(scores):
+        return REASON_LOW_SCORE
+
+    if suspect:
+        return REASON_HALLUCINATION
+
+    return None
+
+
+def gate_samples(podcast: str, samples: list[DatasetDataPoint]) -> tuple[list, list, Counter]:
+    """
+    Splits the samples of a podcast into those whose whisperx transcript passes all confidence checks and those which
+    need a second Whisper pass. Accepted samples get the whisperx text as de_text.
+    :return: Accepted samples, samples to re-transcribe, count of the reasons for re-transcription
+    """
+    accepted, to_transcribe = [], []
+    reasons = Counter()
+    segments = {}
+    loaded_episodes = set()
+
+    for sample in samples:
+        if sample.orig_episode_name not in loaded_episodes:
+            segments.update(load_episode_segments(podcast, sample.orig_episode_name))
+            loaded_episodes.add(sample.orig_episode_name)
+
+    sample_segments = [segments.get(sample.sample_name) for sample in samples]
+    # repetition, compression ratio and chars/s of all whisperx texts in one pass
+    texts = [segment["text"] if segment else "" for segment in sample_segments]
+    durations = [segment["end"] - segment["start"] if segment else 0.0 for segment in sample_segments]
+    suspect = flag_hallucinations(texts, durations)
+
+    for sample, segment, is_suspect in zip(samples, sample_segments, suspect):
+        reason = get_retranscription_reason(segment, is_suspect)
+        if reason is None:
+            sample.de_text = segment["text"].strip()
+            accepted.append(sample)
+        else:
+            reasons[reason] += 1
+            to_transcribe.append(sample)
+
+    logger.info(f"Confidence gate kept the whisperx transcript of {len(accepted)} samples "
+                f"({sum(s.duration for s in accepted) / 3600:.2f}h), {len(to_transcribe)} samples are re-transcribed: "
+                f"{dict(reasons)}")
+    return accepted, to_transcribe, reasons
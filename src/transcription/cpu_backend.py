@@ -0,0 +1,108 @@
+import hashlib
+import os
+from collections import Counter
+
+import torch
+from transformers import PreTrainedModel, T5ForConditionalGeneration
+
+from src.transcription.utils import get_checkpoint_id
+from src.utils.logger import get_logger
+
+BACKEND_GPU = "gpu"
+BACKEND_CPU_INT8 = "cpu_int8"
+BACKENDS = (BACKEND_GPU, BACKEND_CPU_INT8)
+
+CPU_THREADS = int(os.getenv("SWISSGPC_CPU_THREADS", "0")) or os.cpu_count() or 1
+CPU_BATCH_SIZE = 8  # smaller batches keep the beams of short inputs from waiting on long ones without a GPU
+
+CHRF_ORDER = 6
+CHRF_BETA = 2.0
+
+logger = get_logger(__name__)
+
+
+def setup_cpu_threads(num_threads: int = CPU_THREADS) -> None:
+    """All threads of the budget work on one batch at a time, generate parallelizes within the matmuls."""
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # can only be set once per process, before the first parallel work
+        pass
+    logger.info(f"CPU inference with {num_threads} threads.")
+
+
+def get_quantized_model_path(checkpoint_path: str) -> str:
+    """The converted model is tied to the checkpoint and torch version it was created with."""
+    signature = hashlib.blake2b(f"{get_checkpoint_id(checkpoint_path)}|{torch.__version__}".encode(),
+                                digest_size=8).hexdigest()
+    return f"{os.path.normpath(checkpoint_path)}-int8-{signature}.pt"
+
+
+def load_quantized_t5(checkpoint_path: str) -> PreTrainedModel:
+    """
+    Loads the T5 checkpoint with its linear layers dynamically quantized to int8. The conversion is cached next to the
+    checkpoint, so only the first run on a node pays for it.
+    :return: Quantized model in eval mode on the CPU
+    """
+    quantized_path = get_quantized_model_path(checkpoint_path)
+    if os.path.exists(quantized_path):
+        logger.info(f"Loading quantized model from {quantized_path}")
+        model = torch.load(quantized_path, map_location="cpu", weights_only=False)
+        model.eval()
+        return model
+
+    logger.info(f"Quantizing {checkpoint_path} to int8, cached at {quantized_path}")
+    model = T5ForConditionalGeneration.from_pretrained(checkpoint_path, torch_dtype=torch.float32)
+    model.eval()
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    tmp_path = f"{quantized_path}.tmp"
+    torch.save(model, tmp_path)
+    os.replace(tmp_path, quantized_path)
+    return model
+
+
+def _char_ngrams(text: str, n: int) -> Counter:
+    text = text.replace(" ", "")
+    return Counter(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+def corpus_chrf(hypotheses: list[str], references: list[str], order: int = CHRF_ORDER,
+                beta: float = CHRF_BETA) -> float:
+    """
+    Corpus level chrF (Popović 2015) as computed by sacrebleu without word n-grams: character n-gram precision and
+    recall averaged over n = 1..order and combined to an F-beta score.
+    :return: chrF in [0, 100]
+    """
+    matches, hypothesis_counts, reference_counts = [0] * order, [0] * order, [0] * order
+    for hypothesis, reference in zip(hypotheses, references):
+        for n in range(1, order + 1):
+            hypothesis_ngrams, reference_ngrams = _char_ngrams(hypothesis, n), _char_ngrams(reference, n)
+            matches[n - 1] += sum((hypothesis_ngrams & reference_ngrams).values())
+            hypothesis_counts[n - 1] += sum(hypothesis_ngrams.values())
+            reference_counts[n - 1] += sum(reference_ngrams.values())
+
+    orders = [n for n in range(order) if hypothesis_counts[n] and reference_counts[n]]
+    if not orders:
+        return 0.0
+    precision = sum(matches[n] / hypothesis_counts[n] for n in orders) / len(orders)
+    recall = sum(matches[n] / reference_counts[n] for n in orders) / len(orders)
+    if precision + recall == 0:
+        return 0.0
+    return 100 * (1 + beta ** 2) * precision * recall / (beta ** 2 * precision + recall)
+
+
+def report_quality_drift(reference_translations: list[str], translations: list[str], backend: str) -> dict:
+    """Compares the translations of a backend against those of the float model on the same prompts."""
+    if not translations:
+        logger.warning(f"No translations to compare {backend} against the float model.")
+        return {"exact_match": 0.0, "chrf": 0.0}
+
+    drift = {
+        "exact_match": sum(a == b for a, b in zip(reference_translations, translations)) / len(translations),
+        "chrf": corpus_chrf(translations, reference_translations),
+    }
+    logger.info(f"Quality drift of {backend} against the float model on {len(translations)} prompts: "
+                f"{drift['exact_match']:.1%} exact matches, chrF {drift['chrf']:.2f}")
+    return drift
@@ -0,0 +1,102 @@
+import math
+import time
+
+import torch
+from transformers import PreTrainedModel, T5Tokenizer
+
+from src.utils.logger import get_logger
+
+MAX_INPUT_LENGTH = 400
+# (max input tokens, beams), inputs longer than the last bucket use its beams
+LENGTH_BUCKETS = ((8, 1), (24, 3), (MAX_INPUT_LENGTH, 5))
+# Swiss German output is rarely longer than the German input, the offset covers the prompt tag and short inputs
+MAX_NEW_TOKENS_RATIO = 1.5
+MAX_NEW_TOKENS_OFFSET = 8
+
+logger = get_logger(__name__)
+
+
+def get_num_beams(input_length: int, buckets: tuple[tuple[int, int], ...] = LENGTH_BUCKETS) -> int:
+    for max_length, num_beams in buckets:
+        if input_length <= max_length:
+            return num_beams
+    return buckets[-1][1]
+
+
+def get_max_new_tokens(input_length: int) -> int:
+    return min(MAX_INPUT_LENGTH, math.ceil(MAX_NEW_TOKENS_RATIO * input_length) + MAX_NEW_TOKENS_OFFSET)
+
+
+def plan_decoding(input_lengths: list[int], batch_size: int,
+                  buckets: tuple[tuple[int, int], ...] = LENGTH_BUCKETS) -> list[tuple[list[int], int, int]]:
+    """
+    Groups inputs of similar token length, so short inputs are neither padded to nor decoded as long as the longest
+    input of their batch.
+    :return: Batches of (input indices, beams, max new tokens), indices sorted by length
+    """
+    order = sorted(range(len(input_lengths)), key=lambda i: input_lengths[i])
+    groups = {}
+    for i in order:
+        groups.setdefault(get_num_beams(input_lengths[i], buckets), []).append(i)
+
+    plan = []
+    for num_beams, indices in groups.items():
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start:start + batch_size]
+            plan.append((batch, num_beams, get_max_new_tokens(input_lengths[batch[-1]])))
+    return plan
+
+
+class DecodingPlanner:
+    """
+    Length aware generation for the DE to CH T5 model: inputs are bucketed by token length, every bucket has its own
+    beam width (greedy for very short inputs), max_new_tokens follows the longest input of a batch and beam search stops
+    early. Generated tokens and generation time are counted for the tokens/s report.
+    """
+
+    def __init__(self, tokenizer: T5Tokenizer, model: PreTrainedModel, device: str, batch_size: int,
+                 buckets: tuple[tuple[int, int], ...] = LENGTH_BUCKETS):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.device = device
+        self.batch_size = batch_size
+        self.buckets = buckets
+        self.generated_tokens = 0
+        self.generation_time = 0.0
+
+    def get_config(self) -> dict:
+        """Parameters changing the output, part of the translation memo key."""
+        return {"buckets": self.buckets, "max_new_tokens_ratio": MAX_NEW_TOKENS_RATIO,
+                "max_new_tokens_offset": MAX_NEW_TOKENS_OFFSET, "early_stopping": True}
+
+    def translate(self, batch_texts: list[str]) -> list[str]:
+        input_lengths = [len(ids) for ids in self.tokenizer(batch_texts, truncation=True,
+                                                            max_length=MAX_INPUT_LENGTH)["input_ids"]]
+        translations = [""] * len(batch_texts)
+
+        for indices, num_beams, max_new_tokens in plan_decoding(input_lengths, self.batch_size, self.buckets):
+            inputs = self.tokenizer([batch_texts[i] for i in indices], return_tensors="pt", padding=True,
+                                    truncation=True, max_length=MAX_INPUT_LENGTH)
+
+            start_time = time.perf_counter()
+            with torch.no_grad():
+                output_ids = self.model.generate(
+                    input_ids=inputs["input_ids"].to(self.device),
+                    attention_mask=inputs["attention_mask"].to(self.device), max_new_tokens=max_new_tokens,
+                    num_beams=num_beams, early_stopping=num_beams > 1, num_return_sequences=1,
+                    pad_token_id=self.tokenizer.eos_token_id)
+            self.generation_time += time.perf_counter() - start_time
+
+            special_ids = torch.tensor([self.tokenizer.pad_token_id, self.tokenizer.eos_token_id],
+                                       device=output_ids.device)
+            self.generated_tokens += int((~torch.isin(output_ids, special_ids)).sum())
+
+            for i, translation in zip(indices, self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)):
+                translations[i] = translation.replace("Ä ", "Ä").replace("Ü ", "Ü").replace("Ö ", "Ö").strip()
+
+        return translations
+
+    def log_stats(self) -> None:
+        tokens_per_second = self.generated_tokens / self.generation_time if self.generation_time else 0.0
+        logger.info(f"Decoding planner generated {self.generated_tokens} tokens in {self.generation_time:.1f}s, "
+                    f"{tokens_per_second:.0f} tokens/s.")
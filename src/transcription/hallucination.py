@@ -0,0 +1,86 @@
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from src.utils.logger import get_logger
+
+REPETITION_NGRAM = 2
+MIN_NGRAMS = 5  # shorter transcripts like "Ja, ja, ja." are legitimate repetitions
+MAX_REPETITION_RATIO = 0.4  # share of word bigrams repeating an earlier bigram of the transcript
+MAX_COMPRESSION_RATIO = 2.4  # same threshold as whisper's compression_ratio_threshold
+MAX_CHARS_PER_SECOND = 25.0
+# transcripts whisper produces for silence or music, learnt from subtitles of its training data
+KNOWN_HALLUCINATIONS = (
+    r"untertitel(?:ung)? (?:im auftrag )?(?:des|der|von)",
+    r"vielen dank f(?:ü|u)rs zuschauen",
+    r"copyright (?:wdr|ndr|swr|zdf|ard)",
+)
+
+REASON_REPETITION = "repetition"
+REASON_COMPRESSION = "compression_ratio"
+REASON_CHARS_PER_SECOND = "chars_per_second"
+REASON_KNOWN_HALLUCINATION = "known_hallucination"
+
+_WORD_PATTERN = re.compile(r"\w+")
+_KNOWN_HALLUCINATION_PATTERN = "|".join(f"(?:{pattern})" for pattern in KNOWN_HALLUCINATIONS)
+
+logger = get_logger(__name__)
+
+
+def _repetition_ratio(text: str) -> float:
+    words = _WORD_PATTERN.findall(text.lower())
+    ngrams = list(zip(*(words[i:] for i in range(REPETITION_NGRAM))))
+    if len(ngrams) < MIN_NGRAMS:
+        return 0.0
+    return 1 - len(set(ngrams)) / len(ngrams)
+
+
+def _compression_ratio(text: str) -> float:
+    text_bytes = text.encode("utf-8")
+    return len(text_bytes) / len(zlib.compress(text_bytes)) if text_bytes else 0.0
+
+
+def score_transcripts(texts: list[str], durations: list[float] | np.ndarray) -> pd.DataFrame:
+    """
+    Scores all transcripts in one pass: word bigram repetition ratio, zlib compression ratio, characters per second of
+    audio and known whisper hallucinations. The string statistics are computed per text, thresholds and reasons on
+    whole columns.
+    :param texts: German transcripts
+    :param durations: Durations of the audio in seconds
+    :return: One row per transcript with the scores, "suspect" and the first "reason" it is suspect for
+    """
+    scores = pd.DataFrame({"text": pd.Series(texts, dtype=object).fillna("").str.strip(),
+                           "duration": np.asarray(durations, dtype=float)})
+    scores["repetition"] = [_repetition_ratio(text) for text in scores["text"]]
+    scores["compression_ratio"] = [_compression_ratio(text) for text in scores["text"]]
+    scores["chars_per_second"] = scores["text"].str.len() / scores["duration"].where(scores["duration"] > 0)
+    scores["known_hallucination"] = scores["text"].str.contains(_KNOWN_HALLUCINATION_PATTERN, case=False, regex=True)
+
+    conditions = [
+        scores["repetition"] > MAX_REPETITION_RATIO,
+        scores["compression_ratio"] > MAX_COMPRESSION_RATIO,
+        scores["chars_per_second"].fillna(0.0) > MAX_CHARS_PER_SECOND,
+        scores["known_hallucination"],
+    ]
+    reasons = [REASON_REPETITION, REASON_COMPRESSION, REASON_CHARS_PER_SECOND, REASON_KNOWN_HALLUCINATION]
+    scores["reason"] = np.select(conditions, reasons, default="")
+    scores["suspect"] = scores["reason"] != ""
+    return scores
+
+
+def flag_hallucinations(texts: list[str], durations: list[float] | np.ndarray) -> np.ndarray:
+    """:return: Boolean mask of the transcripts suspected to be hallucinated or garbage"""
+    if len(texts) == 0:
+        return np.zeros(0, dtype=bool)
+    return score_transcripts(texts, durations)["suspect"].to_numpy()
+
+
+def log_suspect_transcripts(scores: pd.DataFrame, names: list[str]) -> None:
+    suspects = scores[scores["suspect"]]
+    for i, row in suspects.iterrows():
+        logger.warning(f"SUSPECT GERMAN TRANSCRIPT ({row['reason']}) FOR {names[i]}: {row['text']}")
+    if len(suspects):
+        logger.info(f"{len(suspects)} of {len(scores)} transcripts suspect: "
+                    f"{suspects['reason'].value_counts().to_dict()}")
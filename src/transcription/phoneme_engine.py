@@ -0,0 +1,104 @@
+import numpy as np
+import torch
+from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+
+from src.transcription.utils import setup_gpu_device
+from src.utils.logger import get_logger
+
+ENGINE_BATCH_SIZE = 32
+NORMALIZE_EPSILON = 1e-7  # same as Wav2Vec2FeatureExtractor.zero_mean_unit_var_norm
+
+logger = get_logger(__name__)
+
+
+class PhonemeEngine:
+    """
+    Batched greedy CTC transcription with a wav2vec2 phoneme model, without the overhead of the HF pipeline: every
+    batch is sorted by duration, normalized and padded once, run in a single forward pass and decoded greedily on the
+    device. Results have the format of the pipeline ({"text": ...}) so they can be used in its place.
+
+        engine = PhonemeEngine(MODEL_AUDIO_PHONEME)
+        results = engine.transcribe(audio_batch)
+    """
+
+    def __init__(self, model_id: str, batch_size: int = ENGINE_BATCH_SIZE):
+        self.device, self.torch_dtype = setup_gpu_device()
+        self.batch_size = batch_size
+        self.processor = Wav2Vec2Processor.from_pretrained(model_id)
+        self.model = Wav2Vec2ForCTC.from_pretrained(model_id, torch_dtype=self.torch_dtype).to(self.device).eval()
+        self.blank_id = self.processor.tokenizer.pad_token_id
+
+    def _prepare_batch(self, audio_batch: list[np.ndarray]) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        lengths = torch.tensor([len(audio) for audio in audio_batch], device=self.device)
+        input_values = torch.zeros((len(audio_batch), int(lengths.max())), dtype=torch.float32, device=self.device)
+        for i, audio in enumerate(audio_batch):
+            input_values[i, :len(audio)] = torch.from_numpy(np.asarray(audio, dtype=np.float32)).to(self.device)
+
+        attention_mask = torch.arange(input_values.shape[1], device=self.device)[None, :] < lengths[:, None]
+        if self.processor.feature_extractor.do_normalize:
+            # zero mean unit variance per utterance over its unpadded values, padding stays 0
+            mean = input_values.sum(dim=1) / lengths
+            centered = (input_values - mean[:, None]) * attention_mask
+            var = (centered ** 2).sum(dim=1) / lengths
+            input_values = centered / torch.sqrt(var[:, None] + NORMALIZE_EPSILON)
+
+        return input_values.to(self.torch_dtype), attention_mask.long(), lengths
+
+    def _transcribe_batch(self, audio_batch: list[np.ndarray], return_confidences: bool,
+                          suppress_blank_below: float | None) -> list[dict]:
+        input_values, attention_mask, lengths = self._prepare_batch(audio_batch)
+        with torch.inference_mode():
+            uses_mask = self.processor.feature_extractor.return_attention_mask
+            logits = self.model(input_values, attention_mask=attention_mask if uses_mask else None).logits
+            probs = logits.float().softmax(dim=-1)
+            confidences, ids = probs.max(dim=-1)
+
+            if suppress_blank_below is not None:
+                # frames whose blank probability is below the threshold emit their most likely non-blank token
+                non_blank_probs = probs.clone()
+                non_blank_probs[..., self.blank_id] = -1.0
+                non_blank_confidences, non_blank_ids = non_blank_probs.max(dim=-1)
+                suppress = (ids == self.blank_id) & (probs[..., self.blank_id] < suppress_blank_below)
+                ids = torch.where(suppress, non_blank_ids, ids)
+                confidences = torch.where(suppress, non_blank_confidences, confidences)
+
+            # greedy CTC: collapse repeated ids, then drop blanks and the frames of padding
+            num_frames = self.model._get_feat_extract_output_lengths(lengths)
+            valid = torch.arange(ids.shape[1], device=ids.device)[None, :] < num_frames[:, None]
+            changed = torch.ones_like(ids, dtype=torch.bool)
+            changed[:, 1:] = ids[:, 1:] != ids[:, :-1]
+            keep = changed & (ids != self.blank_id) & valid
+
+        ids, keep, confidences, num_frames = ids.cpu(), keep.cpu(), confidences.cpu(), num_frames.cpu()
+        texts = self.processor.tokenizer.batch_decode([ids[i][keep[i]].tolist() for i in range(len(audio_batch))],
+                                                      group_tokens=False, skip_special_tokens=True)
+
+        results = []
+        for i, text in enumerate(texts):
+            result = {"text": text}
+            if return_confidences:
+                emitted = confidences[i][keep[i]]
+                result["frame_confidences"] = confidences[i, :num_frames[i]].numpy()
+                result["confidence"] = float(emitted.mean()) if len(emitted) else 0.0
+            results.append(result)
+        return results
+
+    def transcribe(self, audio_batch: list[np.ndarray], return_confidences: bool = False,
+                   suppress_blank_below: float | None = None) -> list[dict]:
+        """
+        :param audio_batch: Audio at 16kHz
+        :param return_confidences: Add the per-frame probability of the chosen token ("frame_confidences") and the
+        mean probability of the emitted tokens ("confidence") to the results
+        :param suppress_blank_below: Emit the best non-blank token in frames whose blank probability is below this
+        threshold, recovers phonemes of samples for which greedy decoding only yields blanks
+        :return: One result per audio in the order of audio_batch
+        """
+        order = sorted(range(len(audio_batch)), key=lambda i: len(audio_batch[i]), reverse=True)
+        results = [None] * len(audio_batch)
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            batch_results = self._transcribe_batch([audio_batch[i] for i in indices], return_confidences,
+                                                   suppress_blank_below)
+            for i, result in zip(indices, batch_results):
+                results[i] = result
+        return results
@@ -2,11 +2,13 @@ import os
 import shutil
 
 import h5py
-from transformers import Pipeline, Wav2Vec2Processor, pipeline, Wav2Vec2ForCTC
 
-from src.transcription.utils import setup_gpu_device, load_meta_data, get_metadata_path, get_h5_file, write_meta_data, \
+from src.transcription.batch_executor import BatchExecutor, get_quarantine_path
+from src.transcription.phoneme_engine import PhonemeEngine
+from src.transcription.utils import load_meta_data, get_metadata_path, get_h5_file, write_meta_data, \
     META_WRITE_ITERATIONS
 from src.utils.data_points import DatasetDataPoint
+from src.utils.inference_cache import InferenceCache, get_model_key
 from src.utils.logger import get_logger
 from src.utils.paths import SCRATCH_PATH, TTS_PODCASTS_PATH
 
@@ -16,26 +18,15 @@ HF_ACCESS_TOKEN = os.getenv("HF_ACCESS_TOKEN")
 
 MISSING_PHONEME = "NO_PHONEME"
 BATCH_SIZE = 32
+ENGINE_DECODING = "greedy_ctc_skip_special"  # part of the cache key, the engine is not bit identical to the pipeline
+# fix_missing_phoneme: blank probabilities below which a frame emits its best phoneme, one retry per threshold, and
+# the minimal mean confidence of the emitted phonemes, below it the sample is considered to contain no usable speech
+BLANK_SUPPRESSION_THRESHOLDS = (0.9, 0.99)
+MIN_PHONEME_CONFIDENCE = 0.3
 
 logger = get_logger(__name__)
 
 
-def setup_phoneme_model() -> Pipeline:
-    device, torch_dtype = setup_gpu_device()
-
-    processor = Wav2Vec2Processor.from_pretrained(MODEL_AUDIO_PHONEME)
-    model = Wav2Vec2ForCTC.from_pretrained(MODEL_AUDIO_PHONEME)
-
-    return pipeline(
-        "automatic-speech-recognition",
-        model=model,
-        tokenizer=processor.tokenizer,
-        feature_extractor=processor.feature_extractor,
-        torch_dtype=torch_dtype,
-        device=device
-    )
-
-
 def save_phoneme_results(results: list, samples_to_iterate: list[DatasetDataPoint], start_idx: int,
                          write_to_hdf5: bool, h5: h5py.File) -> list[DatasetDataPoint]:
     for idx, result in enumerate(results):
@@ -75,17 +66,18 @@ def audio_to_phoneme(podcast: str, write_to_hdf5: bool = True, overwrite_existin
     else:
         h5_file = get_h5_file(podcast)
 
-    pipe = setup_phoneme_model()
+    engine = PhonemeEngine(MODEL_AUDIO_PHONEME, BATCH_SIZE)
+    cache = InferenceCache(get_model_key(MODEL_AUDIO_PHONEME, decoding=ENGINE_DECODING))
 
-    with h5py.File(h5_file, "r+" if write_to_hdf5 else "r") as h5:
+    with h5py.File(h5_file, "r+" if write_to_hdf5 else "r") as h5, cache:
         iteration_count = 0
         for start_idx in range(0, num_samples, BATCH_SIZE):
             end_idx = min(start_idx + BATCH_SIZE, num_samples)
             # Load batch of audio data
             audio_batch = [h5[samples_to_iterate[i].sample_name][:] for i in range(start_idx, end_idx)]
 
-            # Run phoneme transcription
-            results = pipe(audio_batch, batch_size=BATCH_SIZE)
+            # Run phoneme transcription, samples transcribed before in any hdf5 are taken from the cache
+            results = cache.run(audio_batch, engine.transcribe)
 
             # Save results to collection
             samples_to_iterate = save_phoneme_results(results, samples_to_iterate, start_idx, write_to_hdf5, h5)
@@ -94,10 +86,11 @@ def audio_to_phoneme(podcast: str, write_to_hdf5: bool = True, overwrite_existin
 
             # Save progress of transcription in case of failure
             if iteration_count >= META_WRITE_ITERATIONS:
-                write_meta_data(podcast, meta_data)
+                write_meta_data(podcast, meta_data, register=False)
                 iteration_count = 0
 
     write_meta_data(podcast, meta_data)
+    cache.log_stats()
 
     if write_to_hdf5 and copy_from_projects:
         shutil.copy2(os.path.join(SCRATCH_PATH, f"{podcast}.hdf5"), TTS_PODCASTS_PATH)
@@ -106,43 +99,53 @@ def audio_to_phoneme(podcast: str, write_to_hdf5: bool = True, overwrite_existin
 def fix_missing_phoneme(podcast: str, write_to_hdf5: bool = True) -> None:
     """
     Sometimes the chosen phoneme transcription model does not generate a phoneme sequence for the sample and returns
-    an empty string. This method will attempt to re-transcribe the samples.
+    an empty string, greedy decoding then only found blanks. Instead of retrying blindly, the samples are decoded
+    again in batches with their frame confidences: frames where blank wins with a probability below the thresholds of
+    BLANK_SUPPRESSION_THRESHOLDS emit their most likely phoneme. Samples whose phonemes stay empty or have a mean
+    confidence below MIN_PHONEME_CONFIDENCE keep MISSING_PHONEME and are quarantined, as are samples which raise.
 
     :param podcast: Podcast name where samples to be re-transcribed
     :param write_to_hdf5: Write the phonemes to h5 file attribute
     :return:
     """
     meta_data, _ = load_meta_data(get_metadata_path(podcast))
-    pipe = setup_phoneme_model()
-    if len(get_missing_transcriptions(meta_data)) == 0:
+    missing_samples = get_missing_transcriptions(meta_data)
+    if len(missing_samples) == 0:
         logger.info("No missing phoneme transcription found.")
         return
 
     logger.info(f"\nAttempting to transcribe samples missing phoneme transcription for podcast {podcast}.\n")
+    engine = PhonemeEngine(MODEL_AUDIO_PHONEME, BATCH_SIZE)
+    executor = BatchExecutor("phoneme", get_quarantine_path(podcast))
 
     h5_file = get_h5_file(podcast)
     with h5py.File(h5_file, "r+" if write_to_hdf5 else "r") as h5:
-        for segment in meta_data:
-            if segment.phoneme != MISSING_PHONEME:
-                continue
+        def get_attempt(threshold: float):
+            return lambda batch: engine.transcribe([h5[segment.sample_name][:] for segment in batch],
+                                                   return_confidences=True, suppress_blank_below=threshold)
 
-            result = pipe(h5[segment.sample_name][:])
-            phoneme = result["text"].strip()
+        def accept(_, result: dict) -> bool:
+            return result["text"].strip() != "" and result["confidence"] >= MIN_PHONEME_CONFIDENCE
+
+        results = executor.run_with_retries(missing_samples, [get_attempt(t) for t in BLANK_SUPPRESSION_THRESHOLDS],
+                                            accept, BATCH_SIZE, get_name=lambda segment: segment.sample_name)
 
-            if phoneme == "":
-                logger.error(f"AGAIN NO PHONEME TRANSCRIPT GENERATED FOR {segment.sample_name}.")
+        for segment, result in zip(missing_samples, results):
+            if result is None:
                 continue
 
+            phoneme = result["text"].strip()
             if write_to_hdf5:
                 h5[segment.sample_name].attrs["phoneme"] = phoneme
 
             segment.phoneme = phoneme
-            logger.info(f"NAME: {segment.sample_name}, PHON: {phoneme}")
+            logger.info(f"NAME: {segment.sample_name}, PHON: {phoneme}, CONFIDENCE: {result['confidence']:.2f}")
 
-    if write_to_hdf5:
-        h5.flush()
+        if write_to_hdf5:
+            h5.flush()
 
     write_meta_data(podcast, meta_data)
+    executor.log_stats()
 
 
 def get_missing_transcriptions(meta_data: list[DatasetDataPoint]) -> list:
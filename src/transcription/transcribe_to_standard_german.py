@@ -1,17 +1,30 @@
 import os
+import time
 
 import h5py
 from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
 
+from src.transcription.batch_executor import BatchExecutor, get_quarantine_path
+from src.transcription.confidence_gate import gate_samples
+from src.transcription.hallucination import flag_hallucinations, log_suspect_transcripts, score_transcripts
 from src.transcription.utils import setup_gpu_device, get_h5_file, load_meta_data, get_metadata_path, \
     META_WRITE_ITERATIONS, write_meta_data, MISSING_TEXT
 from src.utils.data_points import DatasetDataPoint
+from src.utils.inference_cache import InferenceCache, get_model_key
+from src.utils.audio import SAMPLING_RATE
 from src.utils.logger import get_logger
 
 HF_ACCESS_TOKEN = os.getenv("HF_ACCESS_TOKEN")
 
 MODEL_WHISPER_v3 = "openai/whisper-large-v3"
 BATCH_SIZE = 32
+GENERATE_KWARGS = {"language": "german"}
+# decoding settings tried in order by fix_long_german_segments, the default settings already failed for these samples
+RETRY_GENERATE_KWARGS = (
+    {**GENERATE_KWARGS, "num_beams": 5, "repetition_penalty": 1.3},
+    {**GENERATE_KWARGS, "num_beams": 5, "no_repeat_ngram_size": 4},
+)
+MAX_DE_TEXT_LENGTH = 390  # longer transcripts of segments of at most 15s are repetitions
 
 logger = get_logger(__name__)
 
@@ -34,17 +47,27 @@ def setup_german_transcription_model():
         feature_extractor=processor.feature_extractor,
         torch_dtype=torch_dtype,
         device=device,
-        generate_kwargs={"language": "german"}
+        generate_kwargs=GENERATE_KWARGS
     )
 
 
 def save_de_transcribe_results(results: list, samples_to_iterate: list[DatasetDataPoint], start_idx: int,
                                write_to_hdf5: bool, h5: h5py.File) -> list[DatasetDataPoint]:
+    """
+    Saves the transcripts of a batch. Empty transcripts and those the hallucination scorer flags are saved as
+    MISSING_TEXT, so they are re-transcribed by fix_long_german_segments and skipped by the later stages.
+    """
+    batch_samples = samples_to_iterate[start_idx:start_idx + len(results)]
+    scores = score_transcripts([result["text"] for result in results], [sample.duration for sample in batch_samples])
+    log_suspect_transcripts(scores, [sample.sample_name for sample in batch_samples])
+
     for idx, result in enumerate(results):
         text = result["text"].strip()
         if text == "" or text == "...":
             logger.error(f"NO GERMAN TRANSCRIPT GENERATED FOR {samples_to_iterate[start_idx + idx].sample_name}")
             text = MISSING_TEXT
+        elif scores["suspect"].iat[idx]:
+            text = MISSING_TEXT
 
         if write_to_hdf5:
             h5[samples_to_iterate[start_idx + idx].sample_name].attrs["de_text"] = text
@@ -58,8 +81,13 @@ def save_de_transcribe_results(results: list, samples_to_iterate: list[DatasetDa
     return samples_to_iterate
 
 
-def transcribe_audio_to_german(podcast: str, write_to_hdf5: bool = True,
-                               overwrite_existing_samples: bool = True) -> None:
+def transcribe_audio_to_german(podcast: str, write_to_hdf5: bool = True, overwrite_existing_samples: bool = True,
+                               selective: bool = False) -> None:
+    """
+    Transcribes the samples of a podcast with Whisper.
+    :param selective: Keep the whisperx transcript of diarization for segments passing the confidence gate and only
+    re-transcribe low confidence, cut or repetitive segments
+    """
     # You seem to be using the pipelines sequentially on GPU. In order to maximize efficiency please use a dataset
     logger.info("Transcribing to WAV to German")
     meta_data, num_samples = load_meta_data(get_metadata_path(podcast))
@@ -70,11 +98,33 @@ def transcribe_audio_to_german(podcast: str, write_to_hdf5: bool = True,
         samples_to_iterate = [sample for sample in meta_data if sample.de_text == ""]
         num_samples = len(samples_to_iterate)
 
+    accepted = []
+    if selective:
+        accepted, samples_to_iterate, _ = gate_samples(podcast, samples_to_iterate)
+        num_samples = len(samples_to_iterate)
+
     h5_file = get_h5_file(podcast)
     pipe = setup_german_transcription_model()
+    cache = InferenceCache(get_model_key(MODEL_WHISPER_v3, **GENERATE_KWARGS))
+
+    with h5py.File(h5_file, "r+" if write_to_hdf5 else "r") as h5, cache:
+        if write_to_hdf5:
+            for sample in accepted:
+                h5[sample.sample_name].attrs["de_text"] = sample.de_text
 
-    with h5py.File(h5_file, "r+" if write_to_hdf5 else "r") as h5:
         iteration_count = 0
+        # only cache misses run through whisper, the real time factor is measured on them alone
+        transcription_time = 0.0
+        whisper_audio = 0.0
+
+        def transcribe_misses(batch: list) -> list:
+            nonlocal transcription_time, whisper_audio
+            start_time = time.perf_counter()
+            batch_results = pipe(batch, batch_size=BATCH_SIZE)
+            transcription_time += time.perf_counter() - start_time
+            whisper_audio += sum(len(audio) for audio in batch) / SAMPLING_RATE
+            return batch_results
+
         for start_idx in range(0, num_samples, BATCH_SIZE):
             # Define the batch range
             end_idx = min(start_idx + BATCH_SIZE, num_samples)
@@ -83,7 +133,7 @@ def transcribe_audio_to_german(podcast: str, write_to_hdf5: bool = True,
             audio_batch = [h5[samples_to_iterate[i].sample_name][:] for i in range(start_idx, end_idx)]
 
             # Perform transcription
-            results = pipe(audio_batch, batch_size=BATCH_SIZE)
+            results = cache.run(audio_batch, transcribe_misses)
 
             # Save results to collection
             samples_to_iterate = save_de_transcribe_results(results, samples_to_iterate, start_idx, write_to_hdf5, h5)
@@ -92,50 +142,84 @@ def transcribe_audio_to_german(podcast: str, write_to_hdf5: bool = True,
 
             # Save progress of transcription in case of failure
             if iteration_count >= META_WRITE_ITERATIONS:
-                write_meta_data(podcast, meta_data)
+                write_meta_data(podcast, meta_data, register=False)
                 iteration_count = 0
 
     write_meta_data(podcast, meta_data)
+    cache.log_stats()
+    if selective:
+        _report_saved_gpu_time(whisper_audio, accepted, transcription_time)
+
+
+def _report_saved_gpu_time(transcribed_audio: float, accepted: list[DatasetDataPoint],
+                           transcription_time: float) -> None:
+    """
+    Estimates the GPU time of the skipped samples from the measured real time factor of whisper.
+    :param transcribed_audio: Seconds of audio whisper transcribed, without cache hits
+    :param transcription_time: Seconds whisper took for them
+    """
+    accepted_audio = sum(sample.duration for sample in accepted)
+    if transcribed_audio > 0:
+        saved = accepted_audio * transcription_time / transcribed_audio
+        saved_text = f"~{saved:.0f} GPU-seconds saved"
+    else:
+        saved_text = "no samples transcribed to estimate the saved GPU time from"
+
+    logger.info(f"Selective transcription: {transcription_time:.0f}s of Whisper for {transcribed_audio / 3600:.2f}h "
+                f"of audio, {accepted_audio / 3600:.2f}h of audio kept the whisperx transcript, {saved_text}.")
 
 
 def fix_long_german_segments(podcast: str, write_to_hdf5: bool = True):
     """
     Sometimes whisper returns very random de-texts, containing only repetitions of the same world like "erst, erst, erst,
-    erst, erst,..." etc. These segments are detected (generally len of > 390 characters) and re-run through whisper. Let
-    them purposefully run through without batching
+    erst, erst,..." etc. These segments are detected (generally len of > MAX_DE_TEXT_LENGTH characters) and re-run
+    through whisper in batches with the settings of RETRY_GENERATE_KWARGS which use beam search and penalize
+    repetitions. Samples raising or still erroneous after all attempts are quarantined.
     :return:
     """
     meta_data, _ = load_meta_data(get_metadata_path(podcast))
-    pipe = setup_german_transcription_model()
     long_segments = get_missing_transcriptions(meta_data)
     if len(long_segments) == 0:
-        logger.info("No missing phoneme transcription found.")
+        logger.info("No missing German transcription found.")
         return
 
     logger.info(f"\nAttempting to transcribe samples missing German transcription for podcast {podcast}.\n")
+    pipe = setup_german_transcription_model()
+    executor = BatchExecutor("german", get_quarantine_path(podcast))
 
     h5_file = get_h5_file(podcast)
     with h5py.File(h5_file, "r+" if write_to_hdf5 else "r") as h5:
-        for segment in long_segments:
+        def get_attempt(generate_kwargs: dict):
+            return lambda batch: pipe([h5[segment.sample_name][:] for segment in batch], batch_size=BATCH_SIZE,
+                                      generate_kwargs=generate_kwargs)
 
-            result = pipe(h5[segment.sample_name][:])
+        def accept(segment: DatasetDataPoint, result: dict) -> bool:
             text = result["text"].strip()
+            return text not in ["", "..."] and len(text) <= MAX_DE_TEXT_LENGTH and \
+                not flag_hallucinations([text], [segment.duration])[0]
+
+        results = executor.run_with_retries(long_segments, [get_attempt(kwargs) for kwargs in RETRY_GENERATE_KWARGS],
+                                            accept, BATCH_SIZE, get_name=lambda segment: segment.sample_name)
 
-            if len(text) > 390 or text == "...":
-                logger.error(f"AGAIN NO OR ERRONEOUS GERMAN TRANSCRIPT GENERATED FOR {segment.sample_name}")
+        for segment, result in zip(long_segments, results):
+            if result is None:
                 continue
 
+            text = result["text"].strip()
             if write_to_hdf5:
                 h5[segment.sample_name].attrs["de_text"] = text
 
             segment.de_text = text
             logger.info(f"NAME: {segment.sample_name}, DE-TXT: {text}")
 
-    if write_to_hdf5:
-        h5.flush()
+        if write_to_hdf5:
+            h5.flush()
 
     write_meta_data(podcast, meta_data)
+    executor.log_stats()
 
 
 def get_missing_transcriptions(meta_data: list[DatasetDataPoint]) -> list:
-    return [entry for entry in meta_data if len(entry.de_text) > 390 or entry.de_text in [MISSING_TEXT, "..."]]
+    suspect = flag_hallucinations([entry.de_text for entry in meta_data], [entry.duration for entry in meta_data])
+    return [entry for entry, is_suspect in zip(meta_data, suspect)
+            if is_suspect or len(entry.de_text) > MAX_DE_TEXT_LENGTH or entry.de_text in [MISSING_TEXT, "..."]]
@@ -1,32 +1,77 @@
+import hashlib
 import os
+import unicodedata
 
 import h5py
 import torch
 from transformers import T5Tokenizer, PreTrainedModel, T5ForConditionalGeneration
 
+from src.transcription.cpu_backend import BACKEND_CPU_INT8, BACKEND_GPU, BACKENDS, CPU_BATCH_SIZE, \
+    load_quantized_t5, setup_cpu_threads
+from src.transcription.decoding_planner import DecodingPlanner
 from src.transcription.utils import DIALECT_TO_TAG, MISSING_TEXT, load_meta_data, get_metadata_path, get_h5_file, \
-    setup_gpu_device, META_WRITE_ITERATIONS, write_meta_data
+    setup_gpu_device, META_WRITE_ITERATIONS, write_meta_data, get_checkpoint_id
 from src.utils.data_points import DatasetDataPoint
+from src.utils.inference_cache import InferenceCache, get_model_key
 from src.utils.logger import get_logger
-from src.utils.paths import MODEL_PATH
+from src.utils.paths import MODEL_PATH, PODCAST_AUDIO_FOLDER
 
 HF_ACCESS_TOKEN = os.getenv("HF_ACCESS_TOKEN")
 
 MODEL_PATH_DE_CH = f"{MODEL_PATH}/de_to_ch_large_2"
+CHECKPOINT_PATH_DE_CH = os.path.join(MODEL_PATH_DE_CH, "best-model")
 MODEL_T5_TOKENIZER = "google/t5-v1_1-large"
 BATCH_SIZE = 16
+GENERATION_KWARGS = {"max_length": 400, "num_beams": 5, "num_return_sequences": 1}
+
+# shared by all podcasts, short utterances like "Ja." or "Genau." are only translated once per dialect
+TRANSLATION_MEMO_PATH = os.path.join(PODCAST_AUDIO_FOLDER, "translation_memo.sqlite")
+MEMO_WINDOW_BATCHES = 8  # batches looked up in the memo at once, so the misses still fill complete batches
 
 NO_CH_TEXT = "NO_CH_TEXT"
 
 logger = get_logger(__name__)
 
 
+def normalize_de_text(de_text: str) -> str:
+    return unicodedata.normalize("NFC", " ".join(de_text.split()))
+
+
+def get_ch_de_prompt(sample: DatasetDataPoint) -> str:
+    return f"[{DIALECT_TO_TAG[sample.dialect]}]: {normalize_de_text(sample.de_text)}"
+
+
+def hash_prompt(prompt: str) -> str:
+    return hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def setup_ch_de_model(device: str, backend: str = BACKEND_GPU) -> tuple[T5Tokenizer, PreTrainedModel]:
+    """
+    :param device: Device of the float model, the int8 model always runs on the CPU
+    :param backend: BACKEND_GPU for the float model, BACKEND_CPU_INT8 for the dynamically quantized model
+    """
+    if backend == BACKEND_CPU_INT8:
+        setup_cpu_threads()
+        model = load_quantized_t5(CHECKPOINT_PATH_DE_CH)
+    else:
+        model = T5ForConditionalGeneration.from_pretrained(CHECKPOINT_PATH_DE_CH)
+        model.to(device)
+        model.eval()
+
+    tokenizer = T5Tokenizer.from_pretrained(MODEL_T5_TOKENIZER)
+    tokenizer.add_tokens(["Ä", "Ö", "Ü"])
+    return tokenizer, model
+
+
 def run_ch_de_batch(start_idx: int, batch_size: int, num_samples: int, samples_to_iterate: list[DatasetDataPoint],
                     tokenizer: T5Tokenizer, model: PreTrainedModel, device: str) -> list:
     end_idx = min(start_idx + batch_size, num_samples)
-    batch_texts = [f"[{DIALECT_TO_TAG[samples_to_iterate[i].dialect]}]: {samples_to_iterate[i].de_text}" for i in
-                   range(start_idx, end_idx)]  # Extract batched texts from meta_data
+    batch_texts = [get_ch_de_prompt(samples_to_iterate[i]) for i in range(start_idx, end_idx)]
+    return translate_ch_de_prompts(batch_texts, tokenizer, model, device)
 
+
+def translate_ch_de_prompts(batch_texts: list[str], tokenizer: T5Tokenizer, model: PreTrainedModel,
+                            device: str) -> list:
     # Tokenize the batch of sentences
     inputs = tokenizer(batch_texts, return_tensors="pt", padding=True, truncation=True, max_length=400)
 
@@ -36,8 +81,8 @@ def run_ch_de_batch(start_idx: int, batch_size: int, num_samples: int, samples_t
 
     # Generate translations
     with torch.no_grad():
-        output_ids = model.generate(input_ids=input_ids, max_length=400, attention_mask=attention_mask, num_beams=5,
-                                    num_return_sequences=1, pad_token_id=tokenizer.eos_token_id)
+        output_ids = model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                                    pad_token_id=tokenizer.eos_token_id, **GENERATION_KWARGS)
 
     batch_translations = tokenizer.batch_decode(output_ids, skip_special_tokens=True)
     batch_translations = [x.replace("Ä ", "Ä").replace("Ü ", "Ü").replace("Ö ", "Ö").strip() for x in
@@ -64,15 +109,21 @@ def save_ch_de_results(batch_translations: list, samples_to_iterate: list[Datase
     return samples_to_iterate
 
 
-def transcribe_de_to_ch(podcast: str, write_to_hdf5: bool = True, overwrite_existing_samples: bool = True) -> None:
+def transcribe_de_to_ch(podcast: str, write_to_hdf5: bool = True, overwrite_existing_samples: bool = True,
+                        planned_decoding: bool = False, backend: str = BACKEND_GPU) -> None:
     """
     Instead of directly transcribing audio to CH-DE we chose the approach of first transcribing it to Standard German
     and then translate it to Swiss German.
     :param podcast:
     :param write_to_hdf5:
     :param overwrite_existing_samples:
+    :param planned_decoding: Decode with length buckets, per bucket beams and max_new_tokens instead of 5 beams up to
+    400 tokens for every batch
+    :param backend: BACKEND_GPU runs the float model on the GPU if available, BACKEND_CPU_INT8 the int8 quantized
+    model on the CPU for nodes without GPU
     :return:
     """
+    assert backend in BACKENDS, f"Values for 'backend' must be one of {BACKENDS}"
     logger.info("Transcribing German text to Swiss German text.")
     meta_data, _ = load_meta_data(get_metadata_path(podcast))
     meta_data_non_de = [sample for sample in meta_data if sample.dialect != "Deutschland"]
@@ -85,28 +136,42 @@ def transcribe_de_to_ch(podcast: str, write_to_hdf5: bool = True, overwrite_exis
         num_samples = len(samples_to_iterate)
 
     h5_file = get_h5_file(podcast)
-    device, _ = setup_gpu_device()
+    device = "cpu" if backend == BACKEND_CPU_INT8 else setup_gpu_device()[0]
+    batch_size = CPU_BATCH_SIZE if backend == BACKEND_CPU_INT8 else BATCH_SIZE
 
-    model = T5ForConditionalGeneration.from_pretrained(os.path.join(MODEL_PATH_DE_CH, "best-model"))
-    tokenizer = T5Tokenizer.from_pretrained(MODEL_T5_TOKENIZER)
-    tokenizer.add_tokens(["Ä", "Ö", "Ü"])
+    tokenizer, model = setup_ch_de_model(device, backend)
+    planner = DecodingPlanner(tokenizer, model, device, batch_size) if planned_decoding else None
+
+    def translate(prompts: list[str]) -> list[str]:
+        if planner is not None:
+            return planner.translate(prompts)
+
+        translations = []
+        for batch_start in range(0, len(prompts), batch_size):
+            translations += translate_ch_de_prompts(prompts[batch_start:batch_start + batch_size], tokenizer, model,
+                                                    device)
+        return translations
 
-    model.to(device)
-    model.eval()
+    decoding_params = planner.get_config() if planner is not None else GENERATION_KWARGS
+    memo = InferenceCache(get_model_key(get_checkpoint_id(CHECKPOINT_PATH_DE_CH), tokenizer=MODEL_T5_TOKENIZER,
+                                        backend=backend, **decoding_params), cache_path=TRANSLATION_MEMO_PATH)
+    window_size = batch_size * MEMO_WINDOW_BATCHES
 
-    with h5py.File(h5_file, "r+" if write_to_hdf5 else "r") as h5:
+    with h5py.File(h5_file, "r+" if write_to_hdf5 else "r") as h5, memo:
         iteration_count = 0
-        for start_idx in range(0, num_samples, BATCH_SIZE):
-            batch_translations = run_ch_de_batch(start_idx, BATCH_SIZE, num_samples, samples_to_iterate, tokenizer,
-                                                 model, device)
+        for start_idx in range(0, num_samples, window_size):
+            end_idx = min(start_idx + window_size, num_samples)
+            # identical prompts are translated once, prompts translated before in any podcast come from the memo
+            prompts = [get_ch_de_prompt(samples_to_iterate[i]) for i in range(start_idx, end_idx)]
+            batch_translations = memo.run(prompts, translate, key=hash_prompt)
 
             # Save results to collection
             samples_to_iterate = save_ch_de_results(batch_translations, samples_to_iterate, start_idx, write_to_hdf5,
                                                     h5)
-            iteration_count += 1
+            iteration_count += MEMO_WINDOW_BATCHES
 
             if iteration_count >= META_WRITE_ITERATIONS:
-                write_meta_data(podcast, meta_data)
+                write_meta_data(podcast, meta_data, register=False)
                 iteration_count = 0
 
     for sample in meta_data:
@@ -114,3 +179,6 @@ def transcribe_de_to_ch(podcast: str, write_to_hdf5: bool = True, overwrite_exis
             sample.ch_text = NO_CH_TEXT
 
     write_meta_data(podcast, meta_data)
+    memo.log_stats()
+    if planner is not None:
+        planner.log_stats()
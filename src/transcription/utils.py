@@ -2,6 +2,7 @@ import os
 
 import torch
 
+from src.utils.catalog import register_samples, LOCATION_PODCAST
 from src.utils.data_points import DatasetDataPoint, DialectDataPoint
 from src.utils.logger import get_logger
 from src.utils.paths import PODCAST_AUDIO_FOLDER
@@ -57,16 +58,29 @@ def load_meta_data(meta_data_path: str, load_as_dialect: bool = False) -> tuple[
     return sample_list, length_samples
 
 
-def write_meta_data(podcast: str, meta_data) -> None:
+def write_meta_data(podcast: str, meta_data, register: bool = True) -> None:
+    """
+    :param register: Register the samples in the catalog, periodic progress writes skip it and the final write of a
+    stage registers them once
+    """
     with open(get_metadata_path(podcast), "wt", encoding="utf-8") as f:
         for line in meta_data:
             f.write(line.to_string())
 
+    if register:
+        register_samples(meta_data, get_h5_file(podcast), LOCATION_PODCAST, dataset_name=podcast)
+
 
 def get_h5_file(podcast: str) -> str:
     return os.path.join(PODCAST_AUDIO_FOLDER, f"{podcast}.hdf5")
 
 
+def get_checkpoint_id(checkpoint_path: str) -> str:
+    """Identifies a checkpoint by its path and the last modification of its files, a retrained model is a new key."""
+    files = [os.path.join(checkpoint_path, file) for file in os.listdir(checkpoint_path)]
+    return f"{os.path.abspath(checkpoint_path)}@{max(os.path.getmtime(file) for file in files):.0f}"
+
+
 def setup_gpu_device() -> tuple:
     device = "cuda:0" if torch.cuda.is_available() else "cpu"
     torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
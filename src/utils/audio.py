@@ -0,0 +1,168 @@
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterable, Iterator
+
+import librosa
+import numpy as np
+import soundfile as sf
+import soxr
+
+from src.utils.logger import get_logger
+
+try:
+    import av  # optional, decodes containers libsndfile does not support (m4a, aac, opus in mp4, ...)
+except ImportError:
+    av = None
+
+SAMPLING_RATE = 16000
+STREAM_BLOCK_SIZE = 1 << 16  # frames read and resampled at once
+IN_FLIGHT_PER_WORKER = 2  # decode jobs queued per pool worker, bounds memory if the consumer is slower
+
+logger = get_logger(__name__)
+
+
+def _to_mono(block: np.ndarray) -> np.ndarray:
+    return block.mean(axis=1, dtype=np.float32) if block.ndim == 2 and block.shape[1] > 1 else block.reshape(-1)
+
+
+def _decode_soundfile(path: str, offset: float, duration: float | None) -> np.ndarray:
+    with sf.SoundFile(path) as f:
+        start = int(round(offset * f.samplerate))
+        frames = -1 if duration is None else int(round(duration * f.samplerate))
+        if start:
+            f.seek(start)
+
+        blocks = f.blocks(blocksize=STREAM_BLOCK_SIZE, frames=frames, dtype="float32", always_2d=True)
+        if f.samplerate == SAMPLING_RATE:
+            out = [_to_mono(block) for block in blocks]
+        else:
+            resampler = soxr.ResampleStream(f.samplerate, SAMPLING_RATE, 1, dtype="float32")
+            out = [resampler.resample_chunk(_to_mono(block)) for block in blocks]
+            out.append(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+
+    return np.concatenate(out) if out else np.zeros(0, dtype=np.float32)
+
+
+def _decode_pyav(path: str, offset: float, duration: float | None) -> np.ndarray:
+    resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLING_RATE)
+    out = []
+    num_samples = 0
+    first_sample = None
+    end_sample = None if duration is None else int(round((offset + duration) * SAMPLING_RATE))
+
+    with av.open(path) as container:
+        stream = container.streams.audio[0]
+        if offset > 0:
+            container.seek(int(offset / stream.time_base), stream=stream)
+
+        for frame in container.decode(stream):
+            if first_sample is None and frame.pts is not None:
+                first_sample = int(round(float(frame.pts * stream.time_base) * SAMPLING_RATE))
+            elif first_sample is None:
+                first_sample = 0
+            for resampled in resampler.resample(frame):
+                out.append(resampled.to_ndarray().reshape(-1))
+                num_samples += len(out[-1])
+            if end_sample is not None and first_sample + num_samples >= end_sample:
+                break
+        else:
+            for resampled in resampler.resample(None):
+                out.append(resampled.to_ndarray().reshape(-1))
+
+    audio = np.concatenate(out) if out else np.zeros(0, dtype=np.float32)
+    # seeking lands on the packet before the offset, cut to the exact window
+    start = max(0, int(round(offset * SAMPLING_RATE)) - (first_sample or 0))
+    end = None if end_sample is None else end_sample - (first_sample or 0)
+    return audio[start:end]
+
+
+def decode_audio(path: str, offset: float = 0.0, duration: float | None = None) -> np.ndarray:
+    """
+    Decodes an audio file in process to float32 mono at SAMPLING_RATE. libsndfile (WAV, FLAC, OGG and MP3) is tried
+    first and resampled block by block, PyAV is used for other containers if installed and librosa as last resort.
+    :param path: Audio file
+    :param offset: Start in seconds
+    :param duration: Seconds to decode from offset, None for the rest of the file
+    :return:
+    """
+    try:
+        return _decode_soundfile(path, offset, duration)
+    except sf.LibsndfileError:
+        pass
+
+    if av is not None:
+        try:
+            return _decode_pyav(path, offset, duration)
+        except av.FFmpegError as e:
+            logger.debug(f"PyAV could not decode {path}: {e}")
+
+    speech, _ = librosa.load(path, sr=SAMPLING_RATE, mono=True, offset=offset, duration=duration)
+    return speech.astype(np.float32, copy=False)
+
+
+def get_audio_duration(path: str) -> float:
+    try:
+        return sf.info(path).duration
+    except sf.LibsndfileError:
+        return librosa.get_duration(path=path)
+
+
+def _decode_job(job: tuple) -> np.ndarray:
+    path, offset, duration = job
+    return decode_audio(path, offset, duration)
+
+
+class DecoderPool:
+    """
+    Process pool shared by the importers for parallel decoding. Jobs are submitted lazily and at most
+    IN_FLIGHT_PER_WORKER jobs per worker are pending at once, so decoding a corpus never holds more than a few
+    decoded files in memory. Results are returned in job order.
+
+        with DecoderPool() as pool:
+            for path, audio in pool.imap(paths):
+                ...
+    """
+
+    def __init__(self, num_workers: int | None = None, max_in_flight: int | None = None):
+        num_workers = num_workers or os.cpu_count() or 1
+        self._executor = ProcessPoolExecutor(max_workers=num_workers)
+        self.max_in_flight = max_in_flight or IN_FLIGHT_PER_WORKER * num_workers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def imap(self, jobs: Iterable[str | tuple[str, float, float | None]]) -> Iterator[tuple]:
+        """
+        :param jobs: Paths or (path, offset, duration) tuples
+        :return: Pairs of (job, audio), audio is None if the file could not be decoded
+        """
+        pending: deque[tuple[object, Future]] = deque()
+        jobs = iter(jobs)
+
+        def submit_next() -> bool:
+            job = next(jobs, None)
+            if job is None:
+                return False
+            decode_args = (job, 0.0, None) if isinstance(job, str) else job
+            pending.append((job, self._executor.submit(_decode_job, decode_args)))
+            return True
+
+        while len(pending) < self.max_in_flight and submit_next():
+            pass
+
+        while pending:
+            job, future = pending.popleft()
+            submit_next()
+            try:
+                audio = future.result()
+            except Exception as e:
+                logger.error(f"Could not decode {job}: {type(e).__name__} {e}")
+                audio = None
+            yield job, audio
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
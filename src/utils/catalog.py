@@ -0,0 +1,126 @@
+import os
+import sqlite3
+from contextlib import closing
+
+from src.utils.data_points import DatasetDataPoint, DialectDataPoint
+from src.utils.h5_layout import get_hierarchical_key
+from src.utils.logger import get_logger
+from src.utils.paths import CATALOG_PATH
+
+CATALOG_ENABLED = os.getenv("SWISSGPC_CATALOG", "1") != "0"
+
+LOCATION_PODCAST = "podcast"
+LOCATION_DIALECT = "dialect"
+LOCATION_SUBSET = "subset"
+LOCATION_PACKED = "packed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    file TEXT NOT NULL,
+    key TEXT NOT NULL,
+    location TEXT NOT NULL,
+    sample_name TEXT NOT NULL,
+    dataset_name TEXT,
+    speaker_id TEXT,
+    dialect TEXT,
+    duration REAL,
+    offset INTEGER,
+    length INTEGER,
+    PRIMARY KEY (file, key)
+);
+CREATE INDEX IF NOT EXISTS idx_samples_sample_name ON samples (sample_name);
+CREATE INDEX IF NOT EXISTS idx_samples_speaker ON samples (speaker_id, location, duration);
+CREATE INDEX IF NOT EXISTS idx_samples_dialect ON samples (dialect, location, duration);
+CREATE INDEX IF NOT EXISTS idx_samples_dataset ON samples (location, dataset_name, dialect, duration);
+"""
+
+_UPSERT = """
+INSERT INTO samples (file, key, location, sample_name, dataset_name, speaker_id, dialect, duration, offset, length)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (file, key) DO UPDATE SET
+    location = excluded.location,
+    sample_name = excluded.sample_name,
+    dataset_name = excluded.dataset_name,
+    speaker_id = excluded.speaker_id,
+    dialect = excluded.dialect,
+    duration = excluded.duration,
+    offset = excluded.offset,
+    length = excluded.length
+"""
+
+logger = get_logger(__name__)
+
+
+def connect(catalog_path: str = CATALOG_PATH) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(catalog_path), exist_ok=True)
+    connection = sqlite3.connect(catalog_path, timeout=60)
+    # WAL allows readers while one of the pipeline stages writes
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def register_samples(samples: list[DatasetDataPoint | DialectDataPoint], h5_file: str, location: str,
+                     dataset_name: str = "", offsets: list[int] | None = None, lengths: list[int] | None = None,
+                     catalog_path: str = CATALOG_PATH, hierarchical: bool = False) -> None:
+    """
+    Inserts or updates the catalog rows of samples stored in h5_file. Called incrementally by every stage writing
+    metadata, failures are logged but never interrupt the pipeline as the catalog can always be rebuilt from metadata.
+    :param samples: Datapoints of the samples
+    :param h5_file: hdf5 holding the samples
+    :param location: One of the LOCATION_* constants
+    :param dataset_name: Fallback if the datapoints do not carry a dataset name (podcast metadata)
+    :param offsets: Offsets into the audio array for packed shards
+    :param lengths: Lengths in the audio array for packed shards
+    :param catalog_path: Path to the SQLite catalog
+    :param hierarchical: Whether h5_file has the hierarchical layout, the key is the full path of the sample in the
+    file (/<dataset>/<episode>/<sample>) and the sample name for flat files
+    :return:
+    """
+    if not CATALOG_ENABLED or not samples:
+        return
+
+    h5_file = os.path.abspath(h5_file)
+    rows = [
+        (h5_file, "/" + get_hierarchical_key(sample.sample_name, sample.dataset_name or dataset_name) if hierarchical
+         else sample.sample_name, location, sample.sample_name, sample.dataset_name or dataset_name,
+         sample.speaker_id, sample.dialect, float(sample.duration),
+         int(offsets[i]) if offsets is not None else None, int(lengths[i]) if lengths is not None else None)
+        for i, sample in enumerate(samples)
+    ]
+
+    try:
+        with closing(connect(catalog_path)) as connection, connection:
+            connection.executemany(_UPSERT, rows)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not update sample catalog for {h5_file}: {type(e).__name__} {str(e)}")
+
+
+def remove_file(h5_file: str, catalog_path: str = CATALOG_PATH) -> None:
+    with closing(connect(catalog_path)) as connection, connection:
+        connection.execute("DELETE FROM samples WHERE file = ?", (os.path.abspath(h5_file),))
+
+
+def locate_sample(sample_name: str, catalog_path: str = CATALOG_PATH) -> list[dict]:
+    """:return: Catalog rows of all copies of the sample, h5py.File(row["file"])[row["key"]] is the sample"""
+    with closing(connect(catalog_path)) as connection:
+        connection.row_factory = sqlite3.Row
+        rows = connection.execute("SELECT * FROM samples WHERE sample_name = ?", (sample_name,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def hours_per_dialect_per_dataset(location: str = LOCATION_PODCAST,
+                                  catalog_path: str = CATALOG_PATH) -> list[tuple[str, str, float]]:
+    with closing(connect(catalog_path)) as connection:
+        return connection.execute(
+            "SELECT dataset_name, dialect, SUM(duration) / 3600.0 FROM samples WHERE location = ? AND duration > 0 "
+            "GROUP BY dataset_name, dialect ORDER BY dataset_name, dialect", (location,)).fetchall()
+
+
+def hours_per_speaker(speaker_id: str, location: str = LOCATION_PODCAST, catalog_path: str = CATALOG_PATH) -> float:
+    with closing(connect(catalog_path)) as connection:
+        hours = connection.execute(
+            "SELECT SUM(duration) / 3600.0 FROM samples WHERE speaker_id = ? AND location = ? AND duration > 0",
+            (speaker_id, location)).fetchone()[0]
+    return hours or 0.0
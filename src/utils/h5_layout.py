@@ -0,0 +1,120 @@
+import os
+
+import h5py
+
+LAYOUT_ATTR = "key_layout"
+FLAT_LAYOUT = "flat"  # all samples directly under the root group, <episode>_<1000+i>
+HIERARCHICAL_LAYOUT = "hierarchical"  # <dataset>/<episode>/<episode>_<1000+i>
+UNKNOWN_DATASET = "unknown"
+
+# groups with more links than MAX_COMPACT_LINKS switch from compact storage in the object header to dense storage
+# (fractal heap and v2 B-tree indexed by name hash) and back below MIN_DENSE_LINKS
+MAX_COMPACT_LINKS = 16
+MIN_DENSE_LINKS = 8
+MDC_INITIAL_SIZE = 16 * 1024 ** 2  # metadata cache, the default of 2MB is too small for files with 1M objects
+MDC_MAX_SIZE = 128 * 1024 ** 2
+
+
+def get_episode_name(sample_name: str) -> str:
+    # same rule as orig_episode_name of the data points
+    split_name = sample_name.split("_")
+    return '_'.join(split_name[:-1]) if len(split_name) > 2 else split_name[0]
+
+
+def get_hierarchical_key(sample_name: str, dataset_name: str = "") -> str:
+    return f"{dataset_name or UNKNOWN_DATASET}/{get_episode_name(sample_name)}/{sample_name}"
+
+
+def get_layout(h5: h5py.File) -> str:
+    return h5.file.attrs.get(LAYOUT_ATTR, FLAT_LAYOUT)
+
+
+def _tune_metadata_cache(h5: h5py.File) -> None:
+    config = h5.id.get_mdc_config()
+    config.set_initial_size = True
+    config.initial_size = MDC_INITIAL_SIZE
+    config.max_size = max(config.max_size, MDC_MAX_SIZE)
+    config.min_size = min(config.min_size, MDC_INITIAL_SIZE)
+    h5.id.set_mdc_config(config)
+
+
+def open_h5(path: str, mode: str = "a", hierarchical: bool = False) -> h5py.File:
+    """
+    Opens a sample hdf5 with a metadata cache sized for files with many objects. Files created with hierarchical=True
+    use the latest file format and group samples by dataset and episode, existing files keep the layout they were
+    created with and are opened in the latest format if they are hierarchical.
+    :param path: Path to the hdf5
+    :param mode: h5py file mode
+    :param hierarchical: Layout of newly created files
+    :return:
+    """
+    exists = os.path.exists(path) and mode not in ["w", "w-", "x"]
+    if exists:
+        with h5py.File(path, "r") as h5:
+            hierarchical = get_layout(h5) == HIERARCHICAL_LAYOUT
+
+    h5 = h5py.File(path, mode, libver="latest" if hierarchical else None)
+    _tune_metadata_cache(h5)
+
+    if not exists and hierarchical:
+        h5.attrs[LAYOUT_ATTR] = HIERARCHICAL_LAYOUT
+    return h5
+
+
+def _require_group(parent: h5py.Group, name: str) -> h5py.Group:
+    if name in parent:
+        return parent[name]
+
+    gcpl = h5py.h5p.create(h5py.h5p.GROUP_CREATE)
+    gcpl.set_link_phase_change(MAX_COMPACT_LINKS, MIN_DENSE_LINKS)
+    return h5py.Group(h5py.h5g.create(parent.id, name.encode("utf-8"), gcpl=gcpl))
+
+
+def get_sample_key(h5: h5py.Group, sample_name: str, dataset_name: str = "", create_groups: bool = False) -> str:
+    """
+    Key under which a sample is stored in the given file, the sample name itself for flat files.
+    :param create_groups: Create the dataset and episode groups of hierarchical files if they do not exist yet
+    """
+    if get_layout(h5) != HIERARCHICAL_LAYOUT:
+        return sample_name
+
+    key = get_hierarchical_key(sample_name, dataset_name)
+    if create_groups:
+        dataset_group, episode, _ = key.split("/")
+        _require_group(_require_group(h5.file, dataset_group), episode)
+    return "/" + key
+
+
+def resolve_sample(h5: h5py.Group, sample_name: str, dataset_name: str = "") -> h5py.Dataset | None:
+    """
+    Key resolution shim, returns the sample no matter whether the file is flat or hierarchical. Without the dataset
+    name the dataset groups of a hierarchical file are searched, which costs one lookup per dataset in the file. With
+    the dataset name only its group is looked up.
+    :return: The dataset of the sample or None if the file does not contain it
+    """
+    if get_layout(h5) != HIERARCHICAL_LAYOUT:
+        return h5[sample_name] if sample_name in h5 else None
+
+    episode = get_episode_name(sample_name)
+    root = h5.file
+    candidates = [dataset_name] if dataset_name else list(root.keys())
+
+    for candidate in candidates:
+        if candidate not in root or episode not in root[candidate]:
+            continue
+        episode_group = root[candidate][episode]
+        if sample_name in episode_group:
+            return episode_group[sample_name]
+    return None
+
+
+def contains_sample(h5: h5py.Group, sample_name: str, dataset_name: str = "") -> bool:
+    return resolve_sample(h5, sample_name, dataset_name) is not None
+
+
+def list_sample_names(h5: h5py.File) -> list[str]:
+    if get_layout(h5) != HIERARCHICAL_LAYOUT:
+        return list(h5.keys())
+
+    return [sample_name for dataset_group in h5.values() for episode_group in dataset_group.values()
+            for sample_name in episode_group.keys()]
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+from typing import Callable
+
+import numpy as np
+
+from src.utils.logger import get_logger
+from src.utils.paths import SCRATCH_PATH
+
+INFERENCE_CACHE_ENABLED = os.getenv("SWISSGPC_INFERENCE_CACHE", "1") != "0"
+INFERENCE_CACHE_PATH = os.getenv("SWISSGPC_INFERENCE_CACHE_PATH", os.path.join(SCRATCH_PATH, "inference_cache.sqlite"))
+INFERENCE_CACHE_MAX_BYTES = int(float(os.getenv("SWISSGPC_INFERENCE_CACHE_MAX_GB", "20")) * 1024 ** 3)
+EVICTION_TARGET = 0.9  # share of the maximum size the cache is evicted down to, avoids evicting on every insert
+EVICTION_CHECK_INTERVAL = 64  # inserts between size checks
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    audio_hash TEXT NOT NULL,
+    model_key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (audio_hash, model_key)
+);
+CREATE INDEX IF NOT EXISTS idx_results_last_access ON results (last_access);
+"""
+
+# deletes the least recently used results beyond the given total size
+_EVICT = """
+DELETE FROM results WHERE rowid IN (
+    SELECT rowid FROM (
+        SELECT rowid, SUM(size) OVER (ORDER BY last_access DESC, rowid DESC) AS cumulative_size FROM results
+    ) WHERE cumulative_size > ?
+)
+"""
+
+logger = get_logger(__name__)
+
+
+def hash_audio(audio: np.ndarray) -> str:
+    """Content hash of the audio values, identical for a sample in the podcast, dialect and subset hdf5s."""
+    audio = np.ascontiguousarray(audio)
+    digest = hashlib.blake2b(audio.dtype.str.encode(), digest_size=16)
+    digest.update(audio.tobytes())
+    return digest.hexdigest()
+
+
+def get_model_key(model_id: str, **params) -> str:
+    return f"{model_id}|{json.dumps(params, sort_keys=True, default=str)}"
+
+
+class InferenceCache:
+    """
+    Persistent cache of inference results on local disk keyed by the hash of the audio and the model with its
+    parameters, so samples copied between hdf5s or re-run with overwrite_existing_samples are not inferred again. The
+    least recently used results are evicted once the cache exceeds max_bytes. Failures of the cache are logged and
+    treated as misses, they never interrupt inference.
+
+        cache = InferenceCache(get_model_key(MODEL_AUDIO_PHONEME))
+        results = cache.run(audio_batch, lambda batch: pipe(batch, batch_size=BATCH_SIZE))
+    """
+
+    def __init__(self, model_key: str, cache_path: str = INFERENCE_CACHE_PATH,
+                 max_bytes: int = INFERENCE_CACHE_MAX_BYTES, enabled: bool = INFERENCE_CACHE_ENABLED):
+        self.model_key = model_key
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0  # duplicates of a miss within a batch, they share the result of the miss
+        self._inserts_since_check = 0
+        self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            self._connection = sqlite3.connect(self.cache_path, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(_SCHEMA)
+        return self._connection
+
+    def _disable(self, e: Exception) -> None:
+        logger.warning(f"Disabling inference cache {self.cache_path}: {type(e).__name__} {str(e)}")
+        self.enabled = False
+
+    def get_many(self, audio_hashes: list[str]) -> dict[str, object]:
+        if not self.enabled or not audio_hashes:
+            return {}
+
+        try:
+            connection = self._connect()
+            placeholders = ",".join("?" * len(audio_hashes))
+            rows = connection.execute(
+                f"SELECT audio_hash, value FROM results WHERE model_key = ? AND audio_hash IN ({placeholders})",
+                (self.model_key, *audio_hashes)).fetchall()
+            with connection:
+                connection.execute(
+                    f"UPDATE results SET last_access = ? WHERE model_key = ? AND audio_hash IN ({placeholders})",
+                    (time.time(), self.model_key, *audio_hashes))
+        except sqlite3.Error as e:
+            self._disable(e)
+            return {}
+
+        return {audio_hash: pickle.loads(value) for audio_hash, value in rows}
+
+    def put_many(self, results: dict[str, object]) -> None:
+        if not self.enabled or not results:
+            return
+
+        now = time.time()
+        rows = []
+        for audio_hash, result in results.items():
+            value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            rows.append((audio_hash, self.model_key, value, len(value), now))
+
+        try:
+            connection = self._connect()
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", rows)
+
+            self._inserts_since_check += len(rows)
+            if self._inserts_since_check >= EVICTION_CHECK_INTERVAL:
+                self._inserts_since_check = 0
+                self.evict()
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def evict(self) -> None:
+        connection = self._connect()
+        total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        with connection:
+            evicted = connection.execute(_EVICT, (int(self.max_bytes * EVICTION_TARGET),)).rowcount
+        logger.info(f"Evicted {evicted} results from inference cache {self.cache_path} of "
+                    f"{total_size / 1024 ** 3:.2f}GB.")
+
+    def run(self, audio_batch: list, infer: Callable[[list], list], key: Callable[[object], str] = hash_audio) -> list:
+        """
+        Returns the results of infer for audio_batch, only inputs not in the cache are passed to infer and each of them
+        only once, duplicates within the batch share the result.
+        :param infer: Runs inference on a list of inputs and returns one result per input in the same order
+        :param key: Content hash of an input, the audio hash by default
+        :return: Results in the order of audio_batch
+        """
+        if not self.enabled:
+            self.misses += len(audio_batch)
+            return list(infer(audio_batch))
+
+        audio_hashes = [key(audio) for audio in audio_batch]
+        cached = self.get_many(list(set(audio_hashes)))
+        num_hits = sum(audio_hash in cached for audio_hash in audio_hashes)
+        self.hits += num_hits
+
+        # first occurrence of every input missing from the cache
+        missing = {}
+        for i, audio_hash in enumerate(audio_hashes):
+            if audio_hash not in cached:
+                missing.setdefault(audio_hash, i)
+        self.misses += len(missing)
+        self.deduplicated += len(audio_hashes) - num_hits - len(missing)
+
+        if missing:
+            inferred = list(infer([audio_batch[i] for i in missing.values()]))
+            new_results = dict(zip(missing.keys(), inferred))
+            self.put_many(new_results)
+            cached.update(new_results)
+
+        return [cached[audio_hash] for audio_hash in audio_hashes]
+
+    def log_stats(self) -> None:
+        total = self.hits + self.misses + self.deduplicated
+        hit_rate = (self.hits + self.deduplicated) / total if total else 0.0
+        logger.info(f"Inference cache for {self.model_key}: {self.hits} hits, {self.deduplicated} duplicates, "
+                    f"{self.misses} misses ({hit_rate:.1%} of inferences avoided).")
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
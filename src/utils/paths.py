@@ -14,3 +14,4 @@ PROJECT_DIR = os.getcwd()
 PODCAST_METADATA_FOLDER = os.path.join(PROJECT_DIR, "src", "download", "metadata")
 PODCAST_AUDIO_FOLDER = os.path.join(PROJECT_DIR, "audio")
 # PODCAST_AUDIO_FOLDER = os.path.join(CLUSTER_PROJECTS_TTS, "audio_raw")
+CATALOG_PATH = os.path.join(PODCAST_AUDIO_FOLDER, "catalog.sqlite")